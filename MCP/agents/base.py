@@ -1,9 +1,14 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterator, List, Optional
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
 from langchain.schema import BaseMessage
 from langchain_community.chat_models import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
+from llm_cache import LLMResponseCache, cache_key
+from rate_limiter import RateLimiter, acall_with_retry, estimate_tokens, retry_policy_from_env, shared_limiter
+from streaming import StreamInterruptedError, emit, is_streaming
 
 class AgentState(BaseModel):
     """エージェントの状態を管理するクラス"""
@@ -12,6 +17,22 @@ class AgentState(BaseModel):
     task_status: str = "pending"
     artifacts: Dict[str, Any] = Field(default_factory=dict)
 
+# 実行中のワークフローごとのエージェント状態（エージェント名 -> AgentState）
+_run_states: ContextVar[Optional[Dict[str, AgentState]]] = ContextVar("agent_run_states", default=None)
+
+@contextmanager
+def agent_state_scope() -> Iterator[Dict[str, AgentState]]:
+    """この中（とここから起動したタスク）で動くエージェントの状態を、他の実行と分けて保持する
+
+    エージェントは複数のワークフロー実行で共有されるため、MCPWorkflowは実行ごとにこのスコープを張る。
+    """
+    states: Dict[str, AgentState] = {}
+    token = _run_states.set(states)
+    try:
+        yield states
+    finally:
+        _run_states.reset(token)
+
 class BaseAgent(ABC):
     """基本エージェントクラス"""
     def __init__(
@@ -19,23 +40,108 @@ class BaseAgent(ABC):
         name: str,
         description: str,
         model: ChatOpenAI,
-        prompt_template: ChatPromptTemplate
+        prompt_template: ChatPromptTemplate,
+        response_cache: Optional[LLMResponseCache] = None,
+        rate_limiter: Optional[RateLimiter] = None
     ):
         self.name = name
         self.description = description
         self.model = model
         self.prompt_template = prompt_template
-        self.state = AgentState()
+        self.response_cache = response_cache
+        # 指定がなければプロセス内の全エージェントで予算を共有する
+        self.rate_limiter = rate_limiter or shared_limiter()
+        self.retry_policy = retry_policy_from_env()
+        self._state = AgentState()
+
+    @property
+    def state(self) -> AgentState:
+        """現在の実行での状態（agent_state_scope の外ではエージェント自身が持つ状態）"""
+        states = _run_states.get()
+        if states is None:
+            return self._state
+        return states.setdefault(self.name, AgentState())
+
+    @state.setter
+    def state(self, value: AgentState):
+        states = _run_states.get()
+        if states is None:
+            self._state = value
+        else:
+            states[self.name] = value
 
     @abstractmethod
     async def process(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
         """入力データを処理し、結果を返す"""
         pass
 
-    async def _generate_response(self, messages: List[BaseMessage]) -> str:
-        """LLMを使用してレスポンスを生成"""
-        response = await self.model.agenerate([messages])
-        return response.generations[0][0].text
+    async def _generate_response(
+        self,
+        messages: List[BaseMessage],
+        bypass_cache: bool = False,
+        refresh_cache: bool = False
+    ) -> str:
+        """LLMを使用してレスポンスを生成（response_cacheがあれば同じプロンプトの応答を再利用）
+
+        ワークフローをストリーミング実行している間は model.astream で生成し、
+        届いたトークンを順次 token イベントとして送る。
+        """
+        streaming = is_streaming()
+        streamed = False
+
+        async def call() -> str:
+            nonlocal streamed
+            if streaming:
+                streamed = True
+                return await self._stream_response(messages)
+            response = await acall_with_retry(
+                lambda: self.model.agenerate([messages]),
+                self._model_name(),
+                self._estimate_tokens(messages),
+                self.rate_limiter,
+                self.retry_policy
+            )
+            return response.generations[0][0].text
+
+        if self.response_cache is None:
+            return await call()
+        key = cache_key(
+            type(self.model).__name__,
+            [(message.type, message.content) for message in messages],
+            getattr(self.model, "_identifying_params", {})
+        )
+        text = await self.response_cache.aget_or_call(key, call, bypass=bypass_cache, refresh=refresh_cache)
+        if streaming and not streamed:
+            # キャッシュから返した応答はまとめて1つのトークンとして送る
+            emit("token", agent=self.name, text=text, cached=True)
+        return text
+
+    async def _stream_response(self, messages: List[BaseMessage]) -> str:
+        """model.astream でトークンを受け取りながら送出し、全文を返す"""
+        chunks: List[str] = []
+
+        async def stream() -> str:
+            chunks.clear()
+            try:
+                async for chunk in self.model.astream(messages):
+                    if chunk.content:
+                        chunks.append(chunk.content)
+                        emit("token", agent=self.name, text=chunk.content)
+            except Exception as e:
+                if chunks:
+                    raise StreamInterruptedError(f"Stream interrupted after {len(chunks)} chunks: {e}") from e
+                raise
+            return "".join(chunks)
+
+        return await acall_with_retry(
+            stream, self._model_name(), self._estimate_tokens(messages), self.rate_limiter, self.retry_policy
+        )
+
+    def _model_name(self) -> str:
+        return getattr(self.model, "model_name", type(self.model).__name__)
+
+    def _estimate_tokens(self, messages: List[BaseMessage]) -> int:
+        return estimate_tokens("".join(str(message.content) for message in messages))
 
     def update_state(self, **kwargs):
         """エージェントの状態を更新"""
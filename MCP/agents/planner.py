@@ -1,5 +1,6 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from .base import BaseAgent
+from llm_cache import LLMResponseCache
 from langchain.prompts import ChatPromptTemplate
 from langchain.schema import HumanMessage, SystemMessage
 
@@ -40,7 +41,7 @@ PLANNER_SYSTEM_PROMPT = """あなたは優秀なプロジェクトプランナ
 class PlannerAgent(BaseAgent):
     """タスクの分析と計画を行うエージェント"""
     
-    def __init__(self, model):
+    def __init__(self, model, response_cache: Optional[LLMResponseCache] = None):
         prompt_template = ChatPromptTemplate.from_messages([
             ("system", PLANNER_SYSTEM_PROMPT),
             ("human", "{input}")
@@ -49,7 +50,8 @@ class PlannerAgent(BaseAgent):
             name="Planner",
             description="タスクの分析と計画を行うエージェント",
             model=model,
-            prompt_template=prompt_template
+            prompt_template=prompt_template,
+            response_cache=response_cache
         )
 
     async def process(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
@@ -61,7 +63,11 @@ class PlannerAgent(BaseAgent):
         ]
         
         # プランの生成
-        response = await self._generate_response(messages)
+        response = await self._generate_response(
+            messages,
+            bypass_cache=input_data.get("bypass_cache", False),
+            refresh_cache=input_data.get("refresh_cache", False)
+        )
         
         # 状態の更新
         self.update_state(
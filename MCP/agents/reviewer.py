@@ -1,5 +1,6 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from .base import BaseAgent
+from llm_cache import LLMResponseCache
 from langchain.prompts import ChatPromptTemplate
 from langchain.schema import HumanMessage, SystemMessage
 
@@ -48,7 +49,7 @@ REVIEWER_SYSTEM_PROMPT = """あなたは優秀なレビューアーです。
 class ReviewerAgent(BaseAgent):
     """成果物のレビューを行うエージェント"""
     
-    def __init__(self, model):
+    def __init__(self, model, response_cache: Optional[LLMResponseCache] = None):
         prompt_template = ChatPromptTemplate.from_messages([
             ("system", REVIEWER_SYSTEM_PROMPT),
             ("human", "{input}")
@@ -57,7 +58,8 @@ class ReviewerAgent(BaseAgent):
             name="Reviewer",
             description="成果物のレビューを行うエージェント",
             model=model,
-            prompt_template=prompt_template
+            prompt_template=prompt_template,
+            response_cache=response_cache
         )
 
     async def process(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
@@ -79,7 +81,11 @@ class ReviewerAgent(BaseAgent):
         ]
         
         # レビューの実行
-        response = await self._generate_response(messages)
+        response = await self._generate_response(
+            messages,
+            bypass_cache=input_data.get("bypass_cache", False),
+            refresh_cache=input_data.get("refresh_cache", False)
+        )
         
         # 状態の更新
         self.update_state(
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional
+from database import DEFAULT_CHECKPOINT_TTL_SECONDS, Database
+
+# 実行開始時に保存するタスク情報のノード名
+RUN_NODE = "__run__"
+
+# 保存時に期限切れの実行を掃除する間隔（秒）
+PRUNE_INTERVAL_SECONDS = 60
+
+class WorkflowCheckpointer(ABC):
+    """ワークフローの途中結果を (実行ID, ノード) ごとに保存する
+
+    並行するノードがそれぞれ自分の結果だけを書くため、互いの保存を上書きしない。
+    削除されるのは成功した実行の分だけなので、失敗・中断した実行の分は ttl_seconds
+    （最後の保存からの秒数、0なら無期限）を過ぎると prune で消える。
+    """
+
+    ttl_seconds: int = 0
+    _last_prune: float = 0.0
+
+    @abstractmethod
+    async def save(self, run_id: str, node: str, data: Dict[str, Any]):
+        pass
+
+    @abstractmethod
+    async def load(self, run_id: str) -> Dict[str, Dict[str, Any]]:
+        """ノード名 -> 保存したデータ。保存がなければ空のdict"""
+        pass
+
+    @abstractmethod
+    async def delete(self, run_id: str):
+        pass
+
+    async def prune(self) -> int:
+        """保持期間を過ぎた実行のチェックポイントを削除し、削除した実行数を返す"""
+        return 0
+
+    async def _prune_if_due(self):
+        """保存のついでに、間隔をあけて prune する"""
+        now = time.monotonic()
+        if not self.ttl_seconds or now - self._last_prune < PRUNE_INTERVAL_SECONDS:
+            return
+        self._last_prune = now
+        await self.prune()
+
+    def close(self):
+        pass
+
+class MemoryCheckpointer(WorkflowCheckpointer):
+    """プロセス内のdictに保存する（テスト・単一プロセス用）"""
+
+    def __init__(self, ttl_seconds: Optional[int] = None):
+        self.ttl_seconds = DEFAULT_CHECKPOINT_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self._runs: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._updated: Dict[str, float] = {}
+
+    async def save(self, run_id: str, node: str, data: Dict[str, Any]):
+        await self._prune_if_due()
+        self._runs.setdefault(run_id, {})[node] = json.loads(json.dumps(data, default=str))
+        self._updated[run_id] = time.time()
+
+    async def load(self, run_id: str) -> Dict[str, Dict[str, Any]]:
+        return {node: dict(data) for node, data in self._runs.get(run_id, {}).items()}
+
+    async def delete(self, run_id: str):
+        self._runs.pop(run_id, None)
+        self._updated.pop(run_id, None)
+
+    async def prune(self) -> int:
+        if not self.ttl_seconds:
+            return 0
+        cutoff = time.time() - self.ttl_seconds
+        expired = [run_id for run_id, updated in self._updated.items() if updated < cutoff]
+        for run_id in expired:
+            await self.delete(run_id)
+        return len(expired)
+
+class SQLiteCheckpointer(WorkflowCheckpointer):
+    """SQLiteに保存する（プロセスを再起動しても再開できる）"""
+
+    def __init__(self, path: str, ttl_seconds: Optional[int] = None):
+        self.path = path
+        self.ttl_seconds = DEFAULT_CHECKPOINT_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS workflow_checkpoints ("
+            "run_id TEXT NOT NULL, node TEXT NOT NULL, data TEXT NOT NULL, updated_at REAL NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (run_id, node))"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(workflow_checkpoints)")]
+        if "updated_at" not in columns:
+            # 以前のスキーマのファイル。既存の行は今から保持期間を数える
+            self._conn.execute("ALTER TABLE workflow_checkpoints ADD COLUMN updated_at REAL NOT NULL DEFAULT 0")
+            self._conn.execute("UPDATE workflow_checkpoints SET updated_at = ?", (time.time(),))
+        self._conn.commit()
+
+    async def save(self, run_id: str, node: str, data: Dict[str, Any]):
+        await self._prune_if_due()
+        payload = json.dumps(data, ensure_ascii=False, default=str)
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT OR REPLACE INTO workflow_checkpoints (run_id, node, data, updated_at) VALUES (?, ?, ?, ?)",
+            (run_id, node, payload, time.time())
+        )
+
+    async def load(self, run_id: str) -> Dict[str, Dict[str, Any]]:
+        rows = await asyncio.to_thread(
+            self._execute, "SELECT node, data FROM workflow_checkpoints WHERE run_id = ?", (run_id,)
+        )
+        return {node: json.loads(data) for node, data in rows}
+
+    async def delete(self, run_id: str):
+        await asyncio.to_thread(self._execute, "DELETE FROM workflow_checkpoints WHERE run_id = ?", (run_id,))
+
+    async def prune(self) -> int:
+        if not self.ttl_seconds:
+            return 0
+        # 実行内で最後に保存した時刻で判定する（長い実行の古いノードだけが消えないように）
+        return await asyncio.to_thread(self._prune_before, time.time() - self.ttl_seconds)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _prune_before(self, cutoff: float) -> int:
+        with self._lock:
+            expired = [row[0] for row in self._conn.execute(
+                "SELECT run_id FROM workflow_checkpoints GROUP BY run_id HAVING MAX(updated_at) < ?", (cutoff,)
+            )]
+            self._conn.executemany("DELETE FROM workflow_checkpoints WHERE run_id = ?", [(run_id,) for run_id in expired])
+            self._conn.commit()
+            return len(expired)
+
+    def _execute(self, sql: str, params: tuple) -> list:
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+            self._conn.commit()
+            return rows
+
+class MongoCheckpointer(WorkflowCheckpointer):
+    """Databaseの workflow_checkpoints コレクションに保存する（期限切れはTTLインデックスで消える）"""
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    async def save(self, run_id: str, node: str, data: Dict[str, Any]):
+        await self.db.save_workflow_checkpoint(run_id, node, data)
+
+    async def load(self, run_id: str) -> Dict[str, Dict[str, Any]]:
+        return await self.db.get_workflow_checkpoints(run_id)
+
+    async def delete(self, run_id: str):
+        await self.db.delete_workflow_checkpoints(run_id)
+
+def checkpointer_from_env(db: Database) -> Optional[WorkflowCheckpointer]:
+    """WORKFLOW_CHECKPOINTER（mongo / sqlite / memory / none）から作る
+
+    既定はnone（保存しない）。永続的なチェックポイントは mongo / sqlite を指定した場合だけ使う。
+    """
+    kind = os.getenv("WORKFLOW_CHECKPOINTER", "none").lower()
+    if kind == "none":
+        return None
+    if kind == "memory":
+        return MemoryCheckpointer()
+    if kind == "sqlite":
+        return SQLiteCheckpointer(os.getenv("WORKFLOW_CHECKPOINT_PATH", "workflow_checkpoints.db"))
+    return MongoCheckpointer(db)
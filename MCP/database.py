@@ -1,13 +1,170 @@
 from motor.motor_asyncio import AsyncIOMotorClient
-from typing import Optional, List, Dict, Any
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import BulkWriteError, OperationFailure
+from pymongo.write_concern import WriteConcern
+from typing import Optional, List, Dict, Any, Tuple, AsyncIterator
+import base64
+import json
 import os
 from datetime import datetime
-from models import Process, SystemPrompt, ProcessLog, ProcessStatus
+from models import Process, SystemPrompt, ProcessLog, ProcessStatus, ProcessType
+from cache import AsyncTTLCache
+from pool_metrics import PoolMetrics
 from bson import ObjectId
 from urllib.parse import quote_plus
 
+# 検索結果の件数（limit=0 はMongoDBの仕様どおり無制限）
+DEFAULT_SEARCH_LIMIT = 50
+MAX_SEARCH_LIMIT = 200
+
+# 一覧取得のページサイズ
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# エクスポート時にカーソルが1回で取得する件数
+EXPORT_BATCH_SIZE = 500
+
+# 明示的に要求されない限り一覧で返さない大きなフィールド
+LARGE_FIELDS = {
+    "processes": ("steps",),
+    "system_prompts": ("content",),
+    "process_logs": ("error_details", "metadata"),
+}
+
+# クエリの形に合わせたインデックス定義（コレクション名 -> IndexModel のリスト）
+INDEXES = {
+    "processes": [
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_at_id"),
+        IndexModel([("type", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING)], name="type_status_created_at"),
+        IndexModel([("status", ASCENDING), ("updated_at", DESCENDING)], name="status_updated_at"),
+        IndexModel(
+            [("name", TEXT), ("description", TEXT)],
+            weights={"name": 10, "description": 5},
+            name="processes_text"
+        ),
+    ],
+    "system_prompts": [
+        IndexModel([("name", ASCENDING)]),
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_at_id"),
+        IndexModel([("category", ASCENDING), ("created_at", DESCENDING)], name="category_created_at"),
+        IndexModel(
+            [("name", TEXT), ("content", TEXT), ("tags", TEXT)],
+            weights={"name": 10, "tags": 5, "content": 1},
+            name="system_prompts_text"
+        ),
+    ],
+    "process_logs": [
+        IndexModel([("process_id", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)], name="process_id_created_at_id"),
+        IndexModel([("process_id", ASCENDING), ("step_number", ASCENDING)], name="process_id_step_number"),
+    ],
+    "workflow_checkpoints": [
+        IndexModel([("run_id", ASCENDING), ("node", ASCENDING)], unique=True, name="run_id_node"),
+    ],
+}
+
+# 存在しないフィールドへのインデックスや、複合インデックスの先頭と重複する旧インデックス
+LEGACY_INDEXES = {
+    "processes": ["process_type_1", "status_1"],
+    "process_logs": ["process_id_1", "timestamp_1"],
+}
+
+# プロセスログのTTLインデックス名
+LOG_TTL_INDEX = "created_at_ttl"
+
+# ワークフローのチェックポイントのTTLインデックス名と既定の保持期間（最後の保存から7日）
+CHECKPOINT_TTL_INDEX = "updated_at_ttl"
+DEFAULT_CHECKPOINT_TTL_SECONDS = int(os.getenv("WORKFLOW_CHECKPOINT_TTL_SECONDS", str(7 * 24 * 60 * 60)))
+
+# 環境変数で指定できるMotorクライアントの接続オプション（オプション名 -> (環境変数名, 型)）
+CLIENT_OPTION_ENV = {
+    "maxPoolSize": ("MONGO_MAX_POOL_SIZE", int),
+    "minPoolSize": ("MONGO_MIN_POOL_SIZE", int),
+    "maxIdleTimeMS": ("MONGO_MAX_IDLE_TIME_MS", int),
+    "waitQueueTimeoutMS": ("MONGO_WAIT_QUEUE_TIMEOUT_MS", int),
+    "serverSelectionTimeoutMS": ("MONGO_SERVER_SELECTION_TIMEOUT_MS", int),
+    "connectTimeoutMS": ("MONGO_CONNECT_TIMEOUT_MS", int),
+    "compressors": ("MONGO_COMPRESSORS", str),  # 例: "zstd,snappy,zlib"（zstdはzstandard、snappyはpython-snappyが必要）
+    "readPreference": ("MONGO_READ_PREFERENCE", str),
+}
+
+def client_options_from_env() -> Dict[str, Any]:
+    """環境変数に設定された接続オプションを集める（未設定はドライバの既定値）"""
+    options = {}
+    for option, (env_name, cast) in CLIENT_OPTION_ENV.items():
+        value = os.getenv(env_name)
+        if value:
+            options[option] = cast(value)
+    return options
+
+def _stringify_id(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """ドキュメントの_id(ObjectId)を文字列に変換"""
+    if "_id" in doc:
+        doc["_id"] = str(doc["_id"])
+    return doc
+
+def _to_model(model_cls, doc: Dict[str, Any]):
+    """MongoDBのドキュメントをモデルに変換（ObjectIdは文字列化）"""
+    return model_cls(**_stringify_id(doc))
+
+def _projection(collection: str, fields: Optional[List[str]], include_large: bool = False) -> Optional[Dict[str, int]]:
+    """射影を組み立てる
+
+    fields を指定した場合はそのフィールドのみ、指定しない場合は
+    include_large でなければ LARGE_FIELDS を除いたフィールドを返す。
+    """
+    if fields:
+        projection = {field: 1 for field in fields}
+        projection["created_at"] = 1
+        return projection
+    if include_large:
+        return None
+    return {field: 0 for field in LARGE_FIELDS[collection]}
+
+def encode_cursor(doc: Dict[str, Any]) -> str:
+    """ページの最終ドキュメントから継続トークンを生成"""
+    payload = {"c": doc["created_at"].isoformat(), "i": str(doc["_id"])}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+def decode_cursor(token: str) -> Tuple[datetime, ObjectId]:
+    """継続トークンを (created_at, _id) に復元"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return datetime.fromisoformat(payload["c"]), ObjectId(payload["i"])
+    except Exception:
+        raise ValueError("Invalid pagination cursor")
+
+def _build_search(query: str, filters: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]], List[Tuple[str, Any]]]:
+    """検索条件・射影・ソート順を組み立てる
+
+    クエリがあればテキストインデックスで絞り込み関連度順に、
+    なければ絞り込み条件のみで新しい順に並べる。
+    """
+    criteria = {key: value for key, value in filters.items() if value is not None}
+    if query:
+        criteria["$text"] = {"$search": query}
+        score = {"$meta": "textScore"}
+        return criteria, {"score": score}, [("score", score)]
+    return criteria, None, [("created_at", DESCENDING)]
+
+class BulkLogWriteError(Exception):
+    """一括保存で一部のログを保存できなかった（保存できた分のIDとインデックスごとのエラーを持つ）"""
+
+    def __init__(self, inserted_ids: List[str], errors: List[Dict[str, Any]]):
+        super().__init__(f"{len(errors)} of the logs could not be saved")
+        self.inserted_ids = inserted_ids
+        self.errors = errors
+
 class Database:
-    def __init__(self, mongodb_uri: str = None):
+    def __init__(
+        self,
+        mongodb_uri: str = None,
+        log_ttl_days: Optional[int] = None,
+        cache_size: Optional[int] = None,
+        cache_ttl: Optional[float] = None,
+        client_options: Optional[Dict[str, Any]] = None,
+        max_time_ms: Optional[int] = None,
+        checkpoint_ttl_seconds: Optional[int] = None
+    ):
         if mongodb_uri:
             self.mongodb_uri = mongodb_uri
         else:
@@ -19,12 +176,38 @@ class Database:
             
             # 認証情報付きのURIを構築
             self.mongodb_uri = f"mongodb://{username}:{password}@{host}:{port}/"
+        # プロセスログの保持日数（未指定なら無期限）
+        if log_ttl_days is None and os.getenv("PROCESS_LOG_TTL_DAYS"):
+            log_ttl_days = int(os.getenv("PROCESS_LOG_TTL_DAYS"))
+        self.log_ttl_days = log_ttl_days
+        # チェックポイントの保持秒数（0なら無期限）
+        self.checkpoint_ttl_seconds = DEFAULT_CHECKPOINT_TTL_SECONDS if checkpoint_ttl_seconds is None else checkpoint_ttl_seconds
+        # get_process / get_system_prompt / get_process_log の読み込みキャッシュ
+        # プロセス内のキャッシュで、無効化されるのはこのプロセスからの書き込みだけ。
+        # 複数のワーカーやインスタンスで動かす場合、他から更新されたドキュメント（ジョブキューの
+        # 状態など）は最大 CACHE_TTL_SECONDS 秒古いまま返る。古い値を許容できなければ
+        # CACHE_TTL_SECONDS=0 でキャッシュを無効にする（同時の読み込みをまとめる動作は残る）
+        self.cache = AsyncTTLCache(
+            max_size=cache_size if cache_size is not None else int(os.getenv("CACHE_MAX_SIZE", "1024")),
+            ttl=cache_ttl if cache_ttl is not None else float(os.getenv("CACHE_TTL_SECONDS", "60"))
+        )
+        # プールサイズなどの接続オプション（引数の指定が環境変数より優先）
+        self.client_options = {**client_options_from_env(), **(client_options or {})}
+        # 読み込みクエリ1回あたりのサーバー側の実行時間上限
+        if max_time_ms is None and os.getenv("MONGO_MAX_TIME_MS"):
+            max_time_ms = int(os.getenv("MONGO_MAX_TIME_MS"))
+        self.max_time_ms = max_time_ms
+        self.pool_metrics = PoolMetrics()
         self.client = None
         self.db = None
 
     async def connect(self):
         try:
-            self.client = AsyncIOMotorClient(self.mongodb_uri)
+            self.client = AsyncIOMotorClient(
+                self.mongodb_uri,
+                event_listeners=[self.pool_metrics],
+                **self.client_options
+            )
             self.db = self.client.mcp
             # 接続テスト
             await self.client.admin.command('ping')
@@ -36,71 +219,315 @@ class Database:
         if self.client:
             self.client.close()
 
+    def stats(self) -> Dict[str, Any]:
+        """接続設定とコネクションプールの利用状況"""
+        return {
+            "client_options": self.client_options,
+            "max_time_ms": self.max_time_ms,
+            "pool": self.pool_metrics.stats()
+        }
+
     async def init_indexes(self):
-        # 必要なインデックスを作成
-        await self.db.processes.create_index("process_type")
-        await self.db.processes.create_index("status")
-        await self.db.system_prompts.create_index("name")
-        await self.db.process_logs.create_index("process_id")
-        await self.db.process_logs.create_index("timestamp")
+        """インデックスを定義どおりに揃える（何度実行しても同じ結果になる）
+
+        MongoDB 4.2以降のインデックス構築はコレクションを長時間ロックしないため、
+        起動時はバックグラウンドタスクとして実行してよい。
+        """
+        for collection_name, indexes in INDEXES.items():
+            collection = getattr(self.db, collection_name)
+            for index_name in LEGACY_INDEXES.get(collection_name, []):
+                try:
+                    await collection.drop_index(index_name)
+                except OperationFailure:
+                    pass  # 既に存在しない
+            await collection.create_indexes(indexes)
+        await self._ensure_log_ttl()
+        await self._ensure_checkpoint_ttl()
+
+    async def _ensure_log_ttl(self):
+        """プロセスログのTTLインデックスを設定に合わせる"""
+        expire_after = self.log_ttl_days * 24 * 60 * 60 if self.log_ttl_days else None
+        await self._ensure_ttl("process_logs", "created_at", LOG_TTL_INDEX, expire_after)
+
+    async def _ensure_checkpoint_ttl(self):
+        """チェックポイントのTTLインデックスを設定に合わせる（失敗・放棄された実行の分も消えるように）"""
+        await self._ensure_ttl("workflow_checkpoints", "updated_at", CHECKPOINT_TTL_INDEX, self.checkpoint_ttl_seconds or None)
+
+    async def _ensure_ttl(self, collection_name: str, field: str, index_name: str, expire_after: Optional[int]):
+        """TTLインデックスを作成・更新する。expire_after が None なら削除する"""
+        collection = getattr(self.db, collection_name)
+        if not expire_after:
+            try:
+                await collection.drop_index(index_name)
+            except OperationFailure:
+                pass
+            return
+        try:
+            await collection.create_index(field, name=index_name, expireAfterSeconds=expire_after)
+        except OperationFailure:
+            # 保持期間が変わった場合は既存インデックスの設定だけを更新
+            await self.db.command(
+                "collMod", collection_name,
+                index={"name": index_name, "expireAfterSeconds": expire_after}
+            )
+
+    async def _page(
+        self,
+        collection: str,
+        criteria: Dict[str, Any],
+        page_size: int,
+        cursor: Optional[str],
+        fields: Optional[List[str]],
+        ascending: bool = False,
+        include_large: bool = False
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """(created_at, _id) のキーセットでページングしたドキュメントを取得"""
+        projection = _projection(collection, fields, include_large)
+        criteria = dict(criteria)
+        if cursor:
+            created_at, last_id = decode_cursor(cursor)
+            op = "$gt" if ascending else "$lt"
+            criteria["$or"] = [
+                {"created_at": {op: created_at}},
+                {"created_at": created_at, "_id": {op: last_id}}
+            ]
+
+        direction = ASCENDING if ascending else DESCENDING
+        docs = await getattr(self.db, collection).find(criteria, projection, max_time_ms=self.max_time_ms) \
+            .sort([("created_at", direction), ("_id", direction)]) \
+            .limit(page_size + 1) \
+            .to_list(length=page_size + 1)
+
+        next_cursor = encode_cursor(docs[page_size - 1]) if len(docs) > page_size else None
+        return [_stringify_id(doc) for doc in docs[:page_size]], next_cursor
+
+    async def _iterate(
+        self,
+        collection: str,
+        criteria: Dict[str, Any],
+        fields: Optional[List[str]],
+        ascending: bool = False
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """カーソルからドキュメントを1件ずつ取り出す（全件をメモリに載せない）
+
+        エクスポートは件数に比例して時間がかかるため max_time_ms は適用しない。
+        """
+        direction = ASCENDING if ascending else DESCENDING
+        cursor = getattr(self.db, collection).find(criteria, _projection(collection, fields, include_large=True)) \
+            .sort([("created_at", direction), ("_id", direction)]) \
+            .batch_size(EXPORT_BATCH_SIZE)
+        async for doc in cursor:
+            yield _stringify_id(doc)
+
+    async def _find_by_id(self, collection: str, model_cls, doc_id: str):
+        result = await getattr(self.db, collection).find_one({"_id": ObjectId(doc_id)}, max_time_ms=self.max_time_ms)
+        if result:
+            return _to_model(model_cls, result)
+        return None
+
+    async def _get_cached(self, collection: str, model_cls, doc_id: str):
+        """キャッシュ経由でドキュメントを取得（呼び出し側の変更がキャッシュに及ばないようコピーを返す）"""
+        model = await self.cache.get_or_load(
+            (collection, doc_id),
+            lambda: self._find_by_id(collection, model_cls, doc_id)
+        )
+        return model.model_copy() if model else None
 
     # プロセス関連の操作
     async def save_process(self, process: Process) -> str:
         result = await self.db.processes.insert_one(process.dict())
+        self.cache.invalidate(("processes", str(result.inserted_id)))
         return str(result.inserted_id)
 
+    async def create_process(self, process: Process, verify: bool = False) -> Optional[Process]:
+        """プロセスを保存し、挿入IDを付与したモデルを返す
+
+        verify=True の場合はキャッシュを通さずDBから読み直した値を返す。
+        """
+        process_id = await self.save_process(process)
+        if verify:
+            return await self._find_by_id("processes", Process, process_id)
+        return process.model_copy(update={"id": process_id})
+
     async def get_process(self, process_id: str) -> Optional[Process]:
-        result = await self.db.processes.find_one({"_id": ObjectId(process_id)})
-        if result:
-            return Process(**result)
-        return None
+        return await self._get_cached("processes", Process, process_id)
 
     async def update_process_status(self, process_id: str, status: ProcessStatus) -> bool:
         result = await self.db.processes.update_one(
             {"_id": ObjectId(process_id)},
-            {"$set": {"status": status}}
+            {"$set": {"status": status, "updated_at": datetime.utcnow()}}
         )
+        # 更新前に読み込み中だった値も含めて破棄する
+        self.cache.invalidate(("processes", process_id))
         return result.modified_count > 0
 
-    async def search_processes(self, query: str) -> List[Process]:
-        cursor = self.db.processes.find({})
-        processes = []
-        async for doc in cursor:
-            processes.append(Process(**doc))
-        return processes
+    async def update_process(self, process_id: str, updates: Dict[str, Any]) -> bool:
+        """任意のフィールドを更新する（ドット区切りでネストしたフィールドも指定できる）"""
+        result = await self.db.processes.update_one(
+            {"_id": ObjectId(process_id)},
+            {"$set": {**updates, "updated_at": datetime.utcnow()}}
+        )
+        self.cache.invalidate(("processes", process_id))
+        return result.modified_count > 0
+
+    async def search_processes(
+        self,
+        query: str,
+        process_type: Optional[ProcessType] = None,
+        status: Optional[ProcessStatus] = None,
+        limit: int = DEFAULT_SEARCH_LIMIT
+    ) -> List[Process]:
+        criteria, projection, sort = _build_search(query, {"type": process_type, "status": status})
+        cursor = self.db.processes.find(criteria, projection, max_time_ms=self.max_time_ms).sort(sort).limit(limit)
+        return [_to_model(Process, doc) async for doc in cursor]
+
+    async def list_processes(
+        self,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        cursor: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+        process_type: Optional[ProcessType] = None,
+        status: Optional[ProcessStatus] = None,
+        include_large: bool = False
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        criteria = {key: value for key, value in {"type": process_type, "status": status}.items() if value is not None}
+        return await self._page("processes", criteria, page_size, cursor, fields, include_large=include_large)
+
+    def iter_processes(
+        self,
+        fields: Optional[List[str]] = None,
+        process_type: Optional[ProcessType] = None,
+        status: Optional[ProcessStatus] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        criteria = {key: value for key, value in {"type": process_type, "status": status}.items() if value is not None}
+        return self._iterate("processes", criteria, fields)
 
     # システムプロンプト関連の操作
     async def save_system_prompt(self, prompt: SystemPrompt) -> str:
         result = await self.db.system_prompts.insert_one(prompt.dict())
+        self.cache.invalidate(("system_prompts", str(result.inserted_id)))
         return str(result.inserted_id)
 
+    async def create_system_prompt(self, prompt: SystemPrompt, verify: bool = False) -> Optional[SystemPrompt]:
+        prompt_id = await self.save_system_prompt(prompt)
+        if verify:
+            return await self._find_by_id("system_prompts", SystemPrompt, prompt_id)
+        return prompt.model_copy(update={"id": prompt_id})
+
     async def get_system_prompt(self, prompt_id: str) -> Optional[SystemPrompt]:
-        result = await self.db.system_prompts.find_one({"_id": ObjectId(prompt_id)})
-        if result:
-            return SystemPrompt(**result)
-        return None
+        return await self._get_cached("system_prompts", SystemPrompt, prompt_id)
 
-    async def search_system_prompts(self, query: str) -> List[SystemPrompt]:
-        cursor = self.db.system_prompts.find({})
-        prompts = []
-        async for doc in cursor:
-            prompts.append(SystemPrompt(**doc))
-        return prompts
+    async def search_system_prompts(
+        self,
+        query: str,
+        category: Optional[str] = None,
+        tag: Optional[str] = None,
+        limit: int = DEFAULT_SEARCH_LIMIT
+    ) -> List[SystemPrompt]:
+        criteria, projection, sort = _build_search(query, {"category": category, "tags": tag})
+        cursor = self.db.system_prompts.find(criteria, projection, max_time_ms=self.max_time_ms).sort(sort).limit(limit)
+        return [_to_model(SystemPrompt, doc) async for doc in cursor]
+
+    async def list_system_prompts(
+        self,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        cursor: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+        category: Optional[str] = None,
+        include_large: bool = False
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        criteria = {"category": category} if category else {}
+        return await self._page("system_prompts", criteria, page_size, cursor, fields, include_large=include_large)
+
+    def iter_system_prompts(
+        self,
+        fields: Optional[List[str]] = None,
+        category: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        criteria = {"category": category} if category else {}
+        return self._iterate("system_prompts", criteria, fields)
 
     # プロセスログ関連の操作
     async def save_process_log(self, log: ProcessLog) -> str:
         result = await self.db.process_logs.insert_one(log.dict())
+        self.cache.invalidate(("process_logs", str(result.inserted_id)))
         return str(result.inserted_id)
 
+    async def create_process_log(self, log: ProcessLog, verify: bool = False) -> Optional[ProcessLog]:
+        log_id = await self.save_process_log(log)
+        if verify:
+            return await self._find_by_id("process_logs", ProcessLog, log_id)
+        return log.model_copy(update={"id": log_id})
+
+    async def save_process_logs(self, logs: List[ProcessLog], write_concern: Optional[WriteConcern] = None) -> List[str]:
+        """ログを順序なしの insert_many でまとめて保存し、挿入IDを返す
+
+        保存後の再読み込みは行わない。ドライバが自動的に適切なサイズの
+        バッチに分割して送信する。一部が失敗した場合は BulkLogWriteError。
+        """
+        if not logs:
+            return []
+        collection = self.db.process_logs
+        if write_concern is not None:
+            collection = collection.with_options(write_concern=write_concern)
+        docs = [log.dict(exclude={"id"}) for log in logs]
+        try:
+            result = await collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # 順序なしなので失敗した分以外は保存されている（_id はドライバが docs に付けている）
+            details = e.details or {}
+            errors = [
+                {"index": error["index"], "code": error.get("code"), "message": error.get("errmsg")}
+                for error in details.get("writeErrors", [])
+            ]
+            errors += [
+                {"index": None, "code": error.get("code"), "message": error.get("errmsg")}
+                for error in details.get("writeConcernErrors", [])
+            ]
+            failed = {error["index"] for error in errors}
+            inserted_ids = [str(doc["_id"]) for index, doc in enumerate(docs) if index not in failed and "_id" in doc]
+            raise BulkLogWriteError(inserted_ids, errors) from e
+        return [str(inserted_id) for inserted_id in result.inserted_ids]
+
     async def get_process_log(self, log_id: str) -> Optional[ProcessLog]:
-        result = await self.db.process_logs.find_one({"_id": ObjectId(log_id)})
-        if result:
-            return ProcessLog(**result)
-        return None
+        return await self._get_cached("process_logs", ProcessLog, log_id)
 
     async def get_process_logs(self, process_id: str) -> List[ProcessLog]:
-        cursor = self.db.process_logs.find({"process_id": process_id})
-        logs = []
-        async for doc in cursor:
-            logs.append(ProcessLog(**doc))
-        return logs 
\ No newline at end of file
+        return [ProcessLog(**doc) async for doc in self.iter_process_logs(process_id)]
+
+    async def list_process_logs(
+        self,
+        process_id: str,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        cursor: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+        include_large: bool = False
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """ログは発生順（古い順）にページングする"""
+        return await self._page(
+            "process_logs", {"process_id": process_id}, page_size, cursor, fields,
+            ascending=True, include_large=include_large
+        )
+
+    def iter_process_logs(self, process_id: str, fields: Optional[List[str]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """ログを発生順（古い順）に1件ずつ返す"""
+        return self._iterate("process_logs", {"process_id": process_id}, fields, ascending=True)
+
+    # ワークフローのチェックポイント（実行IDとノードごとに1ドキュメント）
+    async def save_workflow_checkpoint(self, run_id: str, node: str, data: Dict[str, Any]):
+        await self.db.workflow_checkpoints.update_one(
+            {"run_id": run_id, "node": node},
+            {"$set": {"data": data, "updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+    async def get_workflow_checkpoints(self, run_id: str) -> Dict[str, Dict[str, Any]]:
+        """ノード名 -> 保存したデータ"""
+        docs = await self.db.workflow_checkpoints.find(
+            {"run_id": run_id}, {"node": 1, "data": 1}, max_time_ms=self.max_time_ms
+        ).to_list(length=None)
+        return {doc["node"]: doc["data"] for doc in docs}
+
+    async def delete_workflow_checkpoints(self, run_id: str) -> int:
+        result = await self.db.workflow_checkpoints.delete_many({"run_id": run_id})
+        return result.deleted_count
@@ -0,0 +1,203 @@
+import asyncio
+from bson import ObjectId
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+from models import Process, ProcessType, ProcessStatus
+from database import Database
+
+WorkflowRunner = Callable[..., Awaitable[Dict[str, Any]]]
+
+class JobQueueFull(Exception):
+    """待ち行列が上限に達していて新しいジョブを受け付けられない"""
+
+class WorkflowJobQueue:
+    """ワークフローをバックグラウンドで実行するジョブキュー
+
+    submit はジョブをProcess(type=workflow)として保存してキューに積み、すぐにIDを返す。
+    max_workers 個のワーカーが順に取り出して runner(task, process_id=...) を実行し、
+    状態と結果をProcessに書き戻す（各ステップのログはワークフロー側がProcessLogとして積む）。
+    process_id を指定した場合はそのProcessに、省略した場合はジョブ自身にログを積む。
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        runner: WorkflowRunner,
+        max_workers: int = 4,
+        max_queue_size: int = 100,
+        timeout: Optional[float] = None
+    ):
+        self.db = db
+        self.runner = runner
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.timeout = timeout
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: list = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._pending: Set[str] = set()
+
+    @property
+    def running(self) -> bool:
+        return any(not worker.done() for worker in self._workers)
+
+    def start(self):
+        """ワーカーを起動"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+
+    async def close(self):
+        """実行中のジョブをキャンセルしてワーカーを停止（待機中のジョブもキャンセル済みにする）"""
+        # 再起動後に取り出されることはないため、pendingのまま残さない
+        pending = list(self._pending)
+        self._pending.clear()
+        for job_id in pending:
+            self.cancelled += 1
+            await self._finish(job_id, ProcessStatus.CANCELLED, error_message="Job queue was stopped before the job started")
+        jobs = list(self._running.values())
+        for job in jobs:
+            job.cancel()
+        await asyncio.gather(*jobs, return_exceptions=True)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(
+        self,
+        task: str,
+        metadata: Optional[Dict[str, Any]] = None,
+        process_id: Optional[str] = None
+    ) -> str:
+        """ジョブを登録してIDを返す。待ち行列が満杯ならJobQueueFull"""
+        if not self.running:
+            raise RuntimeError("Workflow job queue is not running")
+        if self._queue.full():
+            self.rejected += 1
+            raise JobQueueFull(f"Workflow job queue is full (max {self.max_queue_size})")
+        job_id = await self.db.save_process(Process(
+            name="workflow",
+            type=ProcessType.WORKFLOW,
+            description=task,
+            steps=[],
+            status=ProcessStatus.PENDING,
+            metadata={**(metadata or {}), "task": task, **({"process_id": process_id} if process_id else {})}
+        ))
+        try:
+            self._queue.put_nowait((job_id, task, process_id))
+        except asyncio.QueueFull:
+            # 保存中に他のリクエストが枠を埋めた場合
+            self.rejected += 1
+            await self._finish(job_id, ProcessStatus.FAILURE, error_message="Workflow job queue is full")
+            raise JobQueueFull(f"Workflow job queue is full (max {self.max_queue_size})")
+        self._pending.add(job_id)
+        self.submitted += 1
+        return job_id
+
+    async def cancel(self, job_id: str) -> bool:
+        """待機中または実行中のジョブをキャンセルする。対象がなければFalse"""
+        if job_id in self._pending:
+            self._pending.discard(job_id)
+            self.cancelled += 1
+            await self._finish(job_id, ProcessStatus.CANCELLED, error_message="Job was cancelled")
+            return True
+        job = self._running.get(job_id)
+        if job is None or job.done():
+            return False
+        job.cancel()
+        await asyncio.wait([job])
+        return True
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """ジョブの状態と結果を返す"""
+        if not ObjectId.is_valid(job_id):
+            return None
+        process = await self.db.get_process(job_id)
+        if process is None or process.type != ProcessType.WORKFLOW:
+            return None
+        metadata = process.metadata or {}
+        return {
+            "job_id": job_id,
+            "status": process.status,
+            "task": metadata.get("task", process.description),
+            "result": metadata.get("result"),
+            "error": process.error_message,
+            "created_at": process.created_at,
+            "updated_at": process.updated_at
+        }
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._pending),
+            "running": len(self._running),
+            "max_workers": self.max_workers,
+            "max_queue_size": self.max_queue_size,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled
+        }
+
+    async def _worker(self):
+        while True:
+            job_id, task, process_id = await self._queue.get()
+            try:
+                if job_id not in self._pending:
+                    continue  # 待機中にキャンセルされた
+                self._pending.discard(job_id)
+                job = asyncio.create_task(self._execute(job_id, task, process_id))
+                self._running[job_id] = job
+                # ジョブのキャンセルでワーカー自身が止まらないよう、完了だけを待つ
+                await asyncio.wait([job])
+            finally:
+                self._running.pop(job_id, None)
+                self._queue.task_done()
+
+    async def _execute(self, job_id: str, task: str, process_id: Optional[str] = None):
+        await self._update(job_id, {"status": ProcessStatus.IN_PROGRESS})
+        try:
+            result = await asyncio.wait_for(self.runner(task, process_id=process_id or job_id), self.timeout)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            await self._finish(job_id, ProcessStatus.CANCELLED, error_message="Job was cancelled")
+            raise
+        except asyncio.TimeoutError:
+            self.failed += 1
+            await self._finish(job_id, ProcessStatus.FAILURE, error_message=f"Job timed out after {self.timeout}s")
+            return
+        except Exception as e:
+            self.failed += 1
+            await self._finish(job_id, ProcessStatus.FAILURE, error_message=str(e))
+            return
+
+        if result.get("status") == "error":
+            self.failed += 1
+            await self._finish(job_id, ProcessStatus.FAILURE, result=result, error_message=str(result.get("error")))
+        else:
+            self.completed += 1
+            await self._finish(job_id, ProcessStatus.SUCCESS, result=result)
+
+    async def _finish(
+        self,
+        job_id: str,
+        status: ProcessStatus,
+        result: Optional[Dict[str, Any]] = None,
+        error_message: Optional[str] = None
+    ):
+        updates: Dict[str, Any] = {"status": status, "error_message": error_message}
+        if result is not None:
+            updates["metadata.result"] = result
+        await self._update(job_id, updates)
+
+    async def _update(self, job_id: str, updates: Dict[str, Any]):
+        try:
+            await self.db.update_process(job_id, updates)
+        except Exception as e:
+            print(f"Failed to update workflow job {job_id}: {e}")
@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+def cache_key(model: str, prompt: Any, params: Optional[Dict[str, Any]] = None) -> str:
+    """(モデル, プロンプト, パラメータ) から内容アドレスのキーを作る"""
+    payload = json.dumps(
+        {"model": model, "prompt": prompt, "params": params or {}},
+        ensure_ascii=False, sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class LLMResponseCache:
+    """LLM応答のキャッシュ（メモリ + SQLiteの2階層）
+
+    メモリはLRU、ディスクは最終アクセス順で max_entries を超えた分を削除する。
+    エントリには元の呼び出しにかかった時間を保存し、ヒット時に節約できた時間として集計する。
+    GeminiとLangChainのどちらの経路からも文字列の応答を保存する。
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl: float = 86400.0,
+        max_memory_entries: int = 256,
+        max_disk_entries: int = 10000
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.saved_ms = 0.0
+        self._memory: "OrderedDict[str, Tuple[float, str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, latency_ms REAL NOT NULL, "
+                "expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache (last_access)")
+            self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        """キャッシュ済みの応答を返す。なければNone"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, response, latency_ms = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    self.saved_ms += latency_ms
+                    return response
+                del self._memory[key]
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT response, latency_ms, expires_at FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    response, latency_ms, expires_at = row
+                    if expires_at > now:
+                        self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+                        self._conn.commit()
+                        self._remember(key, expires_at, response, latency_ms)
+                        self.disk_hits += 1
+                        self.saved_ms += latency_ms
+                        return response
+                    self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    self._conn.commit()
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, response: str, latency_ms: float = 0.0):
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, response, latency_ms)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, response, latency_ms, expires_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, response, latency_ms, expires_at, now)
+                )
+                self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN ("
+                    "SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries,)
+                )
+                self._conn.commit()
+
+    def get_or_call(
+        self,
+        key: str,
+        call: Callable[[], str],
+        bypass: bool = False,
+        refresh: bool = False,
+        should_cache: Callable[[str], bool] = bool
+    ) -> str:
+        """キャッシュを引き、なければ call() の結果を保存して返す
+
+        bypass=True ならキャッシュを読み書きしない。refresh=True なら読まずに呼び出して上書きする。
+        """
+        if bypass:
+            return call()
+        if not refresh:
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+        start = time.perf_counter()
+        response = call()
+        if should_cache(response):
+            self.set(key, response, (time.perf_counter() - start) * 1000)
+        return response
+
+    async def aget_or_call(
+        self,
+        key: str,
+        call: Callable[[], Awaitable[str]],
+        bypass: bool = False,
+        refresh: bool = False,
+        should_cache: Callable[[str], bool] = bool
+    ) -> str:
+        """get_or_call の非同期版"""
+        if bypass:
+            return await call()
+        if not refresh:
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+        start = time.perf_counter()
+        response = await call()
+        if should_cache(response):
+            self.set(key, response, (time.perf_counter() - start) * 1000)
+        return response
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM llm_cache")
+                self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        with self._lock:
+            disk_entries = (
+                self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+                if self._conn is not None else 0
+            )
+        return {
+            "memory_entries": len(self._memory),
+            "disk_entries": disk_entries,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "saved_ms": round(self.saved_ms, 1)
+        }
+
+    def _remember(self, key: str, expires_at: float, response: str, latency_ms: float):
+        if self.max_memory_entries <= 0:
+            return
+        self._memory[key] = (expires_at, response, latency_ms)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+def response_cache_from_env() -> Optional[LLMResponseCache]:
+    """環境変数からキャッシュを作る。LLM_CACHE_DISABLED=true なら None
+
+    LLM_CACHE_PATH を指定するとSQLiteに保存し、プロセスをまたいで再利用できる。
+    """
+    if os.getenv("LLM_CACHE_DISABLED", "").lower() == "true":
+        return None
+    return LLMResponseCache(
+        path=os.getenv("LLM_CACHE_PATH") or None,
+        ttl=float(os.getenv("LLM_CACHE_TTL_SECONDS", "86400")),
+        max_memory_entries=int(os.getenv("LLM_CACHE_MAX_MEMORY_ENTRIES", "256")),
+        max_disk_entries=int(os.getenv("LLM_CACHE_MAX_DISK_ENTRIES", "10000"))
+    )
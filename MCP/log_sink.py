@@ -0,0 +1,141 @@
+import asyncio
+import time
+from enum import Enum
+from typing import Optional, List
+from models import ProcessLog
+from database import BulkLogWriteError, Database
+
+class OverflowPolicy(str, Enum):
+    """キューが満杯のときの振る舞い"""
+    BLOCK = "block"              # 空きができるまで待つ（バックプレッシャー）
+    DROP_NEWEST = "drop_newest"  # 新しいログを捨てる
+    DROP_OLDEST = "drop_oldest"  # 最も古いログを捨てて新しいログを入れる
+
+class ProcessLogSink:
+    """ProcessLogをバッファリングしてまとめてDBに書き込むシンク
+
+    呼び出し側はキューに積むだけで戻り、バックグラウンドのフラッシャーが
+    件数(batch_size)または時間(flush_interval秒)のどちらかに達した時点で
+    Database.save_process_logs により一括保存する。
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        max_queue_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        overflow_policy: OverflowPolicy = OverflowPolicy.BLOCK
+    ):
+        self.db = db
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = OverflowPolicy(overflow_policy)
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # close() 開始後は新しいログを受け付けない（DROP_OLDEST で停止用の None を捨てないように）
+        self._closing = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """バックグラウンドのフラッシャーを起動"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """キューに残っているログをすべて書き出して停止"""
+        if not self.running or self._closing:
+            return
+        self._closing = True
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def log(self, entry: ProcessLog) -> bool:
+        """ログをキューに積む。捨てられた場合はFalseを返す"""
+        if self.overflow_policy == OverflowPolicy.BLOCK:
+            self._ensure_running()
+            await self._queue.put(entry)
+            return True
+        return self.log_nowait(entry)
+
+    def log_nowait(self, entry: ProcessLog) -> bool:
+        """待たずにログを積む。満杯ならポリシーに従って捨てる"""
+        self._ensure_running()
+        try:
+            self._queue.put_nowait(entry)
+            return True
+        except asyncio.QueueFull:
+            if self.overflow_policy == OverflowPolicy.DROP_OLDEST:
+                self._queue.get_nowait()
+                self._queue.put_nowait(entry)
+            self.dropped += 1
+            return self.overflow_policy == OverflowPolicy.DROP_OLDEST
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed
+        }
+
+    def _ensure_running(self):
+        if not self.running:
+            raise RuntimeError("Process log sink is not running")
+        if self._closing:
+            raise RuntimeError("Process log sink is closing")
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch: List[ProcessLog] = []
+            entry = await self._queue.get()
+            if entry is None:
+                stopping = True
+            else:
+                batch.append(entry)
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        entry = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                    if entry is None:
+                        stopping = True
+                        break
+                    batch.append(entry)
+            if stopping:
+                # 停止要求より前に積まれた分をすべて回収
+                while not self._queue.empty():
+                    entry = self._queue.get_nowait()
+                    if entry is not None:
+                        batch.append(entry)
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[ProcessLog]):
+        for start in range(0, len(batch), self.batch_size):
+            chunk = batch[start:start + self.batch_size]
+            try:
+                await self.db.save_process_logs(chunk)
+                self.written += len(chunk)
+            except BulkLogWriteError as e:
+                self.written += len(e.inserted_ids)
+                self.failed += len(chunk) - len(e.inserted_ids)
+                print(f"Failed to flush some process logs: {e.errors}")
+            except Exception as e:
+                self.failed += len(chunk)
+                print(f"Failed to flush process logs: {e}")
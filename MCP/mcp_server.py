@@ -1,18 +1,26 @@
-from fastapi import FastAPI, HTTPException, Depends, status, Header, Request
+from fastapi import FastAPI, HTTPException, Depends, status, Header, Request, Query, Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from datetime import datetime, UTC, timedelta
 from typing import Optional, List
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel
-from models import Process, SystemPrompt, ProcessLog, ProcessType, ProcessStatus
-from database import Database
+from models import Process, SystemPrompt, ProcessLog, ProcessType, ProcessStatus, ProcessView, SystemPromptView, ProcessLogView
+from pymongo.errors import ConfigurationError, ExecutionTimeout, WaitQueueTimeoutError
+from pymongo.write_concern import WriteConcern
+from database import Database, BulkLogWriteError, DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 import os
+import json
+import asyncio
 from dotenv import load_dotenv
 from contextlib import asynccontextmanager
 from workflow import MCPWorkflow
+from log_sink import ProcessLogSink, OverflowPolicy
+from job_queue import WorkflowJobQueue, JobQueueFull
+from llm_cache import response_cache_from_env
+from checkpoint import checkpointer_from_env
 from langchain.tools import Tool
 from langchain_core.outputs import Generation, LLMResult
 from langchain_core.language_models.chat_models import BaseChatModel
@@ -24,11 +32,24 @@ MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+MAX_BULK_LOGS = int(os.getenv("MAX_BULK_LOGS", "50000"))
 API_KEY = os.getenv("API_KEY", "your-api-key")
+MAX_BATCH_TASKS = int(os.getenv("WORKFLOW_BATCH_MAX_TASKS", "1000"))
+DEFAULT_BATCH_CONCURRENCY = int(os.getenv("WORKFLOW_BATCH_CONCURRENCY", "8"))
+MAX_BATCH_CONCURRENCY = int(os.getenv("WORKFLOW_BATCH_MAX_CONCURRENCY", "64"))
 
 # データベース接続
 db = Database(mongodb_uri=MONGODB_URI)
 
+# プロセスログの非同期書き込み
+log_sink = ProcessLogSink(
+    db,
+    max_queue_size=int(os.getenv("LOG_SINK_MAX_QUEUE", "10000")),
+    batch_size=int(os.getenv("LOG_SINK_BATCH_SIZE", "500")),
+    flush_interval=float(os.getenv("LOG_SINK_FLUSH_INTERVAL", "1.0")),
+    overflow_policy=OverflowPolicy(os.getenv("LOG_SINK_OVERFLOW_POLICY", OverflowPolicy.BLOCK.value))
+)
+
 # セキュリティ設定
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -52,6 +73,12 @@ tools = [
     )
 ]
 
+# プランナー/レビューアーのLLM応答キャッシュ（LLM_CACHE_PATHでSQLiteに永続化）
+llm_cache = response_cache_from_env()
+
+# ノードごとの途中結果（失敗した実行を /workflow/resume/{run_id} で再開する）
+checkpointer = checkpointer_from_env(db)
+
 # ワークフローの初期化
 if os.getenv("TESTING", "false").lower() == "true":
     from unittest.mock import MagicMock
@@ -68,18 +95,42 @@ if os.getenv("TESTING", "false").lower() == "true":
             return "mock"
     
     mock_model = MockChatModel()
-    workflow = MCPWorkflow(model=mock_model, tools=tools)
+    workflow = MCPWorkflow(model=mock_model, tools=tools, log_sink=log_sink, response_cache=llm_cache, checkpointer=checkpointer)
 else:
-    workflow = MCPWorkflow(model_name="gpt-4", tools=tools)
+    workflow = MCPWorkflow(model_name="gpt-4", tools=tools, log_sink=log_sink, response_cache=llm_cache, checkpointer=checkpointer)
+
+# /workflow/execute?background=true で使うジョブキュー
+job_queue = WorkflowJobQueue(
+    db,
+    lambda task, process_id=None: workflow.run(task, process_id=process_id),
+    max_workers=int(os.getenv("WORKFLOW_JOB_WORKERS", "4")),
+    max_queue_size=int(os.getenv("WORKFLOW_JOB_MAX_QUEUE", "100")),
+    timeout=float(os.getenv("WORKFLOW_JOB_TIMEOUT_SECONDS")) if os.getenv("WORKFLOW_JOB_TIMEOUT_SECONDS") else None
+)
+
+def _report_index_result(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        print(f"Failed to initialize indexes: {task.exception()}")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # 起動時の処理
     await db.connect()
-    await db.init_indexes()
+    # インデックス構築はリクエスト受付を妨げないようバックグラウンドで行う
+    index_task = asyncio.create_task(db.init_indexes())
+    index_task.add_done_callback(_report_index_result)
+    log_sink.start()
+    job_queue.start()
     yield
-    # 終了時の処理
+    # 終了時の処理（残っているログを書き出してから切断）
+    index_task.cancel()
+    await job_queue.close()
+    await log_sink.close()
     await db.close()
+    if llm_cache is not None:
+        llm_cache.close()
+    if checkpointer is not None:
+        checkpointer.close()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -92,6 +143,81 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """カンマ区切りのフィールド指定をリストに変換"""
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(",") if field.strip()]
+
+async def paginate(response: Response, fetch) -> list:
+    """ページ取得を実行し、継続トークンを X-Next-Cursor ヘッダーに設定"""
+    try:
+        items, next_cursor = await fetch
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return items
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+async def ndjson_lines(docs):
+    """ドキュメントを1行ずつJSON Lines形式で返す"""
+    async for doc in docs:
+        yield json.dumps(doc, default=_json_default, ensure_ascii=False) + "\n"
+
+def ndjson_response(docs) -> StreamingResponse:
+    return StreamingResponse(ndjson_lines(docs), media_type="application/x-ndjson")
+
+async def sse_lines(events):
+    """イベントをServer-Sent Events形式で返す"""
+    async for event in events:
+        data = json.dumps(event, default=_json_default, ensure_ascii=False)
+        yield f"event: {event['event']}\ndata: {data}\n\n"
+
+def sse_response(events) -> StreamingResponse:
+    return StreamingResponse(
+        sse_lines(events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+class BulkInsertResult(BaseModel):
+    inserted_ids: List[str]
+    count: int
+
+class BulkWriteErrorDetail(BaseModel):
+    index: Optional[int]  # 失敗したログの位置（書き込み保証のエラーはNone）
+    code: Optional[int]
+    message: Optional[str]
+
+class PartialBulkInsertResult(BulkInsertResult):
+    errors: List[BulkWriteErrorDetail]
+
+class BatchWorkflowRequest(BaseModel):
+    tasks: List[str]
+
+@app.exception_handler(ExecutionTimeout)
+async def execution_timeout_handler(request: Request, exc: ExecutionTimeout):
+    return JSONResponse(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        content={"detail": "Database query exceeded its time limit"},
+    )
+
+@app.exception_handler(WaitQueueTimeoutError)
+async def wait_queue_timeout_handler(request: Request, exc: WaitQueueTimeoutError):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Database connection pool exhausted"},
+        headers={"Retry-After": "1"},
+    )
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -160,6 +286,20 @@ async def health_check():
         "timestamp": datetime.now(UTC).isoformat()
     }
 
+@app.get("/cache/stats")
+async def cache_stats(current_user: str = Depends(get_current_user)):
+    return db.cache.stats()
+
+@app.get("/cache/llm/stats")
+async def llm_cache_stats(current_user: str = Depends(get_current_user)):
+    if llm_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **llm_cache.stats()}
+
+@app.get("/db/stats")
+async def db_stats(current_user: str = Depends(get_current_user)):
+    return db.stats()
+
 @app.post("/token")
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     if not verify_password(form_data.username, form_data.password):
@@ -175,10 +315,14 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/processes", response_model=Process)
-async def create_process(process: Process, current_user: str = Depends(get_current_user)):
+async def create_process(
+    process: Process,
+    verify: bool = False,
+    current_user: str = Depends(get_current_user)
+):
+    """verify=true でDBから読み直した値を返す（read-your-write確認）"""
     try:
-        process_id = await db.save_process(process)
-        saved_process = await db.get_process(process_id)
+        saved_process = await db.create_process(process, verify=verify)
         if not saved_process:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -201,15 +345,39 @@ async def get_process(process_id: str, current_user: str = Depends(get_current_u
         )
     return process
 
-@app.get("/processes", response_model=List[Process])
-async def list_processes(current_user: str = Depends(get_current_user)):
-    return await db.search_processes("")
+@app.get("/processes", response_model=List[ProcessView], response_model_exclude_unset=True)
+async def list_processes(
+    response: Response,
+    page_size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    include_large: bool = False,
+    process_type: Optional[ProcessType] = Query(None, alias="type"),
+    process_status: Optional[ProcessStatus] = Query(None, alias="status"),
+    current_user: str = Depends(get_current_user)
+):
+    """プロセスの一覧を作成日時の新しい順でページングして返す（続きは X-Next-Cursor の継続トークンで取得）
+
+    fields で返すフィールドを指定できる。指定しない場合、大きなフィールド（steps）は
+    include_large=true のときだけ返す（以前は常に含めていた）。
+    """
+    return await paginate(response, db.list_processes(
+        page_size=page_size,
+        cursor=cursor,
+        fields=parse_fields(fields),
+        process_type=process_type,
+        status=process_status,
+        include_large=include_large
+    ))
 
 @app.post("/system-prompts", response_model=SystemPrompt)
-async def create_system_prompt(prompt: SystemPrompt, current_user: str = Depends(get_current_user)):
+async def create_system_prompt(
+    prompt: SystemPrompt,
+    verify: bool = False,
+    current_user: str = Depends(get_current_user)
+):
     try:
-        prompt_id = await db.save_system_prompt(prompt)
-        saved_prompt = await db.get_system_prompt(prompt_id)
+        saved_prompt = await db.create_system_prompt(prompt, verify=verify)
         if not saved_prompt:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -232,15 +400,37 @@ async def get_system_prompt(prompt_id: str, current_user: str = Depends(get_curr
         )
     return prompt
 
-@app.get("/system-prompts", response_model=List[SystemPrompt])
-async def list_system_prompts(current_user: str = Depends(get_current_user)):
-    return await db.search_system_prompts("")
+@app.get("/system-prompts", response_model=List[SystemPromptView], response_model_exclude_unset=True)
+async def list_system_prompts(
+    response: Response,
+    page_size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    include_large: bool = False,
+    category: Optional[str] = None,
+    current_user: str = Depends(get_current_user)
+):
+    """システムプロンプトの一覧を作成日時の新しい順でページングして返す（続きは X-Next-Cursor の継続トークンで取得）
+
+    fields で返すフィールドを指定できる。指定しない場合、大きなフィールド（content）は
+    include_large=true のときだけ返す（以前は常に含めていた）。
+    """
+    return await paginate(response, db.list_system_prompts(
+        page_size=page_size,
+        cursor=cursor,
+        fields=parse_fields(fields),
+        category=category,
+        include_large=include_large
+    ))
 
 @app.post("/process-logs", response_model=ProcessLog)
-async def create_process_log(log: ProcessLog, current_user: str = Depends(get_current_user)):
+async def create_process_log(
+    log: ProcessLog,
+    verify: bool = False,
+    current_user: str = Depends(get_current_user)
+):
     try:
-        log_id = await db.save_process_log(log)
-        saved_log = await db.get_process_log(log_id)
+        saved_log = await db.create_process_log(log, verify=verify)
         if not saved_log:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -253,17 +443,127 @@ async def create_process_log(log: ProcessLog, current_user: str = Depends(get_cu
             detail=str(e)
         )
 
-@app.get("/process-logs/{process_id}", response_model=List[ProcessLog])
-async def get_process_logs(process_id: str, current_user: str = Depends(get_current_user)):
-    return await db.get_process_logs(process_id)
+@app.post(
+    "/process-logs/bulk",
+    response_model=BulkInsertResult,
+    responses={status.HTTP_207_MULTI_STATUS: {"model": PartialBulkInsertResult}}
+)
+async def create_process_logs(
+    logs: List[ProcessLog],
+    write_concern: Optional[str] = Query(None, pattern="^(0|1|majority)$"),
+    journal: bool = False,
+    current_user: str = Depends(get_current_user)
+):
+    """ログをまとめて登録する（w=0 は応答を待たない。一部が失敗した場合は207）"""
+    if len(logs) > MAX_BULK_LOGS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Too many logs in one request (max {MAX_BULK_LOGS})"
+        )
+    concern = None
+    if write_concern is not None or journal:
+        w = int(write_concern) if write_concern and write_concern.isdigit() else (write_concern or 1)
+        try:
+            concern = WriteConcern(w=w, j=journal or None)
+        except ConfigurationError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
+    try:
+        inserted_ids = await db.save_process_logs(logs, write_concern=concern)
+    except BulkLogWriteError as e:
+        # 一部だけ保存できた場合は207で、保存できた分とインデックスごとのエラーを返す
+        result = PartialBulkInsertResult(inserted_ids=e.inserted_ids, count=len(e.inserted_ids), errors=e.errors)
+        return JSONResponse(status_code=status.HTTP_207_MULTI_STATUS, content=result.dict())
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+    return BulkInsertResult(inserted_ids=inserted_ids, count=len(inserted_ids))
+
+@app.post("/process-logs/queue", status_code=status.HTTP_202_ACCEPTED)
+async def queue_process_log(log: ProcessLog, current_user: str = Depends(get_current_user)):
+    """ログを非同期シンクに積んで即座に返す"""
+    if not await log_sink.log(log):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Process log queue is full"
+        )
+    return {"status": "queued"}
+
+@app.get("/process-logs/{process_id}", response_model=List[ProcessLogView], response_model_exclude_unset=True)
+async def get_process_logs(
+    process_id: str,
+    response: Response,
+    page_size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    include_large: bool = False,
+    current_user: str = Depends(get_current_user)
+):
+    """ログの一覧を作成日時の古い順でページングして返す（続きは X-Next-Cursor の継続トークンで取得）
+
+    fields で返すフィールドを指定できる。指定しない場合、大きなフィールド（error_details, metadata）は
+    include_large=true のときだけ返す（以前は常に含めていた）。
+    """
+    return await paginate(response, db.list_process_logs(
+        process_id,
+        page_size=page_size,
+        cursor=cursor,
+        fields=parse_fields(fields),
+        include_large=include_large
+    ))
+
+@app.get("/export/processes")
+async def export_processes(
+    fields: Optional[str] = None,
+    process_type: Optional[ProcessType] = Query(None, alias="type"),
+    process_status: Optional[ProcessStatus] = Query(None, alias="status"),
+    current_user: str = Depends(get_current_user)
+):
+    return ndjson_response(db.iter_processes(
+        fields=parse_fields(fields),
+        process_type=process_type,
+        status=process_status
+    ))
+
+@app.get("/export/system-prompts")
+async def export_system_prompts(
+    fields: Optional[str] = None,
+    category: Optional[str] = None,
+    current_user: str = Depends(get_current_user)
+):
+    return ndjson_response(db.iter_system_prompts(fields=parse_fields(fields), category=category))
+
+@app.get("/export/process-logs/{process_id}")
+async def export_process_logs(
+    process_id: str,
+    fields: Optional[str] = None,
+    current_user: str = Depends(get_current_user)
+):
+    return ndjson_response(db.iter_process_logs(process_id, fields=parse_fields(fields)))
 
 @app.get("/search/processes")
-async def search_processes(query: str, current_user: str = Depends(get_current_user)):
-    return await db.search_processes(query)
+async def search_processes(
+    query: str,
+    process_type: Optional[ProcessType] = Query(None, alias="type"),
+    process_status: Optional[ProcessStatus] = Query(None, alias="status"),
+    limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT),
+    current_user: str = Depends(get_current_user)
+):
+    return await db.search_processes(query, process_type=process_type, status=process_status, limit=limit)
 
 @app.get("/search/system-prompts")
-async def search_system_prompts(query: str, current_user: str = Depends(get_current_user)):
-    return await db.search_system_prompts(query)
+async def search_system_prompts(
+    query: str,
+    category: Optional[str] = None,
+    tag: Optional[str] = None,
+    limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT),
+    current_user: str = Depends(get_current_user)
+):
+    return await db.search_system_prompts(query, category=category, tag=tag, limit=limit)
 
 @app.put("/processes/{process_id}/status")
 async def update_process_status(
@@ -282,14 +582,101 @@ async def update_process_status(
 @app.post("/workflow/execute")
 async def execute_workflow(
     task: str,
+    response: Response,
+    process_id: Optional[str] = None,
+    background: bool = False,
     current_user: str = Depends(get_current_user)
 ):
-    """ワークフローを実行するエンドポイント"""
+    """ワークフローを実行するエンドポイント
+
+    background=true ならジョブキューに積んで202とジョブIDを返す（結果は /workflow/jobs/{job_id} で取得）。
+    """
+    if background:
+        try:
+            job_id = await job_queue.submit(task, metadata={"submitted_by": current_user}, process_id=process_id)
+        except JobQueueFull as e:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=str(e),
+                headers={"Retry-After": "5"}
+            )
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {"job_id": job_id, "status": ProcessStatus.PENDING}
     try:
-        result = await workflow.run(task)
+        result = await workflow.run(task, process_id=process_id)
         return result
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
-        ) 
\ No newline at end of file
+        ) 
+
+@app.post("/workflow/execute-batch")
+async def execute_workflow_batch(
+    request: BatchWorkflowRequest,
+    concurrency: int = Query(DEFAULT_BATCH_CONCURRENCY, ge=1, le=MAX_BATCH_CONCURRENCY),
+    current_user: str = Depends(get_current_user)
+):
+    """複数のタスクを並行に実行し、完了した順にJSON Linesで返す（各行に index と所要時間を含む）"""
+    if len(request.tasks) > MAX_BATCH_TASKS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Too many tasks in one request (max {MAX_BATCH_TASKS})"
+        )
+    return ndjson_response(workflow.run_many(request.tasks, concurrency=concurrency))
+
+@app.post("/workflow/resume/{run_id}")
+async def resume_workflow(run_id: str, current_user: str = Depends(get_current_user)):
+    """失敗した実行を、完了済みのノードの結果を再利用して再開する"""
+    try:
+        return await workflow.resume(run_id)
+    except KeyError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Checkpoint not found"
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+@app.get("/workflow/jobs/stats")
+async def workflow_job_stats(current_user: str = Depends(get_current_user)):
+    return job_queue.stats()
+
+@app.get("/workflow/jobs/{job_id}")
+async def get_workflow_job(job_id: str, current_user: str = Depends(get_current_user)):
+    job = await job_queue.get(job_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found"
+        )
+    return job
+
+@app.post("/workflow/jobs/{job_id}/cancel")
+async def cancel_workflow_job(job_id: str, current_user: str = Depends(get_current_user)):
+    if not await job_queue.cancel(job_id):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Job is not pending or running"
+        )
+    return {"job_id": job_id, "status": ProcessStatus.CANCELLED}
+
+@app.get("/workflow/stream")
+async def stream_workflow(
+    task: str,
+    process_id: Optional[str] = None,
+    current_user: str = Depends(get_current_user)
+):
+    """ワークフローの進行（node_start/node_end）と生成中のトークンをSSEで返す
+
+    最後の workflow_end イベントに結果と time_to_first_token_ms / total_ms を含む。
+    """
+    return sse_response(workflow.stream(task, process_id=process_id))
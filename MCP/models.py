@@ -8,6 +8,7 @@ class ProcessStatus(str, Enum):
     SUCCESS = "success"
     FAILURE = "failure"
     IN_PROGRESS = "in_progress"
+    CANCELLED = "cancelled"
 
 class ProcessType(str, Enum):
     INSTALLATION = "installation"
@@ -15,6 +16,7 @@ class ProcessType(str, Enum):
     DEPLOYMENT = "deployment"
     TESTING = "testing"
     SCRAPING = "scraping"
+    WORKFLOW = "workflow"
 
 class Process(BaseModel):
     id: Optional[str] = Field(None, alias="_id")
@@ -46,4 +48,38 @@ class ProcessLog(BaseModel):
     message: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
     error_details: Optional[Dict[str, Any]] = None
-    metadata: Optional[Dict[str, Any]] = None 
\ No newline at end of file
+    metadata: Optional[Dict[str, Any]] = None
+
+# 一覧取得（GET /processes など）の応答モデル。射影で取得したフィールドだけを返すため、
+# すべてのフィールドを省略可能にし、エンドポイント側で response_model_exclude_unset を指定する
+class ProcessView(BaseModel):
+    id: Optional[str] = Field(None, alias="_id")
+    name: Optional[str] = None
+    type: Optional[ProcessType] = None
+    description: Optional[str] = None
+    steps: Optional[List[Dict[str, Any]]] = None
+    status: Optional[ProcessStatus] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    error_message: Optional[str] = None
+    metadata: Optional[Dict[str, Any]] = None
+
+class SystemPromptView(BaseModel):
+    id: Optional[str] = Field(None, alias="_id")
+    name: Optional[str] = None
+    content: Optional[str] = None
+    category: Optional[str] = None
+    tags: Optional[List[str]] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    metadata: Optional[Dict[str, Any]] = None
+
+class ProcessLogView(BaseModel):
+    id: Optional[str] = Field(None, alias="_id")
+    process_id: Optional[str] = None
+    step_number: Optional[int] = None
+    status: Optional[ProcessStatus] = None
+    message: Optional[str] = None
+    created_at: Optional[datetime] = None
+    error_details: Optional[Dict[str, Any]] = None
+    metadata: Optional[Dict[str, Any]] = None
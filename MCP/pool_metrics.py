@@ -0,0 +1,98 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Dict
+from pymongo import monitoring
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """MongoDBコネクションプールの利用状況を集計するリスナー
+
+    チェックアウト開始から取得までの待ち時間を記録し、プールサイズの
+    見積もりに使えるようにする。Motorは操作をスレッドプールで実行するため、
+    開始時刻はスレッドごとに保持する。
+    """
+
+    def __init__(self, max_samples: int = 1000):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._wait_ms = deque(maxlen=max_samples)
+        self.checkouts = 0
+        self.checkout_failures: Dict[str, int] = {}
+        self.in_use = 0
+        self.max_in_use = 0
+        self.open_connections = 0
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        wait_ms = self._elapsed_ms()
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+            if wait_ms is not None:
+                self._wait_ms.append(wait_ms)
+
+    def connection_check_out_failed(self, event):
+        wait_ms = self._elapsed_ms()
+        with self._lock:
+            self.checkout_failures[event.reason] = self.checkout_failures.get(event.reason, 0) + 1
+            if wait_ms is not None:
+                self._wait_ms.append(wait_ms)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use = max(0, self.in_use - 1)
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections = max(0, self.open_connections - 1)
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = sorted(self._wait_ms)
+            return {
+                "checkouts": self.checkouts,
+                "checkout_failures": dict(self.checkout_failures),
+                "in_use": self.in_use,
+                "max_in_use": self.max_in_use,
+                "open_connections": self.open_connections,
+                "wait_ms": {
+                    "p50": _percentile(samples, 50),
+                    "p99": _percentile(samples, 99),
+                    "max": samples[-1] if samples else 0.0
+                }
+            }
+
+    def _elapsed_ms(self):
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        if started is None:
+            return None
+        return (time.perf_counter() - started) * 1000
+
+def _percentile(samples, pct: float) -> float:
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+    return samples[index]
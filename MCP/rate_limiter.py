@@ -0,0 +1,241 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {
+    # google.api_core.exceptions
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "DeadlineExceeded",
+    "InternalServerError", "GatewayTimeout",
+    # openai
+    "RateLimitError", "APIConnectionError", "APITimeoutError",
+}
+
+@dataclass
+class ModelBudget:
+    """モデルごとの1分あたりの上限（0以下は無制限）"""
+    requests_per_minute: float = 0
+    tokens_per_minute: float = 0
+
+class _Bucket:
+    """負債を許すトークンバケット
+
+    予約時に残量から差し引き、不足分は補充されるまで待つ時間として返す。
+    予約順に待ち時間が決まるため、呼び出し側はFIFOで並び、上限近くの速度で流れる。
+    """
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> float:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        self.level -= amount
+        return max(0.0, -self.level / self.rate)
+
+    def drain(self, seconds: float, now: float):
+        """レート制限を受けたときに seconds 秒分の補充を取り消す"""
+        self.reserve(0, now)
+        self.level = min(self.level, -seconds * self.rate)
+
+class RateLimiter:
+    """モデルごとにリクエスト数とトークン数の予算を管理するリミッター
+
+    予算を超える呼び出しは失敗させずに待たせる。スレッド/asyncioの両方から共有できる。
+    """
+
+    def __init__(self, budgets: Optional[Dict[str, ModelBudget]] = None, default: Optional[ModelBudget] = None):
+        self.budgets = dict(budgets or {})
+        self.default = default or ModelBudget()
+        self._buckets: Dict[str, Dict[str, _Bucket]] = {}
+        self._lock = threading.Lock()
+        self.waited_seconds = 0.0
+        self.throttled = 0
+
+    def reserve(self, model: str, tokens: int = 0) -> float:
+        """予算を予約し、実行前に待つべき秒数を返す"""
+        with self._lock:
+            buckets = self._buckets_for(model)
+            now = time.monotonic()
+            wait = 0.0
+            if "requests" in buckets:
+                wait = max(wait, buckets["requests"].reserve(1, now))
+            if "tokens" in buckets and tokens:
+                wait = max(wait, buckets["tokens"].reserve(tokens, now))
+            if wait > 0:
+                self.throttled += 1
+                self.waited_seconds += wait
+            return wait
+
+    def acquire(self, model: str, tokens: int = 0):
+        wait = self.reserve(model, tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, model: str, tokens: int = 0):
+        wait = self.reserve(model, tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def penalize(self, model: str, seconds: float) -> bool:
+        """429を受けたモデルの予算を空にし、並行する呼び出しもまとめて後ろにずらす
+
+        予算が設定されていないモデルではFalseを返す（呼び出し側で待つ）。
+        """
+        with self._lock:
+            buckets = self._buckets_for(model)
+            now = time.monotonic()
+            for bucket in buckets.values():
+                bucket.drain(seconds, now)
+            return bool(buckets)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "throttled": self.throttled,
+            "waited_seconds": round(self.waited_seconds, 3),
+            "models": sorted(self._buckets)
+        }
+
+    def _buckets_for(self, model: str) -> Dict[str, _Bucket]:
+        buckets = self._buckets.get(model)
+        if buckets is None:
+            budget = self.budgets.get(model, self.default)
+            buckets = {}
+            if budget.requests_per_minute > 0:
+                buckets["requests"] = _Bucket(budget.requests_per_minute)
+            if budget.tokens_per_minute > 0:
+                buckets["tokens"] = _Bucket(budget.tokens_per_minute)
+            self._buckets[model] = buckets
+        return buckets
+
+@dataclass
+class RetryPolicy:
+    """指数バックオフ（フルジッター）で再試行する設定"""
+    max_attempts: int = 5
+    base_delay: float = 1.0
+    max_delay: float = 60.0
+
+    def delay(self, attempt: int, error: Optional[BaseException] = None) -> float:
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+def estimate_tokens(text: Any) -> int:
+    """おおよそのトークン数（4文字 = 1トークン）"""
+    return max(1, len(str(text)) // 4)
+
+def _status_code(error: BaseException) -> Optional[int]:
+    for attr in ("status_code", "http_status", "code"):
+        value = getattr(error, attr, None)
+        value = value() if callable(value) else value
+        value = getattr(value, "value", value)  # grpc.StatusCode など
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None)
+
+def _retry_after(error: Optional[BaseException]) -> Optional[float]:
+    value = getattr(error, "retry_after", None)
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def is_retryable(error: BaseException) -> bool:
+    """レート制限・一時的な障害など再試行で回復しうるエラーか"""
+    if isinstance(error, (TimeoutError, ConnectionError, asyncio.TimeoutError)):
+        return True
+    if any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(error).__mro__):
+        return True
+    return _status_code(error) in RETRYABLE_STATUS_CODES
+
+def _is_rate_limited(error: BaseException) -> bool:
+    names = {cls.__name__ for cls in type(error).__mro__}
+    return bool(names & {"ResourceExhausted", "TooManyRequests", "RateLimitError"}) or _status_code(error) == 429
+
+def call_with_retry(
+    call: Callable[[], Any],
+    model: str,
+    tokens: int = 0,
+    limiter: Optional[RateLimiter] = None,
+    policy: Optional[RetryPolicy] = None
+) -> Any:
+    """予算の範囲で call() を実行し、再試行可能なエラーはバックオフして再試行する"""
+    policy = policy or RetryPolicy()
+    for attempt in range(policy.max_attempts):
+        if limiter is not None:
+            limiter.acquire(model, tokens)
+        try:
+            return call()
+        except Exception as e:
+            if attempt + 1 >= policy.max_attempts or not is_retryable(e):
+                raise
+            delay = policy.delay(attempt, e)
+            if not (limiter is not None and _is_rate_limited(e) and limiter.penalize(model, delay)):
+                time.sleep(delay)
+            print(f"Retrying {model} call after {type(e).__name__} (attempt {attempt + 2}/{policy.max_attempts})")
+
+async def acall_with_retry(
+    call: Callable[[], Awaitable[Any]],
+    model: str,
+    tokens: int = 0,
+    limiter: Optional[RateLimiter] = None,
+    policy: Optional[RetryPolicy] = None
+) -> Any:
+    """call_with_retry の非同期版"""
+    policy = policy or RetryPolicy()
+    for attempt in range(policy.max_attempts):
+        if limiter is not None:
+            await limiter.aacquire(model, tokens)
+        try:
+            return await call()
+        except Exception as e:
+            if attempt + 1 >= policy.max_attempts or not is_retryable(e):
+                raise
+            delay = policy.delay(attempt, e)
+            if not (limiter is not None and _is_rate_limited(e) and limiter.penalize(model, delay)):
+                await asyncio.sleep(delay)
+            print(f"Retrying {model} call after {type(e).__name__} (attempt {attempt + 2}/{policy.max_attempts})")
+
+def limiter_from_env() -> RateLimiter:
+    """環境変数からリミッターを作る
+
+    LLM_REQUESTS_PER_MINUTE / LLM_TOKENS_PER_MINUTE は全モデル共通の既定値、
+    LLM_RATE_LIMITS はモデルごとの上書き（例: {"gemini-1.5-pro-latest": {"rpm": 60, "tpm": 1000000}}）。
+    """
+    default = ModelBudget(
+        requests_per_minute=float(os.getenv("LLM_REQUESTS_PER_MINUTE", "0")),
+        tokens_per_minute=float(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+    )
+    budgets = {
+        model: ModelBudget(limits.get("rpm", 0), limits.get("tpm", 0))
+        for model, limits in json.loads(os.getenv("LLM_RATE_LIMITS", "{}")).items()
+    }
+    return RateLimiter(budgets, default)
+
+def retry_policy_from_env() -> RetryPolicy:
+    return RetryPolicy(
+        max_attempts=int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", "5")),
+        base_delay=float(os.getenv("LLM_RETRY_BASE_DELAY", "1.0")),
+        max_delay=float(os.getenv("LLM_RETRY_MAX_DELAY", "60"))
+    )
+
+_shared_limiter: Optional[RateLimiter] = None
+_shared_lock = threading.Lock()
+
+def shared_limiter() -> RateLimiter:
+    """プロセス内で共有するリミッター（並行するワークフローで予算を分け合う）"""
+    global _shared_limiter
+    with _shared_lock:
+        if _shared_limiter is None:
+            _shared_limiter = limiter_from_env()
+        return _shared_limiter
@@ -0,0 +1,68 @@
+"""作成系APIの書き込みレイテンシを計測するベンチマーク
+
+保存後に読み直す従来方式（verify=True）と、挿入IDを付与したモデルを
+そのまま返す方式（verify=False）を、同時実行数を指定して比較する。
+
+使い方:
+    MONGODB_URI=mongodb://localhost:27017 python scripts/benchmark_writes.py --requests 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from database import Database
+from models import ProcessLog, ProcessStatus
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+async def run(db: Database, requests: int, concurrency: int, verify: bool) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i: int):
+        log = ProcessLog(
+            process_id="benchmark",
+            step_number=i,
+            status=ProcessStatus.SUCCESS,
+            message=f"benchmark write {i}"
+        )
+        async with semaphore:
+            start = time.perf_counter()
+            await db.create_process_log(log, verify=verify)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*[one(i) for i in range(requests)])
+    return latencies
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    db = Database(mongodb_uri=os.getenv("MONGODB_URI"))
+    await db.connect()
+    db.db = db.client.mcp_benchmark
+    try:
+        for verify in (True, False):
+            latencies = await run(db, args.requests, args.concurrency, verify)
+            label = "insert + find_one (verify)" if verify else "insert only"
+            print(
+                f"{label:28s} p50={percentile(latencies, 50):7.2f}ms "
+                f"p99={percentile(latencies, 99):7.2f}ms "
+                f"mean={statistics.mean(latencies):7.2f}ms"
+            )
+    finally:
+        await db.client.drop_database("mcp_benchmark")
+        await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
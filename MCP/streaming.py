@@ -0,0 +1,27 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional
+
+# 実行中のワークフローのイベント送信先。asyncioのタスクにコンテキストごと引き継がれる
+_emitter: ContextVar[Optional[Callable[[Dict[str, Any]], None]]] = ContextVar("stream_emitter", default=None)
+
+class StreamInterruptedError(RuntimeError):
+    """トークンを送出した後にストリームが途切れた（再試行すると重複するため再試行しない）"""
+
+def is_streaming() -> bool:
+    return _emitter.get() is not None
+
+def emit(event: str, **data: Any):
+    """ストリーミング中であればイベントを送る。そうでなければ何もしない"""
+    emitter = _emitter.get()
+    if emitter is not None:
+        emitter({"event": event, **data})
+
+@contextmanager
+def streaming_to(callback: Callable[[Dict[str, Any]], None]):
+    """このコンテキスト内（および生成されるタスク）の emit を callback に送る"""
+    token = _emitter.set(callback)
+    try:
+        yield
+    finally:
+        _emitter.reset(token)
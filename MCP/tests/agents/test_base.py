@@ -1,6 +1,7 @@
+import asyncio
 import pytest
-from unittest.mock import AsyncMock
-from agents.base import BaseAgent, AgentState
+from unittest.mock import AsyncMock, patch
+from agents.base import BaseAgent, AgentState, agent_state_scope
 from langchain.schema import HumanMessage, SystemMessage
 from langchain_community.chat_models import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
@@ -73,4 +74,57 @@ async def test_agent_state_management(test_agent):
     test_agent.reset_state()
     assert test_agent.state.current_task == ""
     assert test_agent.state.task_status == "pending"
-    assert test_agent.state.artifacts == {} 
\ No newline at end of file
+    assert test_agent.state.artifacts == {} 
+@pytest.mark.asyncio
+async def test_generate_response_retries_rate_limited_calls(test_agent, mock_model):
+    """429を受けた呼び出しを再試行して応答を返すテスト"""
+    class RateLimitError(Exception):
+        pass
+
+    response = mock_model.agenerate.return_value
+    mock_model.agenerate.side_effect = [RateLimitError("429"), response]
+    with patch("rate_limiter.asyncio.sleep", new=AsyncMock()):
+        result = await test_agent._generate_response([HumanMessage(content="hello")])
+
+    assert result == "Test response"
+    assert mock_model.agenerate.await_count == 2
+
+@pytest.mark.asyncio
+async def test_generate_response_streams_tokens_when_streaming():
+    """ストリーミング中はastreamで生成し、トークンごとにイベントを送るテスト"""
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    from llm_cache import LLMResponseCache
+    from streaming import streaming_to
+
+    agent = TestAgent(
+        name="TestAgent",
+        description="Test agent description",
+        model=FakeListChatModel(responses=["abc"]),
+        prompt_template=ChatPromptTemplate.from_messages([("human", "{input}")]),
+        response_cache=LLMResponseCache()
+    )
+    events = []
+    with streaming_to(events.append):
+        first = await agent._generate_response([HumanMessage(content="hello")])
+        second = await agent._generate_response([HumanMessage(content="hello")])
+
+    assert first == second == "abc"
+    assert [e["text"] for e in events] == ["a", "b", "c", "abc"]
+    assert events[-1]["cached"] is True
+    assert all(e["event"] == "token" and e["agent"] == "TestAgent" for e in events)
+
+@pytest.mark.asyncio
+async def test_agent_state_scope_isolates_concurrent_runs(test_agent):
+    """agent_state_scope ごとに状態が分かれ、エージェント自身の状態も変わらないテスト"""
+    async def run(task):
+        with agent_state_scope() as states:
+            test_agent.update_state(current_task=task)
+            await asyncio.sleep(0.01)
+            assert test_agent.state.current_task == task
+            return states
+
+    first, second = await asyncio.gather(run("first"), run("second"))
+
+    assert first["TestAgent"].current_task == "first"
+    assert second["TestAgent"].current_task == "second"
+    assert test_agent.state.current_task == ""
@@ -2,6 +2,7 @@ import pytest
 import json
 from unittest.mock import AsyncMock
 from agents.planner import PlannerAgent
+from llm_cache import LLMResponseCache
 from langchain.chat_models import ChatOpenAI
 
 @pytest.fixture
@@ -100,4 +101,19 @@ async def test_planner_state_updates(planner_agent):
     state = planner_agent.get_state()
     assert state["current_task"] == "テストタスク"
     assert state["task_status"] == "planning_completed"
-    assert "plan" in state["artifacts"] 
\ No newline at end of file
+    assert "plan" in state["artifacts"] 
+@pytest.mark.asyncio
+async def test_planner_reuses_cached_response(mock_model):
+    """同じタスクの計画はキャッシュから返し、refresh_cacheで作り直すテスト"""
+    cache = LLMResponseCache()
+    planner = PlannerAgent(model=mock_model, response_cache=cache)
+
+    first = await planner.process({"task": "夜間バッチ"})
+    second = await planner.process({"task": "夜間バッチ"})
+    assert first["plan"] == second["plan"]
+    assert mock_model.agenerate.await_count == 1
+
+    await planner.process({"task": "夜間バッチ", "refresh_cache": True})
+    await planner.process({"task": "別のタスク"})
+    assert mock_model.agenerate.await_count == 3
+    assert cache.stats()["memory_hits"] == 1
@@ -70,4 +70,39 @@ def setup_test_env():
         "OPENAI_API_KEY"
     ]
     for var in test_env_vars:
-        os.environ.pop(var, None) 
\ No newline at end of file
+        os.environ.pop(var, None) 
+
+class MockCursor:
+    """Motorカーソルのモック（sort/limitの呼び出しを記録し、非同期に反復できる）"""
+    def __init__(self, docs):
+        self.docs = list(docs)
+        self.sort_spec = None
+        self.limit_count = None
+        self.batch = None
+
+    def sort(self, key_or_list, direction=None):
+        self.sort_spec = key_or_list if direction is None else [(key_or_list, direction)]
+        return self
+
+    def limit(self, count):
+        self.limit_count = count
+        return self
+
+    def batch_size(self, size):
+        self.batch = size
+        return self
+
+    async def to_list(self, length=None):
+        return [doc async for doc in self][:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        docs = self.docs[:self.limit_count] if self.limit_count else self.docs
+        for doc in docs:
+            yield dict(doc)
+
+@pytest.fixture
+def mock_cursor():
+    return MockCursor
@@ -1,9 +1,14 @@
 import pytest
+import json
+from datetime import datetime
 from fastapi.testclient import TestClient
 from unittest.mock import patch, AsyncMock
-from mcp_server import app
+from pymongo.errors import ExecutionTimeout
+from mcp_server import app, create_access_token
 from models import Process, SystemPrompt, ProcessLog, ProcessType, ProcessStatus
 from workflow import MCPWorkflow
+from job_queue import JobQueueFull
+from database import BulkLogWriteError
 
 @pytest.fixture
 def client():
@@ -210,4 +215,272 @@ def test_invalid_token(client):
         headers={"Authorization": "Bearer invalid_token"}
     )
     assert response.status_code == 401
-    assert response.json()["detail"] == "Could not validate credentials" 
\ No newline at end of file
+    assert response.json()["detail"] == "Could not validate credentials" 
+@pytest.fixture
+def api_client():
+    """lifespan（DB接続）を起動しないテストクライアント"""
+    return TestClient(app)
+
+@pytest.fixture
+def auth_headers():
+    token = create_access_token(data={"sub": "test"})
+    return {"Authorization": f"Bearer {token}"}
+
+def test_search_processes_passes_filters(api_client, auth_headers):
+    """検索エンドポイントが絞り込み条件と件数をDBに渡すテスト"""
+    with patch("mcp_server.db.search_processes", new=AsyncMock(return_value=[])) as mock_search:
+        response = api_client.get(
+            "/search/processes",
+            params={"query": "deploy", "type": "deployment", "status": "success", "limit": 5},
+            headers=auth_headers
+        )
+
+    assert response.status_code == 200
+    mock_search.assert_awaited_once_with(
+        "deploy", process_type=ProcessType.DEPLOYMENT, status=ProcessStatus.SUCCESS, limit=5
+    )
+
+def test_search_processes_rejects_oversized_limit(api_client, auth_headers):
+    """上限を超える件数指定を拒否するテスト"""
+    response = api_client.get(
+        "/search/processes",
+        params={"query": "deploy", "limit": 10000},
+        headers=auth_headers
+    )
+    assert response.status_code == 422
+
+def test_list_process_logs_pagination(api_client, auth_headers):
+    """ログ一覧が継続トークンをヘッダーで返すテスト"""
+    page = ([{"_id": "log1", "message": "started"}], "next-token")
+    with patch("mcp_server.db.list_process_logs", new=AsyncMock(return_value=page)) as mock_list:
+        response = api_client.get(
+            "/process-logs/proc-1",
+            params={"page_size": 1, "fields": "message, status"},
+            headers=auth_headers
+        )
+
+    assert response.status_code == 200
+    assert response.json() == [{"_id": "log1", "message": "started"}]
+    assert response.headers["X-Next-Cursor"] == "next-token"
+    mock_list.assert_awaited_once_with("proc-1", page_size=1, cursor=None, fields=["message", "status"], include_large=False)
+
+def test_list_processes_typed_response_and_include_large(api_client, auth_headers):
+    """一覧は応答モデルで検証され、取得したフィールドだけを返し、include_large を渡すテスト"""
+    page = ([{"_id": "p1", "name": "deploy", "status": "success", "created_at": datetime(2024, 1, 1), "extra": "x"}], None)
+    with patch("mcp_server.db.list_processes", new=AsyncMock(return_value=page)) as mock_list:
+        response = api_client.get("/processes", params={"include_large": "true"}, headers=auth_headers)
+
+    assert response.status_code == 200
+    assert response.json() == [{"_id": "p1", "name": "deploy", "status": "success", "created_at": "2024-01-01T00:00:00"}]
+    assert "X-Next-Cursor" not in response.headers
+    assert mock_list.call_args.kwargs["include_large"] is True
+
+    schema = api_client.app.openapi()["paths"]["/processes"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+    assert schema["items"]["$ref"].endswith("/ProcessView")
+
+def test_list_processes_invalid_cursor(api_client, auth_headers):
+    """不正な継続トークンで400を返すテスト"""
+    with patch("mcp_server.db.list_processes", new=AsyncMock(side_effect=ValueError("Invalid pagination cursor"))):
+        response = api_client.get("/processes", params={"cursor": "bad"}, headers=auth_headers)
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid pagination cursor"
+
+def test_export_process_logs_ndjson(api_client, auth_headers):
+    """ログをJSON Lines形式でストリーミングするテスト"""
+    async def logs():
+        yield {"_id": "log1", "step_number": 1, "created_at": datetime(2024, 1, 1)}
+        yield {"_id": "log2", "step_number": 2, "created_at": datetime(2024, 1, 2)}
+
+    with patch("mcp_server.db.iter_process_logs", return_value=logs()) as mock_iter:
+        response = api_client.get("/export/process-logs/proc-1", params={"fields": "step_number"}, headers=auth_headers)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines == [
+        {"_id": "log1", "step_number": 1, "created_at": "2024-01-01T00:00:00"},
+        {"_id": "log2", "step_number": 2, "created_at": "2024-01-02T00:00:00"}
+    ]
+    mock_iter.assert_called_once_with("proc-1", fields=["step_number"])
+
+def test_create_process_logs_bulk(api_client, auth_headers):
+    """ログ一括登録エンドポイントのテスト"""
+    logs = [
+        {"process_id": "proc-1", "step_number": i, "status": "success", "message": f"step {i}"}
+        for i in range(3)
+    ]
+    with patch("mcp_server.db.save_process_logs", new=AsyncMock(return_value=["a", "b", "c"])) as mock_save:
+        response = api_client.post(
+            "/process-logs/bulk",
+            params={"write_concern": "majority", "journal": "true"},
+            json=logs,
+            headers=auth_headers
+        )
+
+    assert response.status_code == 200
+    assert response.json() == {"inserted_ids": ["a", "b", "c"], "count": 3}
+    saved_logs = mock_save.call_args.args[0]
+    assert [log.step_number for log in saved_logs] == [0, 1, 2]
+    assert mock_save.call_args.kwargs["write_concern"].document == {"w": "majority", "j": True}
+
+def test_create_process_logs_bulk_partial_failure(api_client, auth_headers):
+    """一部のログが保存できなかった場合は207で保存できた分とエラーを返すテスト"""
+    logs = [
+        {"process_id": "proc-1", "step_number": i, "status": "success", "message": f"step {i}"}
+        for i in range(3)
+    ]
+    error = BulkLogWriteError(["a", "c"], [{"index": 1, "code": 11000, "message": "duplicate key"}])
+    with patch("mcp_server.db.save_process_logs", new=AsyncMock(side_effect=error)):
+        response = api_client.post("/process-logs/bulk", json=logs, headers=auth_headers)
+
+    assert response.status_code == 207
+    assert response.json() == {
+        "inserted_ids": ["a", "c"],
+        "count": 2,
+        "errors": [{"index": 1, "code": 11000, "message": "duplicate key"}]
+    }
+
+def test_create_process_logs_bulk_invalid_write_concern(api_client, auth_headers):
+    """応答なし書き込みとジャーナル指定の組み合わせを拒否するテスト"""
+    response = api_client.post(
+        "/process-logs/bulk",
+        params={"write_concern": "0", "journal": "true"},
+        json=[],
+        headers=auth_headers
+    )
+    assert response.status_code == 400
+
+def test_create_system_prompt_returns_local_model(api_client, auth_headers):
+    """作成エンドポイントが読み直しなしで結果を返すテスト"""
+    prompt = {"name": "test_prompt", "content": "This is a test prompt", "category": "test", "tags": ["test"]}
+    created = SystemPrompt(**prompt).model_copy(update={"id": "abc123"})
+    with patch("mcp_server.db.create_system_prompt", new=AsyncMock(return_value=created)) as mock_create, \
+         patch("mcp_server.db.get_system_prompt", new=AsyncMock()) as mock_get:
+        response = api_client.post("/system-prompts", json=prompt, headers=auth_headers)
+
+    assert response.status_code == 200
+    assert response.json()["_id"] == "abc123"
+    assert mock_create.call_args.kwargs == {"verify": False}
+    mock_get.assert_not_called()
+
+def test_query_timeout_returns_504(api_client, auth_headers):
+    """クエリの実行時間上限超過を504に変換するテスト"""
+    with patch("mcp_server.db.get_process", new=AsyncMock(side_effect=ExecutionTimeout("operation exceeded time limit"))):
+        response = api_client.get("/processes/abc", headers=auth_headers)
+    assert response.status_code == 504
+
+def test_workflow_stream_returns_sse(api_client, auth_headers):
+    """ワークフローのイベントがServer-Sent Eventsで返るテスト"""
+    async def fake_stream(task, process_id=None):
+        yield {"event": "node_start", "node": "planning"}
+        yield {"event": "token", "agent": "Planner", "text": "計画"}
+        yield {"event": "workflow_end", "result": {"task": task}, "metrics": {"time_to_first_token_ms": 1.0, "total_ms": 2.0}}
+
+    with patch("mcp_server.workflow.stream", new=fake_stream):
+        response = api_client.get("/workflow/stream", params={"task": "テスト"}, headers=auth_headers)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    blocks = response.text.strip().split("\n\n")
+    assert blocks[0] == 'event: node_start\ndata: {"event": "node_start", "node": "planning"}'
+    assert blocks[1].startswith("event: token\n")
+    assert json.loads(blocks[2].split("data: ", 1)[1])["result"] == {"task": "テスト"}
+
+def test_execute_workflow_in_background(api_client, auth_headers):
+    """background=trueでジョブIDを返して即座に応答するテスト"""
+    with patch("mcp_server.job_queue.submit", new=AsyncMock(return_value="job-1")) as mock_submit, \
+            patch("mcp_server.workflow.run", new=AsyncMock()) as mock_run:
+        response = api_client.post(
+            "/workflow/execute",
+            params={"task": "テスト", "background": "true"},
+            headers=auth_headers
+        )
+
+    assert response.status_code == 202
+    assert response.json() == {"job_id": "job-1", "status": "pending"}
+    mock_submit.assert_awaited_once_with("テスト", metadata={"submitted_by": "test"}, process_id=None)
+    mock_run.assert_not_called()
+
+def test_execute_workflow_in_background_keeps_process_id(api_client, auth_headers):
+    """background=trueでも process_id をジョブに渡すテスト"""
+    with patch("mcp_server.job_queue.submit", new=AsyncMock(return_value="job-1")) as mock_submit:
+        response = api_client.post(
+            "/workflow/execute",
+            params={"task": "テスト", "background": "true", "process_id": "proc-1"},
+            headers=auth_headers
+        )
+
+    assert response.status_code == 202
+    mock_submit.assert_awaited_once_with("テスト", metadata={"submitted_by": "test"}, process_id="proc-1")
+
+def test_execute_workflow_queue_full_returns_503(api_client, auth_headers):
+    """ジョブキューが満杯なら503を返すテスト"""
+    with patch("mcp_server.job_queue.submit", new=AsyncMock(side_effect=JobQueueFull("full"))):
+        response = api_client.post(
+            "/workflow/execute",
+            params={"task": "テスト", "background": "true"},
+            headers=auth_headers
+        )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+
+def test_get_workflow_job(api_client, auth_headers):
+    """ジョブの状態取得と存在しないジョブの404のテスト"""
+    job = {"job_id": "job-1", "status": "success", "task": "テスト", "result": {"status": "completed"}, "error": None}
+    with patch("mcp_server.job_queue.get", new=AsyncMock(side_effect=[job, None])):
+        found = api_client.get("/workflow/jobs/job-1", headers=auth_headers)
+        missing = api_client.get("/workflow/jobs/job-2", headers=auth_headers)
+
+    assert found.status_code == 200
+    assert found.json()["result"] == {"status": "completed"}
+    assert missing.status_code == 404
+
+def test_cancel_workflow_job(api_client, auth_headers):
+    """キャンセルできないジョブは409を返すテスト"""
+    with patch("mcp_server.job_queue.cancel", new=AsyncMock(side_effect=[True, False])):
+        cancelled = api_client.post("/workflow/jobs/job-1/cancel", headers=auth_headers)
+        finished = api_client.post("/workflow/jobs/job-1/cancel", headers=auth_headers)
+
+    assert cancelled.json() == {"job_id": "job-1", "status": "cancelled"}
+    assert finished.status_code == 409
+
+def test_resume_workflow(api_client, auth_headers):
+    """チェックポイントからの再開と、存在しない実行IDの404のテスト"""
+    resumed = {"task": "テスト", "status": "completed", "results": {}, "error": None, "run_id": "run-1"}
+    with patch("mcp_server.workflow.resume", new=AsyncMock(side_effect=[resumed, KeyError("run-2")])):
+        found = api_client.post("/workflow/resume/run-1", headers=auth_headers)
+        missing = api_client.post("/workflow/resume/run-2", headers=auth_headers)
+
+    assert found.status_code == 200
+    assert found.json()["run_id"] == "run-1"
+    assert missing.status_code == 404
+
+def test_execute_workflow_batch_streams_ndjson(api_client, auth_headers):
+    """バッチ実行の結果がJSON Linesで返り、同時実行数が渡されるテスト"""
+    calls = []
+
+    async def fake_run_many(tasks, concurrency=8):
+        calls.append((tasks, concurrency))
+        for index, task in reversed(list(enumerate(tasks))):
+            yield {"index": index, "task": task, "result": {"status": "completed"}, "error": None, "wait_ms": 0.0, "elapsed_ms": 1.0}
+
+    with patch("mcp_server.workflow.run_many", new=fake_run_many):
+        response = api_client.post(
+            "/workflow/execute-batch",
+            params={"concurrency": 4},
+            json={"tasks": ["a", "b"]},
+            headers=auth_headers
+        )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["task"] for line in lines] == ["b", "a"]
+    assert calls == [(["a", "b"], 4)]
+
+def test_execute_workflow_batch_rejects_oversized_batch(api_client, auth_headers):
+    """上限を超えるタスク数を413で拒否するテスト"""
+    with patch("mcp_server.MAX_BATCH_TASKS", 2):
+        response = api_client.post("/workflow/execute-batch", json={"tasks": ["a", "b", "c"]}, headers=auth_headers)
+    assert response.status_code == 413
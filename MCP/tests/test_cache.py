@@ -0,0 +1,116 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock
+from cache import AsyncTTLCache
+
+@pytest.mark.asyncio
+async def test_hit_and_miss_counters():
+    """2回目以降はキャッシュから返すテスト"""
+    cache = AsyncTTLCache(max_size=10, ttl=60)
+    loader = AsyncMock(return_value="value")
+
+    assert await cache.get_or_load("key", loader) == "value"
+    assert await cache.get_or_load("key", loader) == "value"
+
+    loader.assert_awaited_once()
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+@pytest.mark.asyncio
+async def test_ttl_expiry():
+    """TTLを過ぎたら再読み込みするテスト"""
+    cache = AsyncTTLCache(max_size=10, ttl=0.01)
+    loader = AsyncMock(return_value="value")
+
+    await cache.get_or_load("key", loader)
+    await asyncio.sleep(0.02)
+    await cache.get_or_load("key", loader)
+
+    assert loader.await_count == 2
+
+@pytest.mark.asyncio
+async def test_zero_ttl_disables_caching():
+    """ttl=0 なら値を保持せず毎回読み込むテスト（複数ワーカーで古い値を返さないための設定）"""
+    cache = AsyncTTLCache(max_size=10, ttl=0)
+    loader = AsyncMock(return_value="value")
+
+    await cache.get_or_load("key", loader)
+    await cache.get_or_load("key", loader)
+
+    assert loader.await_count == 2
+    assert cache.stats()["size"] == 0
+
+@pytest.mark.asyncio
+async def test_lru_eviction():
+    """上限を超えたら最も使われていないキーを捨てるテスト"""
+    cache = AsyncTTLCache(max_size=2, ttl=60)
+    await cache.get_or_load("a", AsyncMock(return_value=1))
+    await cache.get_or_load("b", AsyncMock(return_value=2))
+    await cache.get_or_load("a", AsyncMock(return_value=1))  # aを最近使用にする
+    await cache.get_or_load("c", AsyncMock(return_value=3))
+
+    reload_b = AsyncMock(return_value=2)
+    await cache.get_or_load("b", reload_b)
+    reload_b.assert_awaited_once()
+    reload_a = AsyncMock(return_value=1)
+    await cache.get_or_load("a", reload_a)
+    assert cache.stats()["size"] == 2
+
+@pytest.mark.asyncio
+async def test_single_flight():
+    """同時の読み込みを1回にまとめるテスト"""
+    cache = AsyncTTLCache(max_size=10, ttl=60)
+    calls = 0
+
+    async def slow_loader():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "value"
+
+    results = await asyncio.gather(*[cache.get_or_load("key", slow_loader) for _ in range(50)])
+
+    assert results == ["value"] * 50
+    assert calls == 1
+    assert cache.stats()["coalesced"] == 49
+
+@pytest.mark.asyncio
+async def test_single_flight_propagates_errors():
+    """読み込み失敗は待機中の呼び出しにも伝わり、キャッシュされないテスト"""
+    cache = AsyncTTLCache(max_size=10, ttl=60)
+
+    async def failing_loader():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("db down")
+
+    results = await asyncio.gather(
+        *[cache.get_or_load("key", failing_loader) for _ in range(3)],
+        return_exceptions=True
+    )
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert await cache.get_or_load("key", AsyncMock(return_value="ok")) == "ok"
+
+@pytest.mark.asyncio
+async def test_none_is_not_cached():
+    """存在しない（None）結果は保持しないテスト"""
+    cache = AsyncTTLCache(max_size=10, ttl=60)
+    await cache.get_or_load("key", AsyncMock(return_value=None))
+    assert await cache.get_or_load("key", AsyncMock(return_value="created")) == "created"
+
+@pytest.mark.asyncio
+async def test_invalidate_during_load_discards_stale_value():
+    """読み込み中に無効化された値は保持しないテスト"""
+    cache = AsyncTTLCache(max_size=10, ttl=60)
+    started = asyncio.Event()
+
+    async def slow_loader():
+        started.set()
+        await asyncio.sleep(0.01)
+        return "stale"
+
+    task = asyncio.create_task(cache.get_or_load("key", slow_loader))
+    await started.wait()
+    cache.invalidate("key")
+    assert await task == "stale"
+
+    assert await cache.get_or_load("key", AsyncMock(return_value="fresh")) == "fresh"
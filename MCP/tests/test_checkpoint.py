@@ -0,0 +1,109 @@
+import sqlite3
+import time
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+import checkpoint
+from checkpoint import MemoryCheckpointer, SQLiteCheckpointer, MongoCheckpointer, checkpointer_from_env
+
+@pytest.fixture(params=["memory", "sqlite"])
+def checkpointer(request, tmp_path):
+    if request.param == "memory":
+        yield MemoryCheckpointer()
+    else:
+        saver = SQLiteCheckpointer(str(tmp_path / "checkpoints.db"))
+        yield saver
+        saver.close()
+
+@pytest.mark.asyncio
+async def test_save_load_delete(checkpointer):
+    """ノードごとに保存した結果を実行IDでまとめて読み出せるテスト"""
+    await checkpointer.save("run-1", "planning", {"plan_result": "plan"})
+    await checkpointer.save("run-1", "research", {"research_result": {"findings": ["a"]}})
+    await checkpointer.save("run-1", "planning", {"plan_result": "plan v2"})
+    await checkpointer.save("run-2", "planning", {"plan_result": "other"})
+
+    assert await checkpointer.load("run-1") == {
+        "planning": {"plan_result": "plan v2"},
+        "research": {"research_result": {"findings": ["a"]}}
+    }
+
+    await checkpointer.delete("run-1")
+    assert await checkpointer.load("run-1") == {}
+    assert await checkpointer.load("run-2") == {"planning": {"plan_result": "other"}}
+
+@pytest.mark.asyncio
+async def test_prune_removes_expired_runs(checkpointer, monkeypatch):
+    """最後の保存から保持期間を過ぎた実行だけが削除されるテスト（失敗した実行も残り続けない）"""
+    checkpointer.ttl_seconds = 60
+    now = time.time()
+    monkeypatch.setattr(checkpoint.time, "time", lambda: now - 120)
+    await checkpointer.save("failed-run", "planning", {"plan_result": "old"})
+    await checkpointer.save("active-run", "planning", {"plan_result": "old"})
+    monkeypatch.setattr(checkpoint.time, "time", lambda: now)
+    await checkpointer.save("active-run", "research", {"research_result": {}})
+
+    assert await checkpointer.prune() == 1
+    assert await checkpointer.load("failed-run") == {}
+    assert set(await checkpointer.load("active-run")) == {"planning", "research"}
+
+    checkpointer.ttl_seconds = 0
+    monkeypatch.setattr(checkpoint.time, "time", lambda: now + 3600)
+    assert await checkpointer.prune() == 0
+
+@pytest.mark.asyncio
+async def test_sqlite_adds_updated_at_to_old_schema(tmp_path):
+    """updated_at のない以前のファイルも開けて、既存の行は今から保持期間を数えるテスト"""
+    path = str(tmp_path / "checkpoints.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE workflow_checkpoints ("
+        "run_id TEXT NOT NULL, node TEXT NOT NULL, data TEXT NOT NULL, PRIMARY KEY (run_id, node))"
+    )
+    conn.execute("INSERT INTO workflow_checkpoints VALUES ('run-1', 'planning', '{}')")
+    conn.commit()
+    conn.close()
+
+    saver = SQLiteCheckpointer(path, ttl_seconds=60)
+    assert await saver.prune() == 0
+    assert await saver.load("run-1") == {"planning": {}}
+    saver.close()
+
+@pytest.mark.asyncio
+async def test_sqlite_checkpoints_survive_reopen(tmp_path):
+    """SQLiteのチェックポイントが再接続後も残るテスト"""
+    path = str(tmp_path / "checkpoints.db")
+    first = SQLiteCheckpointer(path)
+    await first.save("run-1", "planning", {"plan_result": "計画"})
+    first.close()
+
+    second = SQLiteCheckpointer(path)
+    assert await second.load("run-1") == {"planning": {"plan_result": "計画"}}
+    second.close()
+
+@pytest.mark.asyncio
+async def test_mongo_checkpointer_delegates_to_database():
+    """MongoCheckpointerがDatabaseのチェックポイント操作を使うテスト"""
+    db = MagicMock()
+    db.save_workflow_checkpoint = AsyncMock()
+    db.get_workflow_checkpoints = AsyncMock(return_value={"planning": {"plan_result": "plan"}})
+    db.delete_workflow_checkpoints = AsyncMock(return_value=1)
+    checkpointer = MongoCheckpointer(db)
+
+    await checkpointer.save("run-1", "planning", {"plan_result": "plan"})
+    assert await checkpointer.load("run-1") == {"planning": {"plan_result": "plan"}}
+    await checkpointer.delete("run-1")
+
+    db.save_workflow_checkpoint.assert_awaited_once_with("run-1", "planning", {"plan_result": "plan"})
+    db.delete_workflow_checkpoints.assert_awaited_once_with("run-1")
+
+def test_checkpointer_from_env(monkeypatch, tmp_path):
+    """既定では保存せず、永続的なチェックポイントは指定した場合だけ使うテスト"""
+    db = MagicMock()
+    monkeypatch.delenv("WORKFLOW_CHECKPOINTER", raising=False)
+    assert checkpointer_from_env(db) is None
+    monkeypatch.setenv("WORKFLOW_CHECKPOINTER", "mongo")
+    assert isinstance(checkpointer_from_env(db), MongoCheckpointer)
+    monkeypatch.setenv("WORKFLOW_CHECKPOINTER", "memory")
+    assert isinstance(checkpointer_from_env(db), MemoryCheckpointer)
+    monkeypatch.setenv("WORKFLOW_CHECKPOINTER", "none")
+    assert checkpointer_from_env(db) is None
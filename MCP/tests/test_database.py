@@ -1,8 +1,12 @@
 import pytest
-from database import Database
+from database import BulkLogWriteError, Database, encode_cursor, decode_cursor
 from models import Process, SystemPrompt, ProcessLog, ProcessStatus, ProcessType
-from datetime import datetime
-from unittest.mock import patch, AsyncMock
+from datetime import datetime, timedelta
+from unittest.mock import patch, AsyncMock, MagicMock
+from bson import ObjectId
+from pymongo import TEXT
+from pymongo.errors import BulkWriteError, OperationFailure
+from pymongo.write_concern import WriteConcern
 
 @pytest.fixture
 async def db(mock_mongo_client):
@@ -144,4 +148,424 @@ async def test_process_status_update(db):
         ProcessStatus.SUCCESS,
         error_message=None
     )
-    assert updated.status == ProcessStatus.SUCCESS 
\ No newline at end of file
+    assert updated.status == ProcessStatus.SUCCESS 
+@pytest.fixture
+def offline_db():
+    """接続せずにコレクションをモックしたDatabase"""
+    test_db = Database(mongodb_uri="mongodb://localhost:27017")
+    test_db.db = MagicMock()
+    return test_db
+
+def _process_doc(name, **kwargs):
+    doc = {
+        "_id": ObjectId(),
+        "name": name,
+        "type": ProcessType.SCRAPING.value,
+        "description": f"{name} description",
+        "steps": [],
+        "status": ProcessStatus.PENDING.value
+    }
+    doc.update(kwargs)
+    return doc
+
+@pytest.mark.asyncio
+async def test_init_indexes_matches_query_shapes(offline_db):
+    """実際のフィールドとクエリの形に合ったインデックスを作成するテスト"""
+    for collection in (offline_db.db.processes, offline_db.db.system_prompts, offline_db.db.process_logs,
+                       offline_db.db.workflow_checkpoints):
+        collection.create_indexes = AsyncMock(return_value=[])
+        collection.create_index = AsyncMock(return_value="index")
+        collection.drop_index = AsyncMock(side_effect=OperationFailure("index not found"))
+
+    await offline_db.init_indexes()
+
+    def keys(collection):
+        return [list(model.document["key"].items()) for model in collection.create_indexes.call_args.args[0]]
+
+    process_keys = keys(offline_db.db.processes)
+    prompt_keys = keys(offline_db.db.system_prompts)
+    log_keys = keys(offline_db.db.process_logs)
+    assert [("status", 1), ("updated_at", -1)] in process_keys
+    assert [("name", TEXT), ("description", TEXT)] in process_keys
+    assert [("name", TEXT), ("content", TEXT), ("tags", TEXT)] in prompt_keys
+    assert [("process_id", 1), ("step_number", 1)] in log_keys
+    assert [("process_id", 1), ("created_at", 1), ("_id", 1)] in log_keys
+    assert [("run_id", 1), ("node", 1)] in keys(offline_db.db.workflow_checkpoints)
+    assert not any(field in ("process_type", "timestamp") for index in process_keys + log_keys for field, _ in index)
+    # 旧インデックスは削除を試みる（存在しなくてもエラーにしない）
+    offline_db.db.processes.drop_index.assert_any_await("process_type_1")
+    offline_db.db.process_logs.drop_index.assert_any_await("timestamp_1")
+    # TTL未設定ではTTLインデックスを作らない
+    offline_db.db.process_logs.create_index.assert_not_called()
+    # チェックポイントは失敗した実行の分も残らないよう、既定でTTLインデックスを作る
+    offline_db.db.workflow_checkpoints.create_index.assert_awaited_once_with(
+        "updated_at", name="updated_at_ttl", expireAfterSeconds=offline_db.checkpoint_ttl_seconds
+    )
+
+@pytest.mark.asyncio
+async def test_init_indexes_checkpoint_ttl_disabled(offline_db):
+    """チェックポイントの保持期間を0にするとTTLインデックスを削除するテスト"""
+    offline_db.checkpoint_ttl_seconds = 0
+    for collection in (offline_db.db.processes, offline_db.db.system_prompts, offline_db.db.process_logs,
+                       offline_db.db.workflow_checkpoints):
+        collection.create_indexes = AsyncMock(return_value=[])
+        collection.create_index = AsyncMock(return_value="index")
+        collection.drop_index = AsyncMock()
+
+    await offline_db.init_indexes()
+
+    offline_db.db.workflow_checkpoints.create_index.assert_not_called()
+    offline_db.db.workflow_checkpoints.drop_index.assert_any_await("updated_at_ttl")
+
+@pytest.mark.asyncio
+async def test_init_indexes_log_ttl(offline_db):
+    """ログ保持期間を指定するとTTLインデックスを作成し、変更時はcollModで更新するテスト"""
+    offline_db.log_ttl_days = 30
+    for collection in (offline_db.db.processes, offline_db.db.system_prompts, offline_db.db.process_logs,
+                       offline_db.db.workflow_checkpoints):
+        collection.create_indexes = AsyncMock(return_value=[])
+        collection.drop_index = AsyncMock()
+    offline_db.db.process_logs.create_index = AsyncMock(side_effect=OperationFailure("IndexOptionsConflict"))
+    offline_db.db.workflow_checkpoints.create_index = AsyncMock(return_value="updated_at_ttl")
+    offline_db.db.command = AsyncMock(return_value={"ok": 1})
+
+    await offline_db.init_indexes()
+
+    offline_db.db.process_logs.create_index.assert_awaited_once_with(
+        "created_at", name="created_at_ttl", expireAfterSeconds=30 * 24 * 60 * 60
+    )
+    offline_db.db.command.assert_awaited_once_with(
+        "collMod", "process_logs",
+        index={"name": "created_at_ttl", "expireAfterSeconds": 30 * 24 * 60 * 60}
+    )
+
+@pytest.mark.asyncio
+async def test_search_processes_pushes_query_to_server(offline_db, mock_cursor):
+    """検索条件がサーバー側に渡され、関連度順・件数制限されるテスト"""
+    cursor = mock_cursor([_process_doc("scraper", score=2.0), _process_doc("crawler", score=1.0)])
+    offline_db.db.processes.find.return_value = cursor
+
+    results = await offline_db.search_processes(
+        "scraper", process_type=ProcessType.SCRAPING, status=ProcessStatus.PENDING, limit=10
+    )
+
+    criteria, projection = offline_db.db.processes.find.call_args.args
+    assert criteria == {
+        "$text": {"$search": "scraper"},
+        "type": ProcessType.SCRAPING,
+        "status": ProcessStatus.PENDING
+    }
+    assert projection == {"score": {"$meta": "textScore"}}
+    assert cursor.sort_spec == [("score", {"$meta": "textScore"})]
+    assert cursor.limit_count == 10
+    assert [p.name for p in results] == ["scraper", "crawler"]
+    assert isinstance(results[0].id, str)
+
+@pytest.mark.asyncio
+async def test_search_processes_without_query(offline_db, mock_cursor):
+    """クエリなしでは絞り込みのみで新しい順に返すテスト"""
+    cursor = mock_cursor([_process_doc("p1")])
+    offline_db.db.processes.find.return_value = cursor
+
+    results = await offline_db.search_processes("", limit=0)
+
+    assert offline_db.db.processes.find.call_args.args == ({}, None)
+    assert cursor.sort_spec == [("created_at", -1)]
+    assert cursor.limit_count == 0
+    assert len(results) == 1
+
+@pytest.mark.asyncio
+async def test_search_system_prompts_filters(offline_db, mock_cursor):
+    """システムプロンプト検索のフィルタテスト"""
+    cursor = mock_cursor([{
+        "_id": ObjectId(),
+        "name": "planner",
+        "content": "plan things",
+        "category": "agent",
+        "tags": ["planning"]
+    }])
+    offline_db.db.system_prompts.find.return_value = cursor
+
+    results = await offline_db.search_system_prompts("plan", category="agent", tag="planning")
+
+    criteria, _ = offline_db.db.system_prompts.find.call_args.args
+    assert criteria == {"$text": {"$search": "plan"}, "category": "agent", "tags": "planning"}
+    assert cursor.limit_count == 50
+    assert results[0].tags == ["planning"]
+
+@pytest.mark.asyncio
+async def test_list_processes_keyset_pagination(offline_db, mock_cursor):
+    """キーセットページングと大きなフィールドの除外テスト"""
+    base = datetime(2024, 1, 1)
+    docs = [_process_doc(f"p{i}", created_at=base - timedelta(minutes=i)) for i in range(3)]
+    cursor = mock_cursor(docs)
+    offline_db.db.processes.find.return_value = cursor
+
+    items, next_cursor = await offline_db.list_processes(page_size=2)
+
+    criteria, projection = offline_db.db.processes.find.call_args.args
+    assert criteria == {}
+    assert projection == {"steps": 0}
+    assert cursor.sort_spec == [("created_at", -1), ("_id", -1)]
+    assert cursor.limit_count == 3
+    assert [item["name"] for item in items] == ["p0", "p1"]
+    assert isinstance(items[0]["_id"], str)
+    assert decode_cursor(next_cursor) == (docs[1]["created_at"], docs[1]["_id"])
+
+    # 継続トークンを渡すと続きから取得する
+    offline_db.db.processes.find.return_value = mock_cursor(docs[2:])
+    items, next_cursor = await offline_db.list_processes(page_size=2, cursor=encode_cursor(docs[1]))
+    criteria, _ = offline_db.db.processes.find.call_args.args
+    assert criteria["$or"] == [
+        {"created_at": {"$lt": docs[1]["created_at"]}},
+        {"created_at": docs[1]["created_at"], "_id": {"$lt": docs[1]["_id"]}}
+    ]
+    assert [item["name"] for item in items] == ["p2"]
+    assert next_cursor is None
+
+@pytest.mark.asyncio
+async def test_list_process_logs_projection(offline_db, mock_cursor):
+    """ログは古い順に、指定フィールドのみ取得するテスト"""
+    cursor = mock_cursor([])
+    offline_db.db.process_logs.find.return_value = cursor
+
+    await offline_db.list_process_logs("proc-1", page_size=10, fields=["message", "status"])
+
+    criteria, projection = offline_db.db.process_logs.find.call_args.args
+    assert criteria == {"process_id": "proc-1"}
+    assert projection == {"message": 1, "status": 1, "created_at": 1}
+    assert cursor.sort_spec == [("created_at", 1), ("_id", 1)]
+
+@pytest.mark.asyncio
+async def test_list_system_prompts_include_large(offline_db, mock_cursor):
+    """include_large を指定すると大きなフィールドも取得するテスト"""
+    offline_db.db.system_prompts.find.return_value = mock_cursor([])
+
+    await offline_db.list_system_prompts(page_size=10)
+    assert offline_db.db.system_prompts.find.call_args.args[1] == {"content": 0}
+
+    offline_db.db.system_prompts.find.return_value = mock_cursor([])
+    await offline_db.list_system_prompts(page_size=10, include_large=True)
+    assert offline_db.db.system_prompts.find.call_args.args[1] is None
+
+def test_decode_cursor_rejects_garbage():
+    """不正な継続トークンのテスト"""
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+
+@pytest.mark.asyncio
+async def test_iter_process_logs_streams_from_cursor(offline_db, mock_cursor):
+    """ログをカーソルから1件ずつ返すテスト"""
+    log_ids = [ObjectId(), ObjectId()]
+    cursor = mock_cursor([
+        {"_id": log_id, "process_id": "proc-1", "step_number": i, "status": "success", "message": f"step {i}"}
+        for i, log_id in enumerate(log_ids)
+    ])
+    offline_db.db.process_logs.find.return_value = cursor
+
+    docs = [doc async for doc in offline_db.iter_process_logs("proc-1")]
+
+    assert offline_db.db.process_logs.find.call_args.args == ({"process_id": "proc-1"}, None)
+    assert cursor.sort_spec == [("created_at", 1), ("_id", 1)]
+    assert cursor.batch == 500
+    assert [doc["_id"] for doc in docs] == [str(log_id) for log_id in log_ids]
+
+@pytest.mark.asyncio
+async def test_save_process_logs_bulk(offline_db):
+    """ログを順序なしinsert_manyで一括保存し、再読み込みしないテスト"""
+    logs = [
+        ProcessLog(process_id="proc-1", step_number=i, status=ProcessStatus.SUCCESS, message=f"step {i}")
+        for i in range(10000)
+    ]
+    inserted_ids = [ObjectId() for _ in logs]
+    collection = offline_db.db.process_logs.with_options.return_value
+    collection.insert_many = AsyncMock(return_value=MagicMock(inserted_ids=inserted_ids))
+    concern = WriteConcern(w=0)
+
+    result = await offline_db.save_process_logs(logs, write_concern=concern)
+
+    offline_db.db.process_logs.with_options.assert_called_once_with(write_concern=concern)
+    docs = collection.insert_many.call_args.args[0]
+    assert len(docs) == 10000
+    assert "id" not in docs[0]
+    assert collection.insert_many.call_args.kwargs == {"ordered": False}
+    assert result == [str(inserted_id) for inserted_id in inserted_ids]
+    offline_db.db.process_logs.find_one.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_save_process_logs_partial_failure(offline_db):
+    """一部のログが保存できなかった場合、保存できた分のIDとインデックスごとのエラーを返すテスト"""
+    logs = [
+        ProcessLog(process_id="proc-1", step_number=i, status=ProcessStatus.SUCCESS, message=f"step {i}")
+        for i in range(3)
+    ]
+
+    async def insert_many(docs, ordered):
+        for doc in docs:
+            doc["_id"] = ObjectId()  # ドライバと同じく送信前に _id を付ける
+        raise BulkWriteError({
+            "nInserted": 2,
+            "writeErrors": [{"index": 1, "code": 11000, "errmsg": "E11000 duplicate key error"}],
+            "writeConcernErrors": []
+        })
+
+    offline_db.db.process_logs.insert_many = AsyncMock(side_effect=insert_many)
+
+    with pytest.raises(BulkLogWriteError) as excinfo:
+        await offline_db.save_process_logs(logs)
+
+    docs = offline_db.db.process_logs.insert_many.call_args.args[0]
+    assert excinfo.value.inserted_ids == [str(docs[0]["_id"]), str(docs[2]["_id"])]
+    assert excinfo.value.errors == [{"index": 1, "code": 11000, "message": "E11000 duplicate key error"}]
+
+@pytest.mark.asyncio
+async def test_save_process_logs_empty(offline_db):
+    """空リストではDBにアクセスしないテスト"""
+    assert await offline_db.save_process_logs([]) == []
+    offline_db.db.process_logs.insert_many.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_get_system_prompt_is_cached(offline_db):
+    """システムプロンプトの取得がキャッシュされるテスト"""
+    prompt_id = ObjectId()
+    offline_db.db.system_prompts.find_one = AsyncMock(return_value={
+        "_id": prompt_id, "name": "planner", "content": "plan", "category": "agent", "tags": []
+    })
+
+    first = await offline_db.get_system_prompt(str(prompt_id))
+    first.content = "mutated"
+    second = await offline_db.get_system_prompt(str(prompt_id))
+
+    offline_db.db.system_prompts.find_one.assert_awaited_once()
+    assert second.content == "plan"
+    assert second.id == str(prompt_id)
+    assert offline_db.cache.stats()["hits"] == 1
+
+@pytest.mark.asyncio
+async def test_update_process_status_invalidates_cache(offline_db):
+    """ステータス更新でキャッシュが無効化されるテスト"""
+    process_id = ObjectId()
+    offline_db.db.processes.find_one = AsyncMock(side_effect=[
+        _process_doc("p", _id=process_id, status=ProcessStatus.PENDING.value),
+        _process_doc("p", _id=process_id, status=ProcessStatus.SUCCESS.value)
+    ])
+    offline_db.db.processes.update_one = AsyncMock(return_value=MagicMock(modified_count=1))
+
+    assert (await offline_db.get_process(str(process_id))).status == ProcessStatus.PENDING
+    assert await offline_db.update_process_status(str(process_id), ProcessStatus.SUCCESS)
+    assert (await offline_db.get_process(str(process_id))).status == ProcessStatus.SUCCESS
+    assert offline_db.db.processes.find_one.await_count == 2
+
+@pytest.mark.asyncio
+async def test_create_process_skips_read_back(offline_db):
+    """作成時に読み直さず、挿入IDを付与したモデルを返すテスト"""
+    inserted_id = ObjectId()
+    offline_db.db.processes.insert_one = AsyncMock(return_value=MagicMock(inserted_id=inserted_id))
+    offline_db.db.processes.find_one = AsyncMock()
+    process = Process(
+        name="テストプロセス",
+        type=ProcessType.SCRAPING,
+        description="テスト用プロセス",
+        steps=[{"step": 1, "action": "test"}],
+        status=ProcessStatus.PENDING
+    )
+
+    created = await offline_db.create_process(process)
+
+    assert created.id == str(inserted_id)
+    assert created.name == process.name
+    assert process.id is None
+    offline_db.db.processes.find_one.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_create_process_log_verify_reads_back(offline_db):
+    """verify指定時はDBから読み直すテスト"""
+    inserted_id = ObjectId()
+    offline_db.db.process_logs.insert_one = AsyncMock(return_value=MagicMock(inserted_id=inserted_id))
+    offline_db.db.process_logs.find_one = AsyncMock(return_value={
+        "_id": inserted_id, "process_id": "proc-1", "step_number": 1, "status": "success", "message": "stored"
+    })
+    log = ProcessLog(process_id="proc-1", step_number=1, status=ProcessStatus.SUCCESS, message="local")
+
+    created = await offline_db.create_process_log(log, verify=True)
+
+    assert offline_db.db.process_logs.find_one.call_args.args == ({"_id": inserted_id},)
+    assert created.message == "stored"
+
+def test_client_options_from_env(monkeypatch):
+    """接続オプションを環境変数から読み込み、引数で上書きできるテスト"""
+    monkeypatch.setenv("MONGO_MAX_POOL_SIZE", "200")
+    monkeypatch.setenv("MONGO_MIN_POOL_SIZE", "10")
+    monkeypatch.setenv("MONGO_COMPRESSORS", "zstd,snappy")
+    monkeypatch.setenv("MONGO_READ_PREFERENCE", "secondaryPreferred")
+    monkeypatch.setenv("MONGO_MAX_TIME_MS", "5000")
+
+    test_db = Database(mongodb_uri="mongodb://localhost:27017", client_options={"minPoolSize": 20})
+
+    assert test_db.client_options == {
+        "maxPoolSize": 200,
+        "minPoolSize": 20,
+        "compressors": "zstd,snappy",
+        "readPreference": "secondaryPreferred"
+    }
+    assert test_db.max_time_ms == 5000
+
+@pytest.mark.asyncio
+async def test_connect_passes_pool_options_and_listener():
+    """接続時にプール設定とメトリクスのリスナーを渡すテスト"""
+    test_db = Database(mongodb_uri="mongodb://localhost:27017", client_options={"maxPoolSize": 50})
+    with patch("database.AsyncIOMotorClient") as mock_client:
+        mock_client.return_value.admin.command = AsyncMock(return_value={"ok": 1})
+        await test_db.connect()
+
+    mock_client.assert_called_once_with(
+        "mongodb://localhost:27017",
+        event_listeners=[test_db.pool_metrics],
+        maxPoolSize=50
+    )
+    assert test_db.stats()["pool"]["checkouts"] == 0
+
+@pytest.mark.asyncio
+async def test_reads_apply_max_time_ms(offline_db, mock_cursor):
+    """読み込みクエリにmaxTimeMSを付与するテスト"""
+    offline_db.max_time_ms = 250
+    offline_db.db.processes.find.return_value = mock_cursor([])
+    offline_db.db.processes.find_one = AsyncMock(return_value=None)
+
+    await offline_db.search_processes("deploy")
+    await offline_db.get_process(str(ObjectId()))
+
+    assert offline_db.db.processes.find.call_args.kwargs == {"max_time_ms": 250}
+    assert offline_db.db.processes.find_one.call_args.kwargs == {"max_time_ms": 250}
+
+@pytest.mark.asyncio
+async def test_update_process_sets_fields_and_invalidates_cache(offline_db):
+    """任意フィールドの更新でupdated_atを付与し、キャッシュを無効化するテスト"""
+    process_id = str(ObjectId())
+    offline_db.db.processes.update_one = AsyncMock(return_value=MagicMock(modified_count=1))
+    offline_db.cache.invalidate = MagicMock()
+
+    assert await offline_db.update_process(process_id, {"status": ProcessStatus.SUCCESS, "metadata.result": {"ok": True}})
+
+    update = offline_db.db.processes.update_one.call_args.args[1]["$set"]
+    assert update["metadata.result"] == {"ok": True}
+    assert "updated_at" in update
+    offline_db.cache.invalidate.assert_called_once_with(("processes", process_id))
+
+@pytest.mark.asyncio
+async def test_workflow_checkpoints(offline_db, mock_cursor):
+    """チェックポイントを (実行ID, ノード) でupsertし、ノードごとにまとめて読むテスト"""
+    offline_db.db.workflow_checkpoints.update_one = AsyncMock()
+    offline_db.db.workflow_checkpoints.find.return_value = mock_cursor([
+        {"node": "planning", "data": {"plan_result": "plan"}},
+        {"node": "research", "data": {"research_result": "findings"}}
+    ])
+
+    await offline_db.save_workflow_checkpoint("run-1", "planning", {"plan_result": "plan"})
+    checkpoints = await offline_db.get_workflow_checkpoints("run-1")
+
+    criteria, update = offline_db.db.workflow_checkpoints.update_one.call_args.args
+    assert criteria == {"run_id": "run-1", "node": "planning"}
+    assert update["$set"]["data"] == {"plan_result": "plan"}
+    assert offline_db.db.workflow_checkpoints.update_one.call_args.kwargs == {"upsert": True}
+    assert checkpoints == {"planning": {"plan_result": "plan"}, "research": {"research_result": "findings"}}
@@ -0,0 +1,76 @@
+import os
+import pytest
+from database import Database
+from models import Process, ProcessLog, ProcessStatus, ProcessType
+
+# docker-compose.test.yml のMongoDBなど、実サーバーがある場合のみ実行する
+MONGODB_TEST_URI = os.getenv("MONGODB_TEST_URI")
+
+pytestmark = pytest.mark.skipif(not MONGODB_TEST_URI, reason="MONGODB_TEST_URI is not set")
+
+def plan_stages(plan):
+    """explain() の実行計画に含まれるステージ名を再帰的に集める"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(plan_stages(value))
+    return stages
+
+@pytest.fixture
+async def live_db():
+    test_db = Database(mongodb_uri=MONGODB_TEST_URI)
+    await test_db.connect()
+    test_db.db = test_db.client.mcp_index_test
+    await test_db.init_indexes()
+    for i in range(20):
+        await test_db.save_process(Process(
+            name=f"process {i}",
+            type=ProcessType.DEPLOYMENT,
+            description="deploy the service",
+            steps=[],
+            status=ProcessStatus.IN_PROGRESS if i % 2 else ProcessStatus.SUCCESS
+        ))
+    await test_db.save_process_logs([
+        ProcessLog(process_id=f"proc-{i % 4}", step_number=i, status=ProcessStatus.SUCCESS, message="ok")
+        for i in range(40)
+    ])
+    yield test_db
+    await test_db.client.drop_database("mcp_index_test")
+    await test_db.close()
+
+async def assert_index_scan(cursor):
+    explain = await cursor.explain()
+    stages = plan_stages(explain["queryPlanner"]["winningPlan"])
+    assert "COLLSCAN" not in stages
+    assert "IXSCAN" in stages or "TEXT_MATCH" in stages
+
+@pytest.mark.asyncio
+async def test_process_log_queries_use_indexes(live_db):
+    """ログ取得・ページングがインデックスを使うテスト"""
+    logs = live_db.db.process_logs
+    await assert_index_scan(logs.find({"process_id": "proc-1"}).sort([("created_at", 1), ("_id", 1)]))
+    await assert_index_scan(logs.find({"process_id": "proc-1", "step_number": 5}))
+
+@pytest.mark.asyncio
+async def test_process_queries_use_indexes(live_db):
+    """プロセス一覧・状態別取得・全文検索がインデックスを使うテスト"""
+    processes = live_db.db.processes
+    await assert_index_scan(processes.find({}).sort([("created_at", -1), ("_id", -1)]))
+    await assert_index_scan(processes.find({"status": "in_progress"}).sort("updated_at", -1))
+    await assert_index_scan(processes.find({"type": "deployment", "status": "success"}).sort("created_at", -1))
+    await assert_index_scan(processes.find({"$text": {"$search": "deploy"}}))
+
+@pytest.mark.asyncio
+async def test_init_indexes_is_idempotent(live_db):
+    """インデックス初期化を繰り返してもエラーにならないテスト"""
+    live_db.log_ttl_days = 7
+    await live_db.init_indexes()
+    live_db.log_ttl_days = 14
+    await live_db.init_indexes()
+    info = await live_db.db.process_logs.index_information()
+    assert info["created_at_ttl"]["expireAfterSeconds"] == 14 * 24 * 60 * 60
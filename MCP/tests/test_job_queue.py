@@ -0,0 +1,204 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock
+from bson import ObjectId
+from job_queue import WorkflowJobQueue, JobQueueFull
+from models import Process, ProcessType, ProcessStatus
+
+@pytest.fixture
+def mock_db():
+    db = AsyncMock()
+    db.save_process.side_effect = lambda process: str(ObjectId())
+    db.update_process.return_value = True
+    return db
+
+def statuses(mock_db, job_id):
+    """update_process に渡された状態の履歴"""
+    return [
+        call.args[1]["status"] for call in mock_db.update_process.call_args_list
+        if call.args[0] == job_id
+    ]
+
+@pytest.mark.asyncio
+async def test_submit_returns_immediately_and_persists_result(mock_db):
+    """submitはすぐにIDを返し、結果がProcessに書き戻されるテスト"""
+    finished = asyncio.Event()
+
+    async def runner(task, process_id=None):
+        await finished.wait()
+        return {"task": task, "status": "completed", "results": {"plan": "p"}, "error": None}
+
+    queue = WorkflowJobQueue(mock_db, runner, max_workers=1)
+    queue.start()
+    job_id = await queue.submit("テストタスク", metadata={"submitted_by": "test"})
+
+    saved = mock_db.save_process.call_args.args[0]
+    assert saved.type == ProcessType.WORKFLOW
+    assert saved.status == ProcessStatus.PENDING
+    assert saved.metadata == {"submitted_by": "test", "task": "テストタスク"}
+
+    await asyncio.sleep(0.01)
+    assert statuses(mock_db, job_id) == [ProcessStatus.IN_PROGRESS]
+    finished.set()
+    await asyncio.sleep(0.01)
+
+    assert statuses(mock_db, job_id) == [ProcessStatus.IN_PROGRESS, ProcessStatus.SUCCESS]
+    updates = mock_db.update_process.call_args.args[1]
+    assert updates["metadata.result"]["results"] == {"plan": "p"}
+    assert queue.stats()["completed"] == 1
+    await queue.close()
+
+@pytest.mark.asyncio
+async def test_workers_bound_concurrency(mock_db):
+    """同時に実行されるジョブ数がワーカー数を超えないテスト"""
+    active = 0
+    peak = 0
+
+    async def runner(task, process_id=None):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.02)
+        active -= 1
+        return {"status": "completed"}
+
+    queue = WorkflowJobQueue(mock_db, runner, max_workers=2)
+    queue.start()
+    for i in range(6):
+        await queue.submit(f"task {i}")
+    await queue._queue.join()
+
+    assert peak == 2
+    assert queue.stats()["completed"] == 6
+    await queue.close()
+
+@pytest.mark.asyncio
+async def test_submit_rejects_when_queue_full(mock_db):
+    """待ち行列が満杯ならJobQueueFullを送出するテスト"""
+    queue = WorkflowJobQueue(mock_db, AsyncMock(), max_workers=1, max_queue_size=1)
+    queue.start()
+    for worker in queue._workers:
+        worker.cancel()
+    queue._workers = [asyncio.create_task(asyncio.sleep(60))]
+
+    await queue.submit("first")
+    with pytest.raises(JobQueueFull):
+        await queue.submit("second")
+    assert mock_db.save_process.await_count == 1
+    assert queue.stats()["rejected"] == 1
+    await queue.close()
+
+@pytest.mark.asyncio
+async def test_cancel_pending_and_running_jobs(mock_db):
+    """待機中・実行中のジョブをキャンセルできるテスト"""
+    started = asyncio.Event()
+    runner_calls = []
+
+    async def runner(task, process_id=None):
+        runner_calls.append(task)
+        started.set()
+        await asyncio.sleep(60)
+
+    queue = WorkflowJobQueue(mock_db, runner, max_workers=1)
+    queue.start()
+    running_id = await queue.submit("running")
+    pending_id = await queue.submit("pending")
+    await started.wait()
+
+    assert await queue.cancel(pending_id)
+    assert await queue.cancel(running_id)
+    await asyncio.sleep(0.01)
+
+    assert runner_calls == ["running"]
+    assert statuses(mock_db, pending_id) == [ProcessStatus.CANCELLED]
+    assert statuses(mock_db, running_id) == [ProcessStatus.IN_PROGRESS, ProcessStatus.CANCELLED]
+    assert not await queue.cancel(running_id)
+    assert queue.running
+    await queue.close()
+
+@pytest.mark.asyncio
+async def test_process_id_is_passed_to_runner(mock_db):
+    """process_id を指定したジョブはそのProcessにログを積み、省略時はジョブIDを使うテスト"""
+    calls = []
+
+    async def runner(task, process_id=None):
+        calls.append((task, process_id))
+        return {"task": task, "status": "completed"}
+
+    queue = WorkflowJobQueue(mock_db, runner, max_workers=1)
+    queue.start()
+    await queue.submit("with process", process_id="proc-1")
+    job_id = await queue.submit("without process")
+    await asyncio.sleep(0.01)
+
+    assert calls == [("with process", "proc-1"), ("without process", job_id)]
+    assert mock_db.save_process.call_args_list[0].args[0].metadata["process_id"] == "proc-1"
+    await queue.close()
+
+@pytest.mark.asyncio
+async def test_close_cancels_pending_jobs(mock_db):
+    """停止時に待機中のジョブをpendingのまま残さずキャンセル済みにするテスト"""
+    started = asyncio.Event()
+
+    async def runner(task, process_id=None):
+        started.set()
+        await asyncio.sleep(60)
+
+    queue = WorkflowJobQueue(mock_db, runner, max_workers=1)
+    queue.start()
+    running_id = await queue.submit("running")
+    pending_id = await queue.submit("pending")
+    await started.wait()
+    await queue.close()
+
+    assert statuses(mock_db, pending_id) == [ProcessStatus.CANCELLED]
+    assert statuses(mock_db, running_id) == [ProcessStatus.IN_PROGRESS, ProcessStatus.CANCELLED]
+    assert queue.stats()["queued"] == 0
+    assert queue.stats()["cancelled"] == 2
+
+@pytest.mark.asyncio
+async def test_failed_and_timed_out_jobs(mock_db):
+    """例外・エラー結果・タイムアウトをFAILUREとして記録するテスト"""
+    async def runner(task, process_id=None):
+        if task == "raise":
+            raise RuntimeError("boom")
+        if task == "slow":
+            await asyncio.sleep(1)
+        return {"status": "error", "error": {"step": "planning", "error": "bad"}}
+
+    queue = WorkflowJobQueue(mock_db, runner, max_workers=3, timeout=0.05)
+    queue.start()
+    ids = {task: await queue.submit(task) for task in ["raise", "slow", "error"]}
+    await queue._queue.join()
+
+    errors = {
+        call.args[0]: call.args[1]["error_message"]
+        for call in mock_db.update_process.call_args_list
+        if call.args[1]["status"] == ProcessStatus.FAILURE
+    }
+    assert errors[ids["raise"]] == "boom"
+    assert "timed out" in errors[ids["slow"]]
+    assert "bad" in errors[ids["error"]]
+    assert queue.stats()["failed"] == 3
+    await queue.close()
+
+@pytest.mark.asyncio
+async def test_get_returns_job_view(mock_db):
+    """ジョブの状態と結果をProcessから組み立てるテスト"""
+    job_id = str(ObjectId())
+    mock_db.get_process.return_value = Process(
+        _id=job_id,
+        name="workflow",
+        type=ProcessType.WORKFLOW,
+        description="テストタスク",
+        steps=[],
+        status=ProcessStatus.SUCCESS,
+        metadata={"task": "テストタスク", "result": {"status": "completed"}}
+    )
+    queue = WorkflowJobQueue(mock_db, AsyncMock())
+
+    job = await queue.get(job_id)
+
+    assert job["status"] == ProcessStatus.SUCCESS
+    assert job["result"] == {"status": "completed"}
+    assert await queue.get("not-an-id") is None
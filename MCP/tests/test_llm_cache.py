@@ -0,0 +1,100 @@
+import time
+import pytest
+from unittest.mock import MagicMock, AsyncMock, patch
+from llm_cache import LLMResponseCache, cache_key, response_cache_from_env
+
+def test_cache_key_is_content_addressed():
+    """キーがモデル・プロンプト・パラメータの内容で決まるテスト"""
+    key = cache_key("gemini-1.5-pro-latest", "prompt", {"temperature": 0, "top_p": 1})
+    assert key == cache_key("gemini-1.5-pro-latest", "prompt", {"top_p": 1, "temperature": 0})
+    assert key != cache_key("gemini-1.5-flash", "prompt", {"temperature": 0, "top_p": 1})
+    assert key != cache_key("gemini-1.5-pro-latest", "prompt", {"temperature": 1, "top_p": 1})
+
+def test_memory_hit_reports_saved_latency():
+    """2回目の呼び出しがキャッシュから返り、節約時間が集計されるテスト"""
+    cache = LLMResponseCache()
+    call = MagicMock(return_value="plan")
+    key = cache_key("model", "prompt")
+
+    assert cache.get_or_call(key, call) == "plan"
+    cache.set(key, "plan", latency_ms=1500.0)  # 計測値を固定する
+    assert cache.get_or_call(key, call) == "plan"
+
+    assert call.call_count == 1
+    stats = cache.stats()
+    assert stats["memory_hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+    assert stats["saved_ms"] == 1500.0
+
+def test_disk_tier_survives_new_instance(tmp_path):
+    """SQLiteに保存した応答を別インスタンスから読めるテスト"""
+    path = str(tmp_path / "llm_cache.sqlite")
+    first = LLMResponseCache(path=path)
+    first.set("key", "nightly plan", latency_ms=800)
+    first.close()
+
+    second = LLMResponseCache(path=path)
+    assert second.get("key") == "nightly plan"
+    assert second.get("key") == "nightly plan"
+    assert second.stats()["disk_hits"] == 1
+    assert second.stats()["memory_hits"] == 1
+
+def test_expired_entries_are_not_returned(tmp_path):
+    """TTLを過ぎた応答はメモリ・ディスクとも返さないテスト"""
+    cache = LLMResponseCache(path=str(tmp_path / "llm_cache.sqlite"), ttl=60)
+    with patch("llm_cache.time.time", return_value=1000.0):
+        cache.set("key", "old")
+    with patch("llm_cache.time.time", return_value=1061.0):
+        assert cache.get("key") is None
+    assert cache.stats()["disk_entries"] == 0
+
+def test_size_bounded_eviction(tmp_path):
+    """メモリ・ディスクとも上限件数を超えた古いエントリが削除されるテスト"""
+    cache = LLMResponseCache(path=str(tmp_path / "llm_cache.sqlite"), max_memory_entries=2, max_disk_entries=3)
+    now = time.time()
+    for n in range(5):
+        with patch("llm_cache.time.time", return_value=now - 10 + n):
+            cache.set(f"key{n}", f"value{n}")
+    stats = cache.stats()
+    assert stats["memory_entries"] == 2
+    assert stats["disk_entries"] == 3
+    assert cache.get("key0") is None
+    assert cache.get("key4") == "value4"
+
+def test_bypass_and_refresh():
+    """bypassはキャッシュを使わず、refreshは呼び直して上書きするテスト"""
+    cache = LLMResponseCache()
+    cache.set("key", "cached")
+
+    assert cache.get_or_call("key", lambda: "fresh", bypass=True) == "fresh"
+    assert cache.get("key") == "cached"
+    assert cache.get_or_call("key", lambda: "refreshed", refresh=True) == "refreshed"
+    assert cache.get("key") == "refreshed"
+
+def test_error_responses_are_not_cached():
+    """should_cacheがFalseの応答は保存しないテスト"""
+    cache = LLMResponseCache()
+    cache.get_or_call("key", lambda: "Error: quota", should_cache=lambda text: not text.startswith("Error"))
+    assert cache.get("key") is None
+
+@pytest.mark.asyncio
+async def test_async_get_or_call():
+    """非同期の呼び出しもキャッシュされるテスト"""
+    cache = LLMResponseCache()
+    call = AsyncMock(return_value="review")
+    assert await cache.aget_or_call("key", call) == "review"
+    assert await cache.aget_or_call("key", call) == "review"
+    call.assert_awaited_once()
+
+def test_response_cache_from_env(monkeypatch, tmp_path):
+    """環境変数で無効化・永続化先を指定できるテスト"""
+    monkeypatch.setenv("LLM_CACHE_DISABLED", "true")
+    assert response_cache_from_env() is None
+
+    monkeypatch.delenv("LLM_CACHE_DISABLED")
+    monkeypatch.setenv("LLM_CACHE_PATH", str(tmp_path / "cache.sqlite"))
+    monkeypatch.setenv("LLM_CACHE_TTL_SECONDS", "120")
+    cache = response_cache_from_env()
+    assert cache.path == str(tmp_path / "cache.sqlite")
+    assert cache.ttl == 120.0
@@ -0,0 +1,154 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock
+from database import BulkLogWriteError
+from log_sink import ProcessLogSink, OverflowPolicy
+from models import ProcessLog, ProcessStatus
+
+def make_log(step_number: int) -> ProcessLog:
+    return ProcessLog(
+        process_id="proc-1",
+        step_number=step_number,
+        status=ProcessStatus.SUCCESS,
+        message=f"step {step_number}"
+    )
+
+@pytest.fixture
+def mock_db():
+    db = AsyncMock()
+    db.save_process_logs.return_value = []
+    return db
+
+@pytest.mark.asyncio
+async def test_flush_by_batch_size(mock_db):
+    """件数に達したらまとめて書き込むテスト"""
+    sink = ProcessLogSink(mock_db, batch_size=3, flush_interval=60)
+    sink.start()
+    for i in range(3):
+        await sink.log(make_log(i))
+    await asyncio.sleep(0.05)
+
+    mock_db.save_process_logs.assert_awaited_once()
+    assert [log.step_number for log in mock_db.save_process_logs.call_args.args[0]] == [0, 1, 2]
+    await sink.close()
+
+@pytest.mark.asyncio
+async def test_flush_by_time_window(mock_db):
+    """件数に達しなくても時間経過で書き込むテスト"""
+    sink = ProcessLogSink(mock_db, batch_size=100, flush_interval=0.05)
+    sink.start()
+    await sink.log(make_log(1))
+    await asyncio.sleep(0.2)
+
+    mock_db.save_process_logs.assert_awaited_once()
+    assert sink.stats()["written"] == 1
+    await sink.close()
+
+@pytest.mark.asyncio
+async def test_close_flushes_pending_logs(mock_db):
+    """停止時に残りのログをすべて書き出すテスト"""
+    sink = ProcessLogSink(mock_db, batch_size=2, flush_interval=60)
+    sink.start()
+    for i in range(5):
+        await sink.log(make_log(i))
+    await sink.close()
+
+    written = [log.step_number for call in mock_db.save_process_logs.call_args_list for log in call.args[0]]
+    assert written == [0, 1, 2, 3, 4]
+    assert not sink.running
+
+@pytest.mark.asyncio
+async def test_drop_newest_when_full(mock_db):
+    """満杯時に新しいログを捨てるテスト"""
+    sink = ProcessLogSink(mock_db, max_queue_size=2, overflow_policy=OverflowPolicy.DROP_NEWEST)
+    sink.start()
+    # フラッシャーが取り出す前に積む
+    results = [sink.log_nowait(make_log(i)) for i in range(4)]
+    assert results == [True, True, False, False]
+    assert sink.stats()["dropped"] == 2
+    await sink.close()
+
+@pytest.mark.asyncio
+async def test_drop_oldest_when_full(mock_db):
+    """満杯時に古いログを捨てるテスト"""
+    sink = ProcessLogSink(mock_db, max_queue_size=2, overflow_policy=OverflowPolicy.DROP_OLDEST)
+    sink.start()
+    for i in range(4):
+        sink.log_nowait(make_log(i))
+    await sink.close()
+
+    written = [log.step_number for call in mock_db.save_process_logs.call_args_list for log in call.args[0]]
+    assert written == [2, 3]
+    assert sink.stats()["dropped"] == 2
+
+@pytest.mark.asyncio
+async def test_block_policy_applies_back_pressure(mock_db):
+    """BLOCKポリシーでは書き込みが追いつくまで呼び出し側を待たせるテスト"""
+    release = asyncio.Event()
+
+    async def slow_save(logs):
+        await release.wait()
+        return []
+
+    mock_db.save_process_logs.side_effect = slow_save
+    sink = ProcessLogSink(mock_db, max_queue_size=1, batch_size=1, flush_interval=60)
+    sink.start()
+    await sink.log(make_log(0))  # フラッシャーが取り出して書き込み待ちになる
+    await asyncio.sleep(0.01)
+    await sink.log(make_log(1))  # キューを埋める
+
+    blocked = asyncio.create_task(sink.log(make_log(2)))
+    await asyncio.sleep(0.05)
+    assert not blocked.done()
+
+    release.set()
+    await asyncio.wait_for(blocked, 1)
+    await sink.close()
+    assert sink.stats()["written"] == 3
+
+@pytest.mark.asyncio
+async def test_failed_flush_is_counted(mock_db):
+    """書き込み失敗時もシンクが停止しないテスト"""
+    mock_db.save_process_logs.side_effect = Exception("db down")
+    sink = ProcessLogSink(mock_db, batch_size=1, flush_interval=60)
+    sink.start()
+    await sink.log(make_log(0))
+    await sink.close()
+    assert sink.stats()["failed"] == 1
+
+@pytest.mark.asyncio
+async def test_partially_failed_flush_is_counted(mock_db):
+    """一部だけ保存できた場合は保存できた分を written、残りを failed に数えるテスト"""
+    mock_db.save_process_logs.side_effect = BulkLogWriteError(["a", "b"], [{"index": 2, "code": 11000, "message": "dup"}])
+    sink = ProcessLogSink(mock_db, batch_size=3, flush_interval=10)
+    sink.start()
+    for i in range(3):
+        await sink.log(make_log(i))
+    await sink.close()
+
+    assert sink.stats()["written"] == 2
+    assert sink.stats()["failed"] == 1
+
+@pytest.mark.asyncio
+async def test_log_requires_running_sink(mock_db):
+    """起動前のログ投入はエラーになるテスト"""
+    sink = ProcessLogSink(mock_db)
+    with pytest.raises(RuntimeError):
+        await sink.log(make_log(0))
+
+@pytest.mark.asyncio
+async def test_drop_oldest_does_not_drop_close_sentinel(mock_db):
+    """停止中に DROP_OLDEST でログを積んでも停止用の None が捨てられず、close が終わるテスト"""
+    sink = ProcessLogSink(mock_db, max_queue_size=2, overflow_policy=OverflowPolicy.DROP_OLDEST)
+    sink.start()
+    sink.log_nowait(make_log(0))
+    sink.log_nowait(make_log(1))
+    closing = asyncio.create_task(sink.close())
+    await asyncio.sleep(0)
+
+    with pytest.raises(RuntimeError, match="closing"):
+        sink.log_nowait(make_log(2))
+    await asyncio.wait_for(closing, timeout=1)
+
+    written = [log.step_number for call in mock_db.save_process_logs.call_args_list for log in call.args[0]]
+    assert written == [0, 1]
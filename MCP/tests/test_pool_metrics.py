@@ -0,0 +1,56 @@
+import threading
+from pymongo import monitoring
+from pool_metrics import PoolMetrics
+
+ADDRESS = ("localhost", 27017)
+
+def test_checkout_wait_and_usage():
+    """チェックアウトの待ち時間と同時使用数を集計するテスト"""
+    metrics = PoolMetrics()
+    for connection_id in (1, 2):
+        metrics.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(ADDRESS))
+        metrics.connection_checked_out(monitoring.ConnectionCheckedOutEvent(ADDRESS, connection_id))
+    metrics.connection_checked_in(monitoring.ConnectionCheckedInEvent(ADDRESS, 1))
+
+    stats = metrics.stats()
+    assert stats["checkouts"] == 2
+    assert stats["in_use"] == 1
+    assert stats["max_in_use"] == 2
+    assert stats["wait_ms"]["max"] >= stats["wait_ms"]["p50"] >= 0
+
+def test_checkout_failures_by_reason():
+    """プール枯渇などのチェックアウト失敗を理由別に数えるテスト"""
+    metrics = PoolMetrics()
+    metrics.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(ADDRESS))
+    metrics.connection_check_out_failed(
+        monitoring.ConnectionCheckOutFailedEvent(ADDRESS, monitoring.ConnectionCheckOutFailedReason.TIMEOUT)
+    )
+    assert metrics.stats()["checkout_failures"] == {"timeout": 1}
+    assert metrics.stats()["in_use"] == 0
+
+def test_wait_time_is_tracked_per_thread():
+    """スレッドごとに開始時刻を保持するテスト"""
+    metrics = PoolMetrics()
+    barrier = threading.Barrier(4)
+
+    def checkout(connection_id):
+        metrics.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(ADDRESS))
+        barrier.wait()
+        metrics.connection_checked_out(monitoring.ConnectionCheckedOutEvent(ADDRESS, connection_id))
+
+    threads = [threading.Thread(target=checkout, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert metrics.stats()["checkouts"] == 4
+    assert len(metrics._wait_ms) == 4
+
+def test_connection_lifecycle():
+    """接続の作成・クローズを数えるテスト"""
+    metrics = PoolMetrics()
+    metrics.connection_created(monitoring.ConnectionCreatedEvent(ADDRESS, 1))
+    metrics.connection_created(monitoring.ConnectionCreatedEvent(ADDRESS, 2))
+    metrics.connection_closed(monitoring.ConnectionClosedEvent(ADDRESS, 1, "idle"))
+    assert metrics.stats()["open_connections"] == 1
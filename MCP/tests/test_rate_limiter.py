@@ -0,0 +1,112 @@
+import json
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from rate_limiter import (
+    ModelBudget, RateLimiter, RetryPolicy, acall_with_retry, call_with_retry,
+    is_retryable, limiter_from_env
+)
+
+class ResourceExhausted(Exception):
+    """google.api_core.exceptions.ResourceExhausted の代わり"""
+    code = 429
+
+class HTTPError(Exception):
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+@pytest.fixture
+def clock():
+    """rate_limiter の monotonic を固定する"""
+    with patch("rate_limiter.time.monotonic", return_value=1000.0) as mock_monotonic:
+        yield mock_monotonic
+
+def test_requests_budget_queues_instead_of_failing(clock):
+    """1分あたりのリクエスト上限を超えた分は順番に待ち時間が割り当てられるテスト"""
+    limiter = RateLimiter({"gemini": ModelBudget(requests_per_minute=60)})
+    waits = [limiter.reserve("gemini") for _ in range(63)]
+
+    assert waits[:60] == [0.0] * 60
+    assert waits[60:] == pytest.approx([1.0, 2.0, 3.0])
+    assert limiter.reserve("other-model") == 0.0  # 予算のないモデルは制限しない
+
+def test_throughput_stays_at_quota(clock):
+    """上限の2倍の呼び出しが、ちょうど上限の速度で処理されるテスト"""
+    limiter = RateLimiter(default=ModelBudget(requests_per_minute=120))
+    waits = [limiter.reserve("gpt-4") for _ in range(240)]
+    assert max(waits) == pytest.approx(60.0)
+
+def test_tokens_budget(clock):
+    """トークン数の上限でも待たされるテスト"""
+    limiter = RateLimiter({"gemini": ModelBudget(tokens_per_minute=1000)})
+    assert limiter.reserve("gemini", tokens=600) == 0.0
+    assert limiter.reserve("gemini", tokens=600) == pytest.approx(12.0)
+
+    clock.return_value = 1012.0
+    assert limiter.reserve("gemini", tokens=10) == pytest.approx(0.6)
+
+def test_penalize_pushes_back_all_callers(clock):
+    """429を受けると同じモデルの後続の呼び出しがまとめて後ろにずれるテスト"""
+    limiter = RateLimiter({"gemini": ModelBudget(requests_per_minute=60)})
+    assert limiter.penalize("gemini", 5.0) is True
+    assert limiter.reserve("gemini") == pytest.approx(6.0)
+    assert limiter.penalize("unbudgeted", 5.0) is False
+
+def test_is_retryable():
+    """再試行してよいエラーだけを判定するテスト"""
+    assert is_retryable(ResourceExhausted("quota"))
+    assert is_retryable(HTTPError(503))
+    assert is_retryable(TimeoutError())
+    assert not is_retryable(HTTPError(400))
+    assert not is_retryable(ValueError("bad prompt"))
+
+def test_call_with_retry_backs_off_on_retryable_errors():
+    """一時的なエラーは指数バックオフで再試行して成功するテスト"""
+    call = MagicMock(side_effect=[HTTPError(503), HTTPError(500), "ok"])
+    with patch("rate_limiter.time.sleep") as mock_sleep, patch("rate_limiter.random.uniform", side_effect=lambda a, b: b):
+        assert call_with_retry(call, "gemini", policy=RetryPolicy(base_delay=1.0)) == "ok"
+    assert [c.args[0] for c in mock_sleep.call_args_list] == [1.0, 2.0]
+
+def test_call_with_retry_honours_retry_after():
+    """Retry-After が指定されていればその秒数だけ待つテスト"""
+    call = MagicMock(side_effect=[HTTPError(429, retry_after="7"), "ok"])
+    with patch("rate_limiter.time.sleep") as mock_sleep:
+        assert call_with_retry(call, "gemini") == "ok"
+    mock_sleep.assert_called_once_with(7.0)
+
+def test_call_with_retry_does_not_retry_other_errors():
+    """再試行できないエラーと上限回数に達したエラーはそのまま送出するテスト"""
+    call = MagicMock(side_effect=ValueError("bad prompt"))
+    with pytest.raises(ValueError):
+        call_with_retry(call, "gemini")
+    assert call.call_count == 1
+
+    call = MagicMock(side_effect=HTTPError(503))
+    with patch("rate_limiter.time.sleep"), pytest.raises(HTTPError):
+        call_with_retry(call, "gemini", policy=RetryPolicy(max_attempts=3))
+    assert call.call_count == 3
+
+@pytest.mark.asyncio
+async def test_acall_with_retry_penalizes_limiter_on_429():
+    """非同期版は429を受けるとリミッター経由で待つテスト"""
+    limiter = RateLimiter({"gpt-4": ModelBudget(requests_per_minute=600)})
+    call = AsyncMock(side_effect=[ResourceExhausted("quota"), "ok"])
+    with patch("rate_limiter.asyncio.sleep", new=AsyncMock()) as mock_sleep, \
+         patch("rate_limiter.random.uniform", return_value=0.5):
+        assert await acall_with_retry(call, "gpt-4", limiter=limiter) == "ok"
+    # 待ち時間はバックオフ分 + 1リクエスト分(0.1秒)
+    assert mock_sleep.await_args.args[0] == pytest.approx(0.6, abs=0.05)
+    assert limiter.stats()["throttled"] == 1
+
+def test_limiter_from_env(monkeypatch, clock):
+    """環境変数から既定値とモデルごとの予算を読み込むテスト"""
+    monkeypatch.setenv("LLM_REQUESTS_PER_MINUTE", "30")
+    monkeypatch.setenv("LLM_RATE_LIMITS", json.dumps({"gemini-1.5-pro-latest": {"rpm": 2, "tpm": 32000}}))
+    limiter = limiter_from_env()
+
+    assert limiter.default.requests_per_minute == 30
+    assert limiter.budgets["gemini-1.5-pro-latest"] == ModelBudget(2, 32000)
+    limiter.reserve("gemini-1.5-pro-latest")
+    limiter.reserve("gemini-1.5-pro-latest")
+    assert limiter.reserve("gemini-1.5-pro-latest") == pytest.approx(30.0)
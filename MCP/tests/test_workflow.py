@@ -1,9 +1,18 @@
+import asyncio
 import pytest
 import json
+import random
+import time
 from unittest.mock import AsyncMock, patch
 from workflow import MCPWorkflow, WorkflowState
 from langchain.tools import Tool
 from langchain.chat_models import ChatOpenAI
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from models import ProcessStatus
+from checkpoint import MemoryCheckpointer, RUN_NODE
 
 @pytest.fixture
 def mock_tools():
@@ -120,4 +129,233 @@ async def test_workflow_state_transitions(mock_chat_model, mock_tools):
         assert "plan_result" in result["results"]
         assert "research_result" in result["results"]
         assert "execution_result" in result["results"]
-        assert "review_result" in result["results"]
\ No newline at end of file
+        assert "review_result" in result["results"]
+@pytest.mark.asyncio
+async def test_node_results_are_queued_to_log_sink(mock_tools):
+    """ノードの結果がログシンクに積まれるテスト"""
+    log_sink = AsyncMock()
+    log_sink.running = True
+    workflow = MCPWorkflow(model=FakeListChatModel(responses=["plan"]), tools=mock_tools, log_sink=log_sink)
+
+    state = await workflow._run_planner(WorkflowState(task="テストタスク", process_id="proc-1"))
+
+    assert state.status == "planning_completed"
+    entry = log_sink.log.call_args.args[0]
+    assert entry.process_id == "proc-1"
+    assert entry.step_number == 1
+    assert entry.status == ProcessStatus.SUCCESS
+
+@pytest.mark.asyncio
+async def test_node_logging_skipped_without_process_id(mock_tools):
+    """process_idがなければログを積まないテスト"""
+    log_sink = AsyncMock()
+    log_sink.running = True
+    workflow = MCPWorkflow(model=FakeListChatModel(responses=["plan"]), tools=mock_tools, log_sink=log_sink)
+
+    await workflow._run_planner(WorkflowState(task="テストタスク"))
+
+    log_sink.log.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_stream_emits_node_events_and_tokens(mock_tools):
+    """ストリーミング実行でノードの開始・終了とトークンが発生順に返るテスト"""
+    workflow = MCPWorkflow(model=FakeListChatModel(responses=["plan", "done", "ok"]), tools=mock_tools)
+    workflow.researcher.process = AsyncMock(return_value={"research": "findings"})
+
+    events = [event async for event in workflow.stream("テストタスク")]
+
+    kinds = [(e["event"], e.get("node")) for e in events if e["event"] != "token"]
+    # 計画とリサーチは並行に走るため、両者の順序は問わない
+    assert kinds[0] == ("workflow_start", None)
+    assert set(kinds[1:5]) == {
+        ("node_start", "planning"), ("node_end", "planning"),
+        ("node_start", "research"), ("node_end", "research"),
+    }
+    assert kinds[5:] == [
+        ("node_start", "execution"), ("node_end", "execution"),
+        ("node_start", "review"), ("node_end", "review"),
+        ("workflow_end", None),
+    ]
+    planner_name = workflow.planner.name
+    tokens = [e["text"] for e in events if e["event"] == "token" and e["agent"] == planner_name]
+    assert "".join(tokens) == "plan"
+
+    end = events[-1]
+    assert end["result"]["status"] == "completed"
+    assert end["result"]["results"]["plan"] == "plan"
+    assert end["metrics"]["time_to_first_token_ms"] <= end["metrics"]["total_ms"]
+
+@pytest.mark.asyncio
+async def test_stream_reports_node_errors(mock_tools):
+    """ノードの失敗がnode_endとworkflow_endに反映されるテスト"""
+    workflow = MCPWorkflow(model=FakeListChatModel(responses=["plan"]), tools=mock_tools)
+    workflow.researcher.process = AsyncMock(side_effect=RuntimeError("search failed"))
+
+    events = [event async for event in workflow.stream("テストタスク")]
+
+    research_end = next(e for e in events if e["event"] == "node_end" and e["node"] == "research")
+    assert research_end["status"] == "error"
+    assert research_end["error"] == {"step": "research", "error": "search failed"}
+    assert events[-1]["event"] == "workflow_end"
+    assert events[-1]["result"]["status"] == "error"
+
+@pytest.mark.asyncio
+async def test_planner_and_researcher_run_in_parallel(mock_tools):
+    """計画とリサーチが並行に実行され、両方の結果が実行エージェントに渡るテスト"""
+    workflow = MCPWorkflow(model=FakeListChatModel(responses=["unused"]), tools=mock_tools)
+
+    async def slow_plan(input_data):
+        await asyncio.sleep(0.3)
+        return {"plan": "steps"}
+
+    async def slow_research(input_data):
+        await asyncio.sleep(0.3)
+        return {"research": "findings"}
+
+    workflow.planner.process = AsyncMock(side_effect=slow_plan)
+    workflow.researcher.process = AsyncMock(side_effect=slow_research)
+    workflow.executor.process = AsyncMock(return_value={"result": "done"})
+    workflow.reviewer.process = AsyncMock(return_value={"review": "ok"})
+
+    start = time.perf_counter()
+    result = await workflow.run("テストタスク")
+    elapsed = time.perf_counter() - start
+
+    assert result["status"] == "completed"
+    assert elapsed < 0.55
+    executor_input = workflow.executor.process.call_args.args[0]
+    assert executor_input["plan"] == "steps"
+    assert executor_input["research"] == "findings"
+
+@pytest.mark.asyncio
+async def test_parallel_branch_error_routes_to_error_handler(mock_tools):
+    """並行ブランチの一方が失敗したら実行に進まずerror_handlerへ分岐するテスト"""
+    workflow = MCPWorkflow(model=FakeListChatModel(responses=["plan"]), tools=mock_tools)
+    workflow.researcher.process = AsyncMock(side_effect=RuntimeError("search failed"))
+    workflow.executor.process = AsyncMock(return_value={"result": "done"})
+
+    result = await workflow.run("テストタスク")
+
+    assert result["status"] == "error"
+    assert result["error"] == {"step": "research", "error": "search failed"}
+    assert result["results"]["plan"] == "plan"
+    workflow.executor.process.assert_not_called()
+
+class EchoChatModel(BaseChatModel):
+    """最後のメッセージを少し待ってからそのまま返すモデル（並行実行を交互に進めるため）"""
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        raise NotImplementedError
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(random.uniform(0, 0.01))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=f"echo:{messages[-1].content}"))])
+
+    @property
+    def _llm_type(self):
+        return "echo"
+
+@pytest.mark.asyncio
+async def test_concurrent_runs_do_not_share_agent_state(mock_tools):
+    """1つのワークフローで並行実行しても、結果とエージェント状態が混ざらないテスト"""
+    workflow = MCPWorkflow(model=EchoChatModel(), tools=mock_tools)
+
+    async def research(input_data):
+        await asyncio.sleep(random.uniform(0, 0.01))
+        return {"research": f"research:{input_data['topic']}"}
+
+    workflow.researcher.process = AsyncMock(side_effect=research)
+    tasks = [f"task-{i}" for i in range(200)]
+
+    results = await asyncio.gather(*(workflow.run(task) for task in tasks))
+
+    for task, result in zip(tasks, results):
+        assert result["status"] == "completed"
+        assert result["results"]["plan"] == f"echo:{task}"
+        assert result["results"]["research"] == f"research:{task}"
+        assert result["results"]["execution"] == f"echo:{task}"
+        assert f"'artifact': 'echo:{task}'" in result["results"]["review"]
+    # 共有しているエージェント自身の状態は実行によって書き換えられない
+    assert workflow.planner.state.current_task == ""
+
+@pytest.mark.asyncio
+async def test_agent_states_are_recorded_in_workflow_state(mock_tools):
+    """各エージェントの状態が実行ごとにWorkflowStateへ記録されるテスト"""
+    workflow = MCPWorkflow(model=EchoChatModel(), tools=mock_tools)
+    workflow.researcher.process = AsyncMock(return_value={"research": "findings"})
+
+    final_state = await workflow.workflow.ainvoke(WorkflowState(task="テストタスク"))
+
+    agent_states = final_state["agent_states"]
+    assert set(agent_states) == {"Planner", "Executor", "Reviewer"}
+    assert agent_states["Planner"]["current_task"] == "テストタスク"
+    assert agent_states["Planner"]["artifacts"] == {"plan": "echo:テストタスク"}
+
+@pytest.mark.asyncio
+async def test_resume_skips_completed_nodes(mock_tools):
+    """実行が失敗したら、再開時に完了済みの計画とリサーチを再実行しないテスト"""
+    checkpointer = MemoryCheckpointer()
+    workflow = MCPWorkflow(model=FakeListChatModel(responses=["unused"]), tools=mock_tools, checkpointer=checkpointer)
+    workflow.planner.process = AsyncMock(return_value={"plan": "steps"})
+    workflow.researcher.process = AsyncMock(return_value={"research": "findings"})
+    workflow.executor.process = AsyncMock(side_effect=[RuntimeError("tool crashed"), {"result": "done"}])
+    workflow.reviewer.process = AsyncMock(return_value={"review": "ok"})
+
+    failed = await workflow.run("テストタスク")
+
+    assert failed["status"] == "error"
+    assert failed["error"] == {"step": "execution", "error": "tool crashed"}
+    assert set(await checkpointer.load(failed["run_id"])) == {RUN_NODE, "planning", "research"}
+
+    resumed = await workflow.resume(failed["run_id"])
+
+    assert resumed["status"] == "completed"
+    assert resumed["task"] == "テストタスク"
+    assert resumed["results"] == {"plan": "steps", "research": "findings", "execution": "done", "review": "ok"}
+    assert workflow.planner.process.await_count == 1
+    assert workflow.researcher.process.await_count == 1
+    assert workflow.executor.process.call_args.args[0]["plan"] == "steps"
+    # 完了した実行のチェックポイントは削除される
+    assert await checkpointer.load(failed["run_id"]) == {}
+
+@pytest.mark.asyncio
+async def test_resume_unknown_run(mock_tools):
+    """チェックポイントがない実行IDの再開はKeyErrorになるテスト"""
+    workflow = MCPWorkflow(model=FakeListChatModel(responses=["unused"]), tools=mock_tools, checkpointer=MemoryCheckpointer())
+    with pytest.raises(KeyError):
+        await workflow.resume("missing")
+
+    without_checkpointer = MCPWorkflow(model=FakeListChatModel(responses=["unused"]), tools=mock_tools)
+    with pytest.raises(ValueError):
+        await without_checkpointer.resume("missing")
+
+@pytest.mark.asyncio
+async def test_run_many_bounds_concurrency_and_yields_as_completed(mock_tools):
+    """同時実行数を制限し、終わった順に所要時間付きで返すテスト"""
+    workflow = MCPWorkflow(model=FakeListChatModel(responses=["unused"]), tools=mock_tools)
+    active = 0
+    peak = 0
+
+    async def run(task, process_id=None, run_id=None):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.2 if task == "slow" else 0.01)
+        active -= 1
+        if task == "broken":
+            raise RuntimeError("boom")
+        return {"task": task, "status": "completed"}
+
+    workflow.run = run
+    tasks = ["slow"] + [f"task-{i}" for i in range(8)] + ["broken"]
+
+    results = [item async for item in workflow.run_many(tasks, concurrency=3)]
+
+    assert peak == 3
+    assert sorted(item["index"] for item in results) == list(range(len(tasks)))
+    assert results[-1]["task"] == "slow"
+    broken = next(item for item in results if item["task"] == "broken")
+    assert broken["error"] == "boom" and broken["result"] is None
+    ok = next(item for item in results if item["task"] == "task-0")
+    assert ok["result"] == {"task": "task-0", "status": "completed"}
+    assert ok["elapsed_ms"] >= 10
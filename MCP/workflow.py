@@ -1,28 +1,74 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, AsyncIterator, Annotated
 from langchain_community.chat_models import ChatOpenAI
 from langchain.tools import Tool
 from agents.planner import PlannerAgent
 from agents.researcher import ResearcherAgent
 from agents.executor import ExecutorAgent
 from agents.reviewer import ReviewerAgent
+from agents.base import agent_state_scope
 from langgraph.graph import StateGraph, END, START
 from pydantic import BaseModel
+from models import ProcessLog, ProcessStatus
+from log_sink import ProcessLogSink
+from llm_cache import LLMResponseCache
+from streaming import emit, streaming_to
+from checkpoint import RUN_NODE, WorkflowCheckpointer
+import asyncio
 import os
+import time
+import uuid
+
+def _merge_status(left: str, right: str) -> str:
+    """並行ノードの状態をまとめる（どちらかが失敗していればerror）"""
+    return "error" if "error" in (left, right) else right
+
+def _merge_error(left: Optional[Dict[str, Any]], right: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """先に記録されたエラーを残す"""
+    return left or right
+
+def _merge_dicts(left: Dict[str, Any], right: Dict[str, Any]) -> Dict[str, Any]:
+    return {**left, **right}
 
 class WorkflowState(BaseModel):
     """ワークフローの状態を管理するクラス"""
     task: str = ""
-    plan_result: Dict[str, Any] = {}
-    research_result: Dict[str, Any] = {}
-    execution_result: Dict[str, Any] = {}
-    review_result: Dict[str, Any] = {}
-    status: str = "pending"
-    error: Dict[str, Any] = None
+    # 各エージェントの出力（LLMの応答文字列またはdict）
+    plan_result: Any = {}
+    research_result: Any = {}
+    execution_result: Any = {}
+    review_result: Any = {}
+    # 計画とリサーチは並行に書き込むため、reducerでマージする
+    status: Annotated[str, _merge_status] = "pending"
+    error: Annotated[Optional[Dict[str, Any]], _merge_error] = None
+    # この実行でのエージェントごとの状態（エージェントのインスタンスは実行間で共有される）
+    agent_states: Annotated[Dict[str, Any], _merge_dicts] = {}
+    process_id: Optional[str] = None
+    # チェックポイントの実行IDと、再開時に前回完了済みのノード
+    run_id: Optional[str] = None
+    completed_nodes: List[str] = []
 
 class MCPWorkflow:
     """MCPワークフローを管理するクラス"""
     
-    def __init__(self, model_name: str = "gpt-4", tools: List[Tool] = None, model: ChatOpenAI = None):
+    # ノードごとのProcessLogのステップ番号
+    STEP_NUMBERS = {"planning": 1, "research": 2, "execution": 3, "review": 4}
+    # ノードごとにチェックポイントへ保存するフィールド
+    STEP_FIELDS = {
+        "planning": "plan_result",
+        "research": "research_result",
+        "execution": "execution_result",
+        "review": "review_result"
+    }
+
+    def __init__(
+        self,
+        model_name: str = "gpt-4",
+        tools: List[Tool] = None,
+        model: ChatOpenAI = None,
+        log_sink: Optional[ProcessLogSink] = None,
+        response_cache: Optional[LLMResponseCache] = None,
+        checkpointer: Optional[WorkflowCheckpointer] = None
+    ):
         if model:
             self.model = model
         else:
@@ -31,50 +77,46 @@ class MCPWorkflow:
                 raise ValueError("OPENAI_API_KEY environment variable is not set")
             self.model = ChatOpenAI(model_name=model_name, openai_api_key=api_key)
         self.tools = tools or []
+        self.log_sink = log_sink
+        self.response_cache = response_cache
+        self.checkpointer = checkpointer
         
         # エージェントの初期化
-        self.planner = PlannerAgent(self.model)
+        self.planner = PlannerAgent(self.model, response_cache=response_cache)
         self.researcher = ResearcherAgent(self.model, self.tools)
         self.executor = ExecutorAgent(self.model, self.tools)
-        self.reviewer = ReviewerAgent(self.model)
+        self.reviewer = ReviewerAgent(self.model, response_cache=response_cache)
         
         # ワークフローグラフの構築
         self.workflow = self._build_workflow()
 
     def _build_workflow(self) -> StateGraph:
-        """ワークフローグラフを構築"""
+        """ワークフローグラフを構築
+
+        リサーチはタスクだけを入力にするため、計画と並行して実行し、
+        両方が終わった時点(join)でエラーがあれば error_handler へ分岐する。
+        """
         workflow = StateGraph(WorkflowState)
         
         # ノードの追加
-        workflow.add_node("planning", self._run_planner)
-        workflow.add_node("researching", self._run_researcher)
+        workflow.add_node("planning", self._branch(self._run_planner, "plan_result"))
+        workflow.add_node("researching", self._branch(self._run_researcher, "research_result"))
+        workflow.add_node("join", self._join)
         workflow.add_node("executing", self._run_executor)
         workflow.add_node("reviewing", self._run_reviewer)
         workflow.add_node("error_handler", self._handle_error)
         
-        # 開始点の定義
+        # 開始点の定義（計画とリサーチを並行に開始）
         workflow.add_edge(START, "planning")
+        workflow.add_edge(START, "researching")
+        workflow.add_edge(["planning", "researching"], "join")
         
-        # 通常のエッジの定義
-        workflow.add_edge("planning", "researching")
-        workflow.add_edge("researching", "executing")
-        workflow.add_edge("executing", "reviewing")
-        workflow.add_edge("reviewing", END)
-        
-        # エラーエッジの定義
+        # ノード間のエッジ（エラー時は error_handler へ分岐）
         def is_error(state: WorkflowState) -> str:
             return "error_handler" if state.status == "error" else None
         
         workflow.add_conditional_edges(
-            "planning",
-            is_error,
-            {
-                "error_handler": "error_handler",
-                None: "researching"
-            }
-        )
-        workflow.add_conditional_edges(
-            "researching",
+            "join",
             is_error,
             {
                 "error_handler": "error_handler",
@@ -101,30 +143,108 @@ class MCPWorkflow:
         
         return workflow.compile()
 
+    def _branch(self, node, field: str):
+        """並行ブランチ用に、ノードの結果から担当フィールドと状態だけを更新として返す"""
+        async def run(state: WorkflowState) -> Dict[str, Any]:
+            result = await node(state)
+            update = {field: getattr(result, field), "status": result.status, "agent_states": result.agent_states}
+            if result.error:
+                update["error"] = result.error
+            return update
+        return run
+
+    async def _join(self, state: WorkflowState) -> Dict[str, Any]:
+        """計画とリサーチの合流点（状態はreducerでマージ済み。グラフ上は何か書き込む必要がある）"""
+        return {"status": state.status}
+
+    def _start_node(self, step: str) -> float:
+        emit("node_start", node=step)
+        return time.perf_counter()
+
+    async def _finish_node(self, state: WorkflowState, step: str, started: float):
+        failed = state.status == "error"
+        emit(
+            "node_end",
+            node=step,
+            status="error" if failed else "success",
+            error=state.error if failed else None,
+            elapsed_ms=round((time.perf_counter() - started) * 1000, 1)
+        )
+        await self._log_step(state, step)
+        if not failed:
+            field = self.STEP_FIELDS[step]
+            await self._save_checkpoint(state.run_id, step, {field: getattr(state, field)})
+
+    def _skip_completed(self, state: WorkflowState, step: str) -> bool:
+        """再開した実行で、前回完了したノードは結果を再利用して飛ばす"""
+        if step not in state.completed_nodes:
+            return False
+        emit("node_skipped", node=step)
+        return True
+
+    async def _save_checkpoint(self, run_id: Optional[str], node: str, data: Dict[str, Any]):
+        """チェックポイントを保存する（失敗しても実行は続ける）"""
+        if not self.checkpointer or not run_id:
+            return
+        try:
+            await self.checkpointer.save(run_id, node, data)
+        except Exception as e:
+            print(f"Failed to save workflow checkpoint {run_id}/{node}: {e}")
+
+    def _record_agent_state(self, state: WorkflowState, agent, result: Dict[str, Any]):
+        if "agent_state" in result:
+            state.agent_states = {**state.agent_states, agent.name: result["agent_state"]}
+
+    async def _log_step(self, state: WorkflowState, step: str):
+        """ノードの結果をログシンクに積む（DBへの書き込みは待たない）"""
+        if not self.log_sink or not state.process_id or not self.log_sink.running:
+            return
+        failed = state.status == "error"
+        await self.log_sink.log(ProcessLog(
+            process_id=state.process_id,
+            step_number=self.STEP_NUMBERS[step],
+            status=ProcessStatus.FAILURE if failed else ProcessStatus.SUCCESS,
+            message=f"{step} {'failed' if failed else 'completed'}",
+            error_details=state.error if failed else None
+        ))
+
     async def _run_planner(self, state: WorkflowState) -> WorkflowState:
         """プランナーエージェントを実行"""
+        if self._skip_completed(state, "planning"):
+            return state
+        started = self._start_node("planning")
         try:
             result = await self.planner.process({"task": state.task})
             state.plan_result = result["plan"]
+            self._record_agent_state(state, self.planner, result)
             state.status = "planning_completed"
         except Exception as e:
             state.error = {"step": "planning", "error": str(e)}
             state.status = "error"
+        await self._finish_node(state, "planning", started)
         return state
 
     async def _run_researcher(self, state: WorkflowState) -> WorkflowState:
         """リサーチャーエージェントを実行"""
+        if self._skip_completed(state, "research"):
+            return state
+        started = self._start_node("research")
         try:
             result = await self.researcher.process({"topic": state.task})
             state.research_result = result["research"]
+            self._record_agent_state(state, self.researcher, result)
             state.status = "research_completed"
         except Exception as e:
             state.error = {"step": "research", "error": str(e)}
             state.status = "error"
+        await self._finish_node(state, "research", started)
         return state
 
     async def _run_executor(self, state: WorkflowState) -> WorkflowState:
         """エグゼキューターエージェントを実行"""
+        if self._skip_completed(state, "execution"):
+            return state
+        started = self._start_node("execution")
         try:
             result = await self.executor.process({
                 "task": state.task,
@@ -132,25 +252,34 @@ class MCPWorkflow:
                 "research": state.research_result
             })
             state.execution_result = result["result"]
+            self._record_agent_state(state, self.executor, result)
             state.status = "execution_completed"
         except Exception as e:
             state.error = {"step": "execution", "error": str(e)}
             state.status = "error"
+        await self._finish_node(state, "execution", started)
         return state
 
     async def _run_reviewer(self, state: WorkflowState) -> WorkflowState:
         """レビューアーエージェントを実行"""
+        if self._skip_completed(state, "review"):
+            return state
+        started = self._start_node("review")
         try:
+            # プランナーの出力は応答文字列のこともある
+            plan = state.plan_result if isinstance(state.plan_result, dict) else {}
             result = await self.reviewer.process({
                 "artifact": state.execution_result,
-                "requirements": state.plan_result.get("requirements", []),
-                "quality_criteria": state.plan_result.get("quality_criteria", [])
+                "requirements": plan.get("requirements", []),
+                "quality_criteria": plan.get("quality_criteria", [])
             })
             state.review_result = result["review"]
+            self._record_agent_state(state, self.reviewer, result)
             state.status = "completed"
         except Exception as e:
             state.error = {"step": "review", "error": str(e)}
             state.status = "error"
+        await self._finish_node(state, "review", started)
         return state
 
     async def _handle_error(self, state: WorkflowState) -> WorkflowState:
@@ -162,12 +291,16 @@ class MCPWorkflow:
             }
         return state
 
-    async def run(self, task: str) -> Dict[str, Any]:
-        """ワークフローを実行"""
-        initial_state = WorkflowState(task=task)
-        final_state = await self.workflow.arun(initial_state)
-        
-        return {
+    async def _invoke(self, state: WorkflowState) -> Dict[str, Any]:
+        # コンパイル済みのグラフとエージェントは共有し、実行ごとの状態だけを分ける
+        with agent_state_scope():
+            final_state = await self.workflow.ainvoke(state)
+        if isinstance(final_state, dict):
+            final_state = WorkflowState(**final_state)
+        # 失敗した実行は再開できるよう残す（保持期間を過ぎるとTTL/pruneで消える）
+        if final_state.run_id and final_state.status == "completed":
+            await self._delete_checkpoints(final_state.run_id)
+        result = {
             "task": final_state.task,
             "status": final_state.status,
             "results": {
@@ -177,4 +310,127 @@ class MCPWorkflow:
                 "review": final_state.review_result
             },
             "error": final_state.error
-        } 
\ No newline at end of file
+        }
+        if final_state.run_id:
+            # 失敗した場合はこのIDで resume すると完了済みのノードを飛ばして再実行できる
+            result["run_id"] = final_state.run_id
+        return result
+
+    async def _delete_checkpoints(self, run_id: str):
+        try:
+            await self.checkpointer.delete(run_id)
+        except Exception as e:
+            print(f"Failed to delete workflow checkpoints {run_id}: {e}")
+
+    async def _new_state(self, task: str, process_id: Optional[str], run_id: Optional[str]) -> WorkflowState:
+        """実行の初期状態を作る（チェックポイントが有効なら実行IDを割り当ててタスクを保存）"""
+        state = WorkflowState(task=task, process_id=process_id)
+        if self.checkpointer:
+            state.run_id = run_id or uuid.uuid4().hex
+            await self._save_checkpoint(state.run_id, RUN_NODE, {"task": task, "process_id": process_id})
+        return state
+
+    async def run(self, task: str, process_id: Optional[str] = None, run_id: Optional[str] = None) -> Dict[str, Any]:
+        """ワークフローを実行（process_idを指定すると各ノードの結果をログに残す）"""
+        return await self._invoke(await self._new_state(task, process_id, run_id))
+
+    async def run_many(self, tasks: List[str], concurrency: int = 8) -> AsyncIterator[Dict[str, Any]]:
+        """複数のタスクを最大 concurrency 件ずつ並行に実行し、終わった順に結果を返す
+
+        LLMの呼び出しはエージェントが共有するレートリミッターの予算内で行われる。
+        各要素には入力順の index と、実行枠を待った時間(wait_ms)・実行時間(elapsed_ms)を含む。
+        呼び出し側が途中で読むのをやめた場合は残りを取り消す。
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        submitted = time.perf_counter()
+
+        async def run_one(index: int, task: str) -> Dict[str, Any]:
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    result, error = await self.run(task), None
+                except Exception as e:
+                    result, error = None, str(e)
+                return {
+                    "index": index,
+                    "task": task,
+                    "result": result,
+                    "error": error,
+                    "wait_ms": round((started - submitted) * 1000, 1),
+                    "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+                }
+
+        pending = [asyncio.create_task(run_one(index, task)) for index, task in enumerate(tasks)]
+        try:
+            for next_done in asyncio.as_completed(pending):
+                yield await next_done
+        finally:
+            for task in pending:
+                if not task.done():
+                    task.cancel()
+
+    async def resume(self, run_id: str) -> Dict[str, Any]:
+        """チェックポイントから再開し、前回完了したノードの結果を再利用して残りを実行する"""
+        if not self.checkpointer:
+            raise ValueError("Workflow checkpointing is not enabled")
+        nodes = await self.checkpointer.load(run_id)
+        run = nodes.pop(RUN_NODE, None)
+        if run is None:
+            raise KeyError(f"No checkpoint found for run {run_id}")
+        state = WorkflowState(
+            task=run["task"],
+            process_id=run.get("process_id"),
+            run_id=run_id,
+            completed_nodes=list(nodes)
+        )
+        for data in nodes.values():
+            for field, value in data.items():
+                setattr(state, field, value)
+        return await self._invoke(state)
+
+    async def stream(
+        self,
+        task: str,
+        process_id: Optional[str] = None,
+        run_id: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """ワークフローを実行しながらイベントを順に返す
+
+        node_start / token / node_end を発生順に返し、最後に結果と
+        最初のトークンまでの時間・全体の時間を含む workflow_end を返す。
+        呼び出し側が途中で読むのをやめた場合は実行を取り消す。
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        started = time.perf_counter()
+        first_token_ms = None
+
+        async def drive():
+            with streaming_to(queue.put_nowait):
+                try:
+                    return await self._invoke(await self._new_state(task, process_id, run_id))
+                finally:
+                    queue.put_nowait(None)
+
+        runner = asyncio.create_task(drive())
+        try:
+            yield {"event": "workflow_start", "task": task, "process_id": process_id}
+            while (event := await queue.get()) is not None:
+                if event["event"] == "token" and first_token_ms is None:
+                    first_token_ms = round((time.perf_counter() - started) * 1000, 1)
+                yield event
+            try:
+                result = await runner
+            except Exception as e:
+                yield {"event": "error", "error": str(e)}
+                return
+            yield {
+                "event": "workflow_end",
+                "result": result,
+                "metrics": {
+                    "time_to_first_token_ms": first_token_ms,
+                    "total_ms": round((time.perf_counter() - started) * 1000, 1)
+                }
+            }
+        finally:
+            if not runner.done():
+                runner.cancel()
@@ -0,0 +1,264 @@
+"""list_files ツールのディレクトリ一覧キャッシュ
+
+ディレクトリごとに os.scandir の結果（名前と種類）を保持し、次回はディレクトリの mtime が
+変わっていなければ stat 1回で再利用する。mtime の刻みより短い間の変更を見逃さないよう、
+走査時点で mtime が新しすぎた（RACY_NS 以内の）一覧は再利用しない。
+
+watch=True（または LIST_FILES_WATCH=1）で Linux の inotify を使い、変更通知のない
+ディレクトリは stat もせずに再利用する。inotify を使えない環境では mtime の確認だけで動く。
+"""
+import ctypes
+import ctypes.util
+import fnmatch
+import os
+import stat
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Set
+
+DEFAULT_MAX_DIRS = int(os.getenv("LIST_FILES_CACHE_DIRS", "10000"))
+DEFAULT_WATCH = os.getenv("LIST_FILES_WATCH", "").lower() in ("1", "true", "yes")
+RACY_NS = 2 * 1_000_000_000
+
+class DirEntry(NamedTuple):
+    name: str
+    is_dir: bool
+
+class _Snapshot(NamedTuple):
+    mtime_ns: int
+    scanned_ns: int
+    entries: List[DirEntry]
+    watched: bool
+
+# <sys/inotify.h>
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+WATCH_MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+_EVENT = struct.Struct("iIII")
+
+class InotifyWatcher:
+    """ディレクトリの追加・削除・名前変更を inotify で受け取る（Linuxのみ）"""
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c")
+        if not hasattr(os, "O_NONBLOCK") or libc_name is None:
+            raise OSError("inotify is not available on this platform")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify is not available on this platform")
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._paths: Dict[int, str] = {}
+        self._wds: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def watch(self, path: str) -> bool:
+        """監視を追加する。上限などで追加できなければFalse"""
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            return False
+        with self._lock:
+            self._paths[wd] = path
+            self._wds[path] = wd
+        return True
+
+    def unwatch(self, path: str):
+        with self._lock:
+            wd = self._wds.pop(path, None)
+            if wd is not None:
+                self._paths.pop(wd, None)
+        if wd is not None:
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def changed(self) -> Optional[Set[str]]:
+        """前回以降に変更があったディレクトリを返す。通知があふれた場合は None（すべて無効）"""
+        changed: Set[str] = set()
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            if not data:
+                return changed
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, pos)
+                pos += _EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    changed = None
+                    continue
+                with self._lock:
+                    path = self._paths.get(wd)
+                    if mask & IN_IGNORED:
+                        self._paths.pop(wd, None)
+                        if path is not None and self._wds.get(path) == wd:
+                            del self._wds[path]
+                if path is not None and changed is not None:
+                    changed.add(path)
+            if changed is None:
+                # 残りの通知を読み捨ててから全体を無効にする
+                self.changed()
+                return None
+
+    @property
+    def watched(self) -> int:
+        return len(self._wds)
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+def _matches(pattern: str, relative: str) -> bool:
+    """パターンに / がなければファイル名に、あれば相対パスの各階層に一致させる"""
+    parts = relative.split(os.sep)
+    if "/" not in pattern:
+        return fnmatch.fnmatch(parts[-1], pattern)
+    segments = pattern.strip("/").split("/")
+    return len(segments) == len(parts) and all(fnmatch.fnmatch(p, s) for p, s in zip(parts, segments))
+
+class DirectoryCache:
+    """ディレクトリ一覧をmtime（とinotify）で検証しながら使い回すキャッシュ"""
+
+    def __init__(self, max_dirs: Optional[int] = None, watch: Optional[bool] = None):
+        self.max_dirs = max_dirs or DEFAULT_MAX_DIRS
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._snapshots: "OrderedDict[str, _Snapshot]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._watcher: Optional[InotifyWatcher] = None
+        if DEFAULT_WATCH if watch is None else watch:
+            try:
+                self._watcher = InotifyWatcher()
+            except OSError as e:
+                print(f"Directory watcher is disabled: {e}")
+
+    @property
+    def watching(self) -> bool:
+        return self._watcher is not None
+
+    def entries(self, path: str) -> List[DirEntry]:
+        """ディレクトリ直下の (名前, ディレクトリか) を名前順で返す"""
+        path = os.path.abspath(path)
+        self._apply_changes()
+        with self._lock:
+            snapshot = self._snapshots.get(path)
+            if snapshot is not None and snapshot.watched:
+                self._snapshots.move_to_end(path)
+                self.hits += 1
+                return snapshot.entries
+
+        st = os.stat(path)
+        if not stat.S_ISDIR(st.st_mode):
+            raise ValueError(f"Path is not a directory: {path}")
+        if snapshot is not None and st.st_mtime_ns == snapshot.mtime_ns and snapshot.scanned_ns - st.st_mtime_ns > RACY_NS:
+            with self._lock:
+                self.revalidated += 1
+            return snapshot.entries
+
+        # 監視を先に追加してから走査する（走査中の変更も通知で拾える）
+        watched = self._watcher is not None and self._watcher.watch(path)
+        scanned_ns = time.time_ns()
+        mtime_ns = os.stat(path).st_mtime_ns
+        with os.scandir(path) as it:
+            entries = sorted(
+                (DirEntry(entry.name, entry.is_dir(follow_symlinks=False)) for entry in it),
+                key=lambda entry: entry.name
+            )
+        with self._lock:
+            self.misses += 1
+            self._snapshots[path] = _Snapshot(mtime_ns, scanned_ns, entries, watched)
+            self._snapshots.move_to_end(path)
+            evicted = []
+            while len(self._snapshots) > self.max_dirs:
+                evicted.append(self._snapshots.popitem(last=False)[0])
+        if self._watcher is not None:
+            for old in evicted:
+                self._watcher.unwatch(old)
+        return entries
+
+    def list(
+        self,
+        path: str,
+        recursive: bool = False,
+        max_depth: Optional[int] = None,
+        pattern: Optional[str] = None,
+        include_dirs: bool = True,
+        with_stat: bool = False
+    ) -> list:
+        """path 以下の一覧を返す（path からの相対パス。with_stat なら種類・サイズ・更新時刻付きのdict）
+
+        max_depth は直下を1とする深さ。recursive=False なら直下だけを返す。
+        pattern はファイル名（"/" を含む場合は相対パス）に対する glob。ディレクトリは一致しなくても下をたどる。
+        """
+        depth_limit = (max_depth or None) if recursive else 1
+        results = []
+        stack = [("", 1)]
+        while stack:
+            relative, depth = stack.pop()
+            directory = os.path.join(path, relative) if relative else path
+            children = []
+            for entry in self.entries(directory):
+                child = os.path.join(relative, entry.name) if relative else entry.name
+                if entry.is_dir and (depth_limit is None or depth < depth_limit):
+                    children.append((child, depth + 1))
+                if entry.is_dir and not include_dirs:
+                    continue
+                if pattern and not _matches(pattern, child):
+                    continue
+                results.append(self._describe(path, child, entry) if with_stat else child)
+            stack.extend(reversed(children))
+        if recursive:
+            results.sort(key=lambda item: item["path"] if with_stat else item)
+        return results
+
+    def invalidate(self, path: Optional[str] = None):
+        with self._lock:
+            if path is None:
+                self._snapshots.clear()
+            else:
+                self._snapshots.pop(os.path.abspath(path), None)
+
+    def stats(self) -> dict:
+        return {
+            "dirs": len(self._snapshots),
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "watched": self._watcher.watched if self._watcher is not None else 0
+        }
+
+    def close(self):
+        self.invalidate()
+        if self._watcher is not None:
+            self._watcher.close()
+            self._watcher = None
+
+    def _apply_changes(self):
+        if self._watcher is None:
+            return
+        changed = self._watcher.changed()
+        if changed is None:
+            self.invalidate()
+            return
+        if changed:
+            with self._lock:
+                for path in changed:
+                    self._snapshots.pop(path, None)
+
+    @staticmethod
+    def _describe(root: str, relative: str, entry: DirEntry) -> dict:
+        st = os.stat(os.path.join(root, relative), follow_symlinks=False)
+        kind = "dir" if entry.is_dir else "symlink" if stat.S_ISLNK(st.st_mode) else "file"
+        return {"path": relative, "type": kind, "size": st.st_size, "mtime": st.st_mtime}
@@ -0,0 +1,101 @@
+"""read_file / write_to_file ツールのファイル操作
+
+- 範囲指定（バイトの offset/length、行の start_line/end_line）で一部だけを読む
+- 行範囲は mmap 上で改行を探して求める（ファイル全体を読み込まない）
+- inline_bytes 以上の範囲やバイナリは内容を読まずに OutputRef（ファイルへの参照）として返す
+  （参照の解決前にファイルが書き換えられていたら StaleOutputError）
+- write_to_file に OutputRef を渡すと chunk ごとにコピーする（ファイルの大きさによらず一定のメモリで済む）
+- str 以外の値は、メモリ上にあっても書き出されていても同じJSONで書き込む
+"""
+import mmap
+import os
+from typing import Any, Optional, Tuple, Union
+from step_store import OutputRef, PREVIEW_CHARS, encode_output, file_version, make_preview
+
+DEFAULT_INLINE_BYTES = int(os.getenv("TOOL_READ_INLINE_BYTES", str(1024 * 1024)))
+
+def line_range(path: str, start_line: int = 1, end_line: Optional[int] = None) -> Tuple[int, int]:
+    """start_line行目からend_line行目まで（1始まり、両端を含む）の (offset, length) を返す"""
+    if start_line < 1 or (end_line is not None and end_line < start_line):
+        raise ValueError(f"Invalid line range: {start_line}-{end_line}")
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return 0, 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            for _ in range(start_line - 1):
+                newline = mm.find(b"\n", start)
+                if newline < 0:
+                    return size, 0
+                start = newline + 1
+            if end_line is None:
+                return start, size - start
+            end = start
+            for _ in range(end_line - start_line + 1):
+                newline = mm.find(b"\n", end)
+                if newline < 0:
+                    return start, size - start
+                end = newline + 1
+            return start, end - start
+
+def read_file(
+    path: str,
+    offset: Optional[int] = None,
+    length: Optional[int] = None,
+    start_line: Optional[int] = None,
+    end_line: Optional[int] = None,
+    binary: bool = False,
+    inline_bytes: Optional[int] = None
+) -> Union[str, OutputRef]:
+    """ファイル（またはその一部）を読む。大きな範囲とバイナリは OutputRef を返す"""
+    inline_bytes = DEFAULT_INLINE_BYTES if inline_bytes is None else inline_bytes
+    size = os.path.getsize(path)
+    by_lines = start_line is not None or end_line is not None
+    if by_lines:
+        offset, length = line_range(path, int(start_line or 1), None if end_line is None else int(end_line))
+    else:
+        offset = min(max(int(offset or 0), 0), size)
+        length = size - offset if length is None else min(max(int(length), 0), size - offset)
+
+    if binary or length >= inline_bytes:
+        with open(path, "rb") as f:
+            version = file_version(f.fileno())
+            f.seek(offset)
+            preview = make_preview(f.read(min(length, PREVIEW_CHARS)))
+        # 内容はコピーせずに元のファイルを指す。読み取り後に書き換えられたら参照時にエラーにする
+        return OutputRef(path, path, "bytes" if binary else "text", length, preview, offset=offset, owned=False, version=version)
+
+    if length == size:
+        # ファイル全体は従来どおりテキストモードで読む（改行の変換も同じ）
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    # バイト範囲は文字の途中で切れることがあるため、壊れた文字は置き換える
+    return data.decode("utf-8", errors="strict" if by_lines else "replace")
+
+def write_file(path: str, content: Any, append: bool = False) -> int:
+    """内容を書き込み、書き込んだバイト数を返す。OutputRef は chunk ごとにコピーする
+
+    str 以外の値（リストやdictなど）は、ステップ出力を書き出す場合と同じくJSONで書き込む。
+    """
+    dir_path = os.path.dirname(path)
+    if dir_path:
+        os.makedirs(dir_path, exist_ok=True)
+    if isinstance(content, OutputRef):
+        if os.path.abspath(content.path) == os.path.abspath(path):
+            raise ValueError(f"Cannot copy {path} onto itself")
+        content.ensure_current() # 書き込み先を空にする前に確認する
+        written = 0
+        with open(path, "ab" if append else "wb") as f:
+            for chunk in content.iter_chunks():
+                f.write(chunk)
+                written += len(chunk)
+        return written
+    # メモリ上の値も書き出した出力（OutputRef）と同じ形にする（リストやdictはJSON）
+    encoded = encode_output(content)
+    kind, data = encoded if encoded is not None else ("text", str(content))
+    with open(path, "ab" if append else "wb") as f:
+        return f.write(data if kind == "bytes" else data.encode("utf-8"))
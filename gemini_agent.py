@@ -1,65 +1,32 @@
 import json
 import datetime
 import os
-import requests
+import asyncio
 import google.generativeai as genai
 import textwrap # for dedenting prompts
-import subprocess # For execute_command simulation
+from plan_scheduler import execute_step, run_plan
+from step_store import StepOutputStore
+from log_pipeline import LogPipeline
+from gemini_client import GeminiClient, is_cacheable_response
+from tool_executor import ToolExecutor
+from tool_registry import build_default_registry
+from mcp_shared import cache_key, response_cache_from_env, retry_policy_from_env, shared_limiter
 
 LOG_FILE = "gemini_agent_log.txt"
+# Fluentd (in_http) の送信先。コンテナ構成では http://fluentd:8888/gemini.log
+FLUENTD_URL = os.getenv("FLUENTD_URL", "http://localhost:8888/gemini.log")
+_log_pipeline = LogPipeline(LOG_FILE, fluentd_url=FLUENTD_URL)
 # --- Gemini API Key Configuration ---
 API_KEY = os.getenv("GOOGLE_API_KEY")
 
 # genai.configure(api_key=API_KEY) # Moved to call_gemini function
-
-# --- Available Tools Definition (Simulated Cline Tools) ---
-AVAILABLE_TOOLS = [
-    {
-        "name": "read_file",
-        "description": "指定されたパスのファイルの内容を読み取る。",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "path": {"type": "string", "description": "読み取るファイルのパス"}
-            },
-            "required": ["path"]
-        }
-    },
-    {
-        "name": "write_to_file",
-        "description": "指定されたパスに指定された内容を書き込む。ファイルが存在しない場合は作成される。",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "path": {"type": "string", "description": "書き込むファイルのパス"},
-                "content": {"type": "string", "description": "書き込む内容"}
-            },
-            "required": ["path", "content"]
-        }
-    },
-    {
-        "name": "execute_command",
-        "description": "指定されたシェルコマンドを実行する。",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "command": {"type": "string", "description": "実行するシェルコマンド"}
-            },
-            "required": ["command"]
-        }
-    },
-    {
-        "name": "list_files",
-        "description": "指定されたディレクトリ内のファイルとサブディレクトリのリストを返す。",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "path": {"type": "string", "description": "リストするディレクトリのパス"}
-            },
-            "required": ["path"]
-        }
-    }
-]
+# モデルはキャッシュして使い回す。同時実行数は GEMINI_MAX_CONCURRENCY で指定
+# 429などは予算(LLM_RATE_LIMITS等)に従って待ってから再試行する
+_gemini_client = GeminiClient(rate_limiter=shared_limiter(), retry_policy=retry_policy_from_env())
+# execute_command の実行エンジン（TOOL_COMMAND_TIMEOUT / TOOL_MAX_CONCURRENCY / TOOL_OUTPUT_*_BYTES で設定）
+_tool_executor = ToolExecutor()
+# 同じプロンプトの応答を再利用する。LLM_CACHE_PATH を指定すると実行をまたいで保持される
+_response_cache = response_cache_from_env()
 
 # --- System Prompts ---
 PLANNER_PROMPT = textwrap.dedent("""
@@ -68,7 +35,7 @@ PLANNER_PROMPT = textwrap.dedent("""
 **制約:**
 - 利用可能なツールのみを使用してください。
 - 各ステップは、単一のツール呼び出しに対応する必要があります。
-- ステップ間の依存関係を考慮してください。前のステップの出力が必要な場合は、`args` 内で `{ステップID}_output` の形式で参照してください。 (例: `"content": "{step_1_output}"}`)
+- ステップ間の依存関係を考慮してください。前のステップの出力が必要な場合は、`args` 内で `{{ステップID}}_output` の形式で参照してください。 (例: `"content": "{{step_1_output}}"`)
 - 出力は必ず以下のJSON形式に従ってください。他のテキストは含めないでください。
 
 **利用可能なツール:**
@@ -121,35 +88,25 @@ IMPROVER_PROMPT = textwrap.dedent("""
 
 # --- Helper Functions ---
 def log_message(message):
-    """ログファイルにメッセージを追記する"""
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    if isinstance(message, (dict, list)):
-        log_content = json.dumps(message, indent=2, ensure_ascii=False)
-    else:
-        log_content = str(message)
-    full_message = f"[{timestamp}] {log_content}\n"
-    print(full_message.strip())
-    try:
-        # ログファイルがなければ作成
-        if not os.path.exists(LOG_FILE):
-            with open(LOG_FILE, "w", encoding="utf-8") as f:
-                f.write("") # 空ファイル作成
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(full_message)
-    except Exception as e:
-        print(f"Error writing to log file: {e}")
+    """ログファイルにメッセージを追記する（書き込みはバックグラウンドで行う）"""
+    _log_pipeline.log(message)
 
-def call_gemini(prompt: str, model_name="gemini-1.5-pro-latest") -> str:
-    """Gemini APIを呼び出して応答を取得する"""
+# --- Available Tools Definition ---
+# ツールの定義と実行は tool_registry に集約し、プランナーに渡す一覧もそこから作る
+TOOL_REGISTRY = build_default_registry(log_message, _tool_executor)
+AVAILABLE_TOOLS = TOOL_REGISTRY.schemas()
+
+def _begin_gemini_call(prompt: str, model_name: str) -> tuple:
+    """APIキーを確認し、(エラーメッセージ or None, Fluentd用ログデータ) を返す"""
     current_api_key = os.getenv("GOOGLE_API_KEY")
     if not current_api_key and os.getenv("TESTING") != "true":
-        return "Error: 環境変数 GOOGLE_API_KEY が設定されていません。"
-    
-    if current_api_key:
-        genai.configure(api_key=current_api_key)
+        return "Error: 環境変数 GOOGLE_API_KEY が設定されていません。", None
+
+    # APIキーが変わったときだけ genai.configure を呼ぶ
+    _gemini_client.configure(current_api_key)
 
     log_message(f"Calling Gemini API (Model: {model_name})...")
-    
+
     # Log to Fluentd
     log_data = {
         "event": "gemini_api_call",
@@ -157,43 +114,70 @@ def call_gemini(prompt: str, model_name="gemini-1.5-pro-latest") -> str:
         "prompt": prompt,
         "timestamp": datetime.datetime.utcnow().isoformat()
     }
-    
-    result_text = ""
-    try:
-        model = genai.GenerativeModel(model_name)
-        response = model.generate_content(prompt)
-
-        if hasattr(response, 'text') and response.text:
-            result_text = response.text
-            log_message("Gemini API call successful.")
-        elif response.candidates:
-             candidate = response.candidates[0]
-             if candidate.content and candidate.content.parts:
-                 result_text = candidate.content.parts[0].text
-                 log_message("Gemini API call successful (using candidate).")
-             else:
-                 finish_reason = candidate.finish_reason.name if hasattr(candidate, 'finish_reason') and candidate.finish_reason else "UNKNOWN"
-                 safety_ratings = candidate.safety_ratings if hasattr(candidate, 'safety_ratings') else []
-                 safety_issues = [f"{r.category.name}: {r.probability.name}" for r in safety_ratings if hasattr(r, 'probability') and r.probability.name != "NEGLIGIBLE"]
-                 if safety_issues:
-                     safety_msg = ", ".join(safety_issues)
-                     result_text = f"Error: Content blocked by safety settings ({safety_msg})"
-                 else:
-                    result_text = f"Error: No text content in Gemini response candidate (Finish Reason: {finish_reason})."
-                 log_message(result_text)
+    return None, log_data
+
+def _response_text(response) -> str:
+    """Geminiの応答からテキストを取り出す。取り出せない場合は 'Error:' で始まる文字列を返す"""
+    if hasattr(response, 'text') and response.text:
+        log_message("Gemini API call successful.")
+        return response.text
+    elif response.candidates:
+         candidate = response.candidates[0]
+         if candidate.content and candidate.content.parts:
+             log_message("Gemini API call successful (using candidate).")
+             return candidate.content.parts[0].text
+         finish_reason = candidate.finish_reason.name if hasattr(candidate, 'finish_reason') and candidate.finish_reason else "UNKNOWN"
+         safety_ratings = candidate.safety_ratings if hasattr(candidate, 'safety_ratings') else []
+         safety_issues = [f"{r.category.name}: {r.probability.name}" for r in safety_ratings if hasattr(r, 'probability') and r.probability.name != "NEGLIGIBLE"]
+         if safety_issues:
+             safety_msg = ", ".join(safety_issues)
+             result_text = f"Error: Content blocked by safety settings ({safety_msg})"
+         else:
+            result_text = f"Error: No text content in Gemini response candidate (Finish Reason: {finish_reason})."
+         log_message(result_text)
+         return result_text
+    else:
+        if hasattr(response, 'prompt_feedback') and response.prompt_feedback.block_reason:
+             block_reason = response.prompt_feedback.block_reason.name if hasattr(response.prompt_feedback.block_reason, 'name') else "UNKNOWN"
+             result_text = f"Error: Content blocked by safety settings ({block_reason})"
         else:
-            if hasattr(response, 'prompt_feedback') and response.prompt_feedback.block_reason:
-                 block_reason = response.prompt_feedback.block_reason.name if hasattr(response.prompt_feedback.block_reason, 'name') else "UNKNOWN"
-                 result_text = f"Error: Content blocked by safety settings ({block_reason})"
-            else:
-                result_text = "Error: Unknown issue with Gemini response."
-            log_message(result_text)
-            log_message(f"Full Gemini Response: {response}")
+            result_text = "Error: Unknown issue with Gemini response."
+        log_message(result_text)
+        log_message(f"Full Gemini Response: {response}")
+        return result_text
 
+def call_gemini(prompt: str, model_name="gemini-1.5-pro-latest", bypass_cache=False, refresh_cache=False) -> str:
+    """Gemini APIを呼び出して応答を取得する。同じ (モデル, プロンプト) の応答はキャッシュから返す"""
+    if _response_cache is None:
+        return _call_gemini_api(prompt, model_name)
+    return _response_cache.get_or_call(
+        cache_key(model_name, prompt),
+        lambda: _call_gemini_api(prompt, model_name),
+        bypass=bypass_cache, refresh=refresh_cache, should_cache=is_cacheable_response
+    )
+
+async def call_gemini_async(prompt: str, model_name="gemini-1.5-pro-latest", bypass_cache=False, refresh_cache=False) -> str:
+    """call_gemini の非同期版。同時実行数は GeminiClient のセマフォで制限される"""
+    if _response_cache is None:
+        return await _call_gemini_api_async(prompt, model_name)
+    return await _response_cache.aget_or_call(
+        cache_key(model_name, prompt),
+        lambda: _call_gemini_api_async(prompt, model_name),
+        bypass=bypass_cache, refresh=refresh_cache, should_cache=is_cacheable_response
+    )
+
+def _call_gemini_api(prompt: str, model_name: str) -> str:
+    """Gemini APIを呼び出して応答を取得する"""
+    error_message, log_data = _begin_gemini_call(prompt, model_name)
+    if error_message:
+        return error_message
+
+    try:
+        response = _gemini_client.generate_sync(prompt, model_name)
+        result_text = _response_text(response)
         log_data["response"] = result_text
         # In a real scenario, you would get token count from the response if available
         # log_data["token_usage"] = {"prompt_tokens": ..., "response_tokens": ...}
-        
         return result_text
 
     except Exception as e:
@@ -202,15 +186,28 @@ def call_gemini(prompt: str, model_name="gemini-1.5-pro-latest") -> str:
         log_data["error"] = error_message
         return error_message
     finally:
-        try:
-            # Assuming fluentd is running on localhost and mapped to port 8888
-            # In a containerized setup, this would be 'http://fluentd:8888/gemini.log'
-            fluentd_url = "http://localhost:8888/gemini.log" 
-            requests.post(fluentd_url, data=json.dumps(log_data), 
-                         headers={'Content-Type': 'application/json'}, 
-                         timeout=5)
-        except requests.exceptions.RequestException as e:
-            log_message(f"Failed to log to Fluentd: {e}")
+        # Fluentdへの転送はバックグラウンドでまとめて行う
+        _log_pipeline.ship(log_data)
+
+async def _call_gemini_api_async(prompt: str, model_name: str) -> str:
+    """_call_gemini_api の非同期版"""
+    error_message, log_data = _begin_gemini_call(prompt, model_name)
+    if error_message:
+        return error_message
+
+    try:
+        response = await _gemini_client.generate(prompt, model_name)
+        result_text = _response_text(response)
+        log_data["response"] = result_text
+        return result_text
+
+    except Exception as e:
+        error_message = f"Error: {type(e).__name__}: {e}"
+        log_message(f"Error calling Gemini API: {error_message}")
+        log_data["error"] = error_message
+        return error_message
+    finally:
+        _log_pipeline.ship(log_data)
 
 
 def parse_json_from_gemini(response_text: str) -> list | dict | None:
@@ -239,14 +236,13 @@ def parse_json_from_gemini(response_text: str) -> list | dict | None:
         return None
 
 # --- Core Agent Functions ---
-def plan(task_description: str) -> list | None:
-    """Gemini APIを使ってタスクの実行計画を生成する"""
+def _planner_prompt(task_description: str) -> str:
     log_message(f"--- Planning Task ---")
     log_message(f"Task: {task_description}")
     tools_json = json.dumps(AVAILABLE_TOOLS, indent=2, ensure_ascii=False)
-    prompt = PLANNER_PROMPT.format(tools_json=tools_json, task_description=task_description)
+    return PLANNER_PROMPT.format(tools_json=tools_json, task_description=task_description)
 
-    response_text = call_gemini(prompt)
+def _parse_plan(response_text: str) -> list | None:
     if response_text.startswith("Error:"):
         log_message(f"Planning failed due to Gemini API error: {response_text}")
         return None
@@ -261,146 +257,49 @@ def plan(task_description: str) -> list | None:
         log_message("Planning failed: Could not generate a valid plan list from Gemini response.")
         return None
 
-def execute(steps: list) -> list:
+def plan(task_description: str, bypass_cache=False, refresh_cache=False) -> list | None:
     """
-    計画されたステップを実行する。
-    Clineツールの呼び出しは模倣し、実行指示をログに出力する。
+    Gemini APIを使ってタスクの実行計画を生成する。
+    bypass_cache=True でキャッシュを使わず、refresh_cache=True で計画を作り直してキャッシュを更新する。
     """
-    results = []
-    memory = {} # ステップ間のデータ保持用 (ステップID -> 出力結果 or None)
-    log_message(f"--- Executing Plan ({len(steps)} steps) ---")
+    prompt = _planner_prompt(task_description)
+    return _parse_plan(call_gemini(prompt, bypass_cache=bypass_cache, refresh_cache=refresh_cache))
 
-    for i, step in enumerate(steps):
-        step_id = step.get("id", f"step_{i+1}")
-        log_message(f"--- Executing Step {i+1}/{len(steps)} (ID: {step_id}) ---")
-        log_message(f"Description: {step.get('description', 'N/A')}")
-        tool_name = step.get("tool")
-        args = step.get("args", {}).copy()
-
-        step_result = {
-            "step": i + 1, "id": step_id, "tool": tool_name, "args": args,
-            "resolved_args": {}, "status": "pending", "output": None,
-            "error": None, "skipped": False
-        }
-
-        if not tool_name:
-             log_message(f"Skipping step {step_id} because 'tool' is missing.")
-             step_result.update({"status": "skipped", "error": "Tool name missing", "skipped": True})
-             results.append(step_result)
-             memory[step_id] = None
-             continue
-
-        try:
-            # 依存関係の解決
-            dependencies = step.get("dependencies", [])
-            can_execute = True
-            log_message(f"Checking dependencies: {dependencies}")
-            for dep_id in dependencies:
-                if dep_id not in memory:
-                    step_result.update({"status": "skipped", "error": f"Dependency '{dep_id}' result not found", "skipped": True})
-                    can_execute = False; break
-                if memory[dep_id] is None:
-                    step_result.update({"status": "skipped", "error": f"Dependency '{dep_id}' failed/skipped", "skipped": True})
-                    can_execute = False; break
-
-            if not can_execute:
-                results.append(step_result)
-                memory[step_id] = None
-                continue
-
-            # 引数プレースホルダー置換
-            resolved_args = args.copy()
-            for key, value in args.items():
-                 if isinstance(value, str) and value.startswith("{") and value.endswith("}"):
-                    placeholder = value[1:-1]
-                    if placeholder.endswith("_output"):
-                        dep_id = placeholder[:-7]
-                        if dep_id in memory and memory[dep_id] is not None:
-                            resolved_args[key] = memory[dep_id]
-                            log_message(f"Resolved placeholder '{value}' using output from step '{dep_id}'.")
-                        else:
-                            # 依存関係チェックで捕捉されるはずだが念のためエラー
-                            raise ValueError(f"Could not resolve placeholder '{value}': Dependency '{dep_id}' result not found or is None.")
-                    # else: # 想定外のプレースホルダーは無視または警告
-
-            step_result["resolved_args"] = resolved_args
-            log_message(f"Tool: {tool_name}")
-            log_message(f"Arguments (resolved):")
-            log_message(resolved_args)
-
-            # --- Cline Tool Execution Simulation ---
-            output_from_tool = None
-
-            if tool_name == "write_to_file":
-                path = resolved_args.get("path")
-                content = resolved_args.get("content")
-                if path is not None and content is not None:
-                    content_str = str(content) # Ensure content is string
-                    log_message(f"[SIMULATE] Would call Cline: <write_to_file><path>{path}</path><content>... (content omitted)")
-                    output_from_tool = f"Successfully wrote to {path}"
-                else:
-                    raise ValueError("Missing 'path' or 'content' for write_to_file.")
-
-            elif tool_name == "execute_command":
-                command = resolved_args.get("command")
-                if command is not None:
-                    log_message(f"[SIMULATE] Would execute command: {command}")
-                    # 実際のコマンド実行をシミュレート
-                    try:
-                        result = subprocess.run(command, shell=True, capture_output=True, text=True, check=True)
-                        output_from_tool = {"stdout": result.stdout, "stderr": result.stderr}
-                        log_message(f"Command stdout: {result.stdout}")
-                        if result.stderr:
-                            log_message(f"Command stderr: {result.stderr}")
-                    except subprocess.CalledProcessError as e:
-                        output_from_tool = {"stdout": e.stdout, "stderr": e.stderr, "error": str(e)}
-                        log_message(f"Command failed with error: {e}")
-                        log_message(f"Command stdout: {e.stdout}")
-                        log_message(f"Command stderr: {e.stderr}")
-                        raise # エラーを再スローして外側のtry-exceptで捕捉
-                else:
-                    raise ValueError("Missing 'command' for execute_command.")
-
-            elif tool_name == "read_file":
-                path = resolved_args.get("path")
-                if path is not None:
-                    log_message(f"[SIMULATE] Would read file: {path}")
-                    try:
-                        with open(path, 'r', encoding='utf-8') as f:
-                            output_from_tool = f.read()
-                    except FileNotFoundError:
-                        raise FileNotFoundError(f"File not found: {path}")
-                    except Exception as e:
-                        raise Exception(f"Error reading file {path}: {e}")
-                else:
-                    raise ValueError("Missing 'path' for read_file.")
-
-            elif tool_name == "list_files":
-                path = resolved_args.get("path")
-                if path is not None:
-                    log_message(f"[SIMULATE] Would list files in: {path}")
-                    try:
-                        if not os.path.isdir(path):
-                            raise ValueError(f"Path is not a directory: {path}")
-                        output_from_tool = os.listdir(path)
-                    except FileNotFoundError:
-                        raise FileNotFoundError(f"Directory not found: {path}")
-                    except Exception as e:
-                        raise Exception(f"Error listing files in {path}: {e}")
-                else:
-                    raise ValueError("Missing 'path' for list_files.")
-
-            # --- End Cline Tool Execution Simulation ---
-
-            step_result.update({"status": "success", "output": output_from_tool})
-            memory[step_id] = output_from_tool
-
-        except Exception as e:
-            log_message(f"Error executing step {step_id}: {e}")
-            step_result.update({"status": "failed", "error": str(e)})
-            memory[step_id] = None # 失敗したステップの出力はNoneとする
-
-        results.append(step_result)
+async def plan_async(task_description: str, bypass_cache=False, refresh_cache=False) -> list | None:
+    """plan の非同期版"""
+    prompt = _planner_prompt(task_description)
+    return _parse_plan(await call_gemini_async(prompt, bypass_cache=bypass_cache, refresh_cache=refresh_cache))
 
+async def plan_many(task_descriptions: list, bypass_cache=False, refresh_cache=False) -> list:
+    """複数タスクの計画を並行して生成し、入力順の結果リストを返す"""
+    return await asyncio.gather(
+        *(plan_async(task, bypass_cache, refresh_cache) for task in task_descriptions)
+    )
+
+def execute(steps: list, max_workers: int | None = None, store: StepOutputStore | None = None) -> list:
+    """
+    計画されたステップを実行する。
+    ツールは TOOL_REGISTRY で実行する。write_to_file は書き込まずにログだけ残すが、
+    read_file / list_files / execute_command は実際に実行する（execute_command は ToolExecutor でシェルコマンドを
+    実行する。タイムアウトと出力の上限はあるがサンドボックスではない）。
+    依存関係のないステップは plan_scheduler により並行に実行され、結果は計画順で返る。
+    一時ファイルに書き出された大きな出力は、結果では describe() の要約になる。内容が必要なら
+    store を渡して実行後に store.get(ステップID) で読む（close は呼び出し側。省略時は実行後に削除）。
+    """
+    log_message(f"--- Executing Plan ({len(steps)} steps) ---")
+    results = run_plan(
+        steps,
+        lambda i, step, memory: execute_step(
+            i, step, memory, len(steps),
+            run_tool=lambda name, args: run_tool(name, args),
+            log_message=log_message
+        ),
+        max_workers=max_workers,
+        store=store
+    )
     log_message("--- Plan Execution Finished ---")
-    return results
\ No newline at end of file
+    return results
+
+def run_tool(tool_name: str, resolved_args: dict):
+    """登録済みのツールを実行し、ツールの出力を返す（未登録のツールは NotImplementedError）"""
+    return TOOL_REGISTRY.call(tool_name, resolved_args)
@@ -1,62 +1,37 @@
 import json
-import datetime
 import os
 import google.generativeai as genai
 import textwrap # for dedenting prompts
-import subprocess # For execute_command simulation
 import time # For potential retries
+from plan_scheduler import execute_step, run_plan
+from step_store import StepOutputStore
+from log_pipeline import LogPipeline
+from gemini_client import GeminiClient, is_cacheable_response
+from tool_executor import ToolExecutor
+from tool_registry import build_default_registry
+from mcp_shared import cache_key, response_cache_from_env, retry_policy_from_env, shared_limiter
 
 LOG_FILE = "gemini_agent_v2_log.txt" # Use a new log file
 MAX_ITERATIONS = 3 # Limit the number of plan-execute-improve cycles
+_log_pipeline = LogPipeline(LOG_FILE)
 
 # --- Gemini API Key Configuration ---
 API_KEY = os.getenv("GOOGLE_API_KEY")
 if not API_KEY:
     raise ValueError("エラー: 環境変数 GOOGLE_API_KEY が設定されていません。")
 
-genai.configure(api_key=API_KEY)
-
-# --- Available Tools Definition (Simulated Cline Tools) ---
-AVAILABLE_TOOLS = [
-    {
-        "name": "read_file",
-        "description": "指定されたパスのファイルの内容を読み取る。",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "path": {"type": "string", "description": "読み取るファイルのパス"}
-            },
-            "required": ["path"]
-        }
-    },
-    {
-        "name": "write_to_file",
-        "description": "指定されたパスに指定された内容を書き込む。ファイルが存在しない場合は作成される。",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "path": {"type": "string", "description": "書き込むファイルのパス"},
-                "content": {"type": "string", "description": "書き込む内容"}
-            },
-            "required": ["path", "content"]
-        }
-    },
-    {
-        "name": "execute_command",
-        "description": "指定されたシェルコマンドを実行する。",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "command": {"type": "string", "description": "実行するシェルコマンド"}
-            },
-            "required": ["command"]
-        }
-    },
-    # { # Example for adding search_files later
-    #     "name": "search_files",
-    #     "description": "指定されたディレクトリ内のファイルを正規表現で検索する。",
-    #     "parameters": { ... }
-    # }
+# 429などは予算(LLM_RATE_LIMITS等)に従って待ってから再試行する
+_gemini_client = GeminiClient(rate_limiter=shared_limiter(), retry_policy=retry_policy_from_env())
+# execute_command の実行エンジン（TOOL_COMMAND_TIMEOUT / TOOL_MAX_CONCURRENCY / TOOL_OUTPUT_*_BYTES で設定）
+_tool_executor = ToolExecutor()
+_gemini_client.configure(API_KEY)
+_response_cache = response_cache_from_env()
+
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
 ]
 
 # --- System Prompts ---
@@ -66,7 +41,7 @@ PLANNER_PROMPT = textwrap.dedent("""
 **制約:**
 - 利用可能なツールのみを使用してください。
 - 各ステップは、単一のツール呼び出しに対応する必要があります。
-- ステップ間の依存関係を考慮してください。前のステップの出力が必要な場合は、`args` 内で `{ステップID}_output` の形式で参照してください。 (例: `"content": "{step_1_output}"`)
+- ステップ間の依存関係を考慮してください。前のステップの出力が必要な場合は、`args` 内で `{{ステップID}}_output` の形式で参照してください。 (例: `"content": "{{step_1_output}}"`)
 - 出力は必ず以下のJSON形式に従ってください。他のテキストは含めないでください。
 
 **利用可能なツール:**
@@ -120,34 +95,32 @@ IMPROVER_PROMPT = textwrap.dedent("""
 
 # --- Helper Functions ---
 def log_message(message):
-    """ログファイルにメッセージを追記する"""
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    if isinstance(message, (dict, list)):
-        log_content = json.dumps(message, indent=2, ensure_ascii=False)
-    else:
-        log_content = str(message)
-    full_message = f"[{timestamp}] {log_content}\n"
-    print(full_message.strip())
-    try:
-        # ログファイルがなければ作成
-        if not os.path.exists(LOG_FILE):
-            with open(LOG_FILE, "w", encoding="utf-8") as f: f.write("")
-        with open(LOG_FILE, "a", encoding="utf-8") as f: f.write(full_message)
-    except Exception as e:
-        print(f"Error writing to log file: {e}")
-
-def call_gemini(prompt: str, model_name="gemini-1.5-pro-latest") -> str:
+    """ログファイルにメッセージを追記する（書き込みはバックグラウンドで行う）"""
+    _log_pipeline.log(message)
+
+# --- Available Tools Definition ---
+# ツールの定義と実行は tool_registry に集約し、プランナーに渡す一覧もそこから作る
+# v2のプランナーは list_files を使わないため登録しない（プランナーに見せるツールと実行できるツールを揃える）
+TOOL_REGISTRY = build_default_registry(log_message, _tool_executor, tools=["read_file", "write_to_file", "execute_command"])
+AVAILABLE_TOOLS = TOOL_REGISTRY.schemas()
+
+def call_gemini(prompt: str, model_name="gemini-1.5-pro-latest", bypass_cache=False, refresh_cache=False) -> str:
+    """Gemini APIを呼び出して応答を取得する。同じ (モデル, プロンプト, 安全性設定) の応答はキャッシュから返す"""
+    if _response_cache is None:
+        return _call_gemini_api(prompt, model_name)
+    return _response_cache.get_or_call(
+        cache_key(model_name, prompt, {"safety_settings": SAFETY_SETTINGS}),
+        lambda: _call_gemini_api(prompt, model_name),
+        bypass=bypass_cache, refresh=refresh_cache,
+        should_cache=is_cacheable_response
+    )
+
+def _call_gemini_api(prompt: str, model_name: str) -> str:
     """Gemini APIを呼び出して応答を取得する"""
     log_message(f"Calling Gemini API (Model: {model_name})...")
     try:
-        safety_settings = [
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        ]
-        model = genai.GenerativeModel(model_name, safety_settings=safety_settings)
-        response = model.generate_content(prompt)
+        # モデルは (モデル名, 安全性設定) ごとにキャッシュされる
+        response = _gemini_client.generate_sync(prompt, model_name, SAFETY_SETTINGS)
 
         if response.candidates:
              candidate = response.candidates[0]
@@ -202,14 +175,14 @@ def parse_json_from_gemini(response_text: str) -> list | dict | None:
         return None
 
 # --- Core Agent Functions ---
-def plan(task_description: str) -> list | None:
-    """Gemini APIを使ってタスクの実行計画を生成する"""
+def plan(task_description: str, bypass_cache=False, refresh_cache=False) -> list | None:
+    """Gemini APIを使ってタスクの実行計画を生成する（bypass_cache/refresh_cache でキャッシュを制御）"""
     log_message(f"--- Planning Task ---")
     log_message(f"Task: {task_description}")
     tools_json = json.dumps(AVAILABLE_TOOLS, indent=2, ensure_ascii=False)
     prompt = PLANNER_PROMPT.format(tools_json=tools_json, task_description=task_description)
 
-    response_text = call_gemini(prompt)
+    response_text = call_gemini(prompt, bypass_cache=bypass_cache, refresh_cache=refresh_cache)
     if response_text.startswith("Error:"):
         log_message(f"Planning failed due to Gemini API error: {response_text}")
         return None
@@ -224,78 +197,30 @@ def plan(task_description: str) -> list | None:
         log_message("Planning failed: Could not generate a valid plan list from Gemini response.")
         return None
 
-def execute(steps: list) -> list:
+def execute(steps: list, max_workers: int | None = None, store: StepOutputStore | None = None) -> list:
     """
     計画されたステップを実行する。
-    Clineツールの呼び出しは模倣し、実行指示をログに出力する。
+    ツールは TOOL_REGISTRY で実行する。write_to_file は書き込まずにログだけ残すが、
+    read_file / execute_command は実際に実行する（execute_command は ToolExecutor でシェルコマンドを
+    実行する。タイムアウトと出力の上限はあるがサンドボックスではない）。
+    依存関係のないステップは plan_scheduler により並行に実行され、結果は計画順で返る。
+    一時ファイルに書き出された大きな出力は、結果では describe() の要約になる。内容が必要なら
+    store を渡して実行後に store.get(ステップID) で読む（close は呼び出し側。省略時は実行後に削除）。
     """
-    results = []
-    memory = {} # ステップ間のデータ保持用 (ステップID -> 出力結果 or None)
     log_message(f"--- Executing Plan ({len(steps)} steps) ---")
-
-    for i, step in enumerate(steps):
-        step_id = step.get("id", f"step_{i+1}")
-        log_message(f"--- Executing Step {i+1}/{len(steps)} (ID: {step_id}) ---")
-        log_message(f"Description: {step.get('description', 'N/A')}")
-        tool_name = step.get("tool")
-        args = step.get("args", {}).copy()
-
-        step_result = {
-            "step": i + 1, "id": step_id, "tool": tool_name, "args": args,
-            "resolved_args": {}, "status": "pending", "output": None,
-            "error": None, "skipped": False
-        }
-
-        if not tool_name:
-             log_message(f"Skipping step {step_id} because 'tool' is missing.")
-             step_result.update({"status": "skipped", "error": "Tool name missing", "skipped": True})
-             results.append(step_result)
-             memory[step_id] = None
-             continue
-
-        try:
-            # 依存関係の解決
-            dependencies = step.get("dependencies", [])
-            can_execute = True
-            log_message(f"Checking dependencies: {dependencies}")
-            for dep_id in dependencies:
-                if dep_id not in memory:
-                    step_result.update({"status": "skipped", "error": f"Dependency '{dep_id}' result not found", "skipped": True})
-                    can_execute = False; break
-                if memory[dep_id] is None:
-                    step_result.update({"status": "skipped", "error": f"Dependency '{dep_id}' failed/skipped", "skipped": True})
-                    can_execute = False; break
-
-            if not can_execute:
-                results.append(step_result)
-                memory[step_id] = None
-                continue
-
-            # 引数プレースホルダー置換
-            resolved_args = args.copy()
-            for key, value in args.items():
-                 if isinstance(value, str) and value.startswith("{") and value.endswith("}"):
-                    placeholder = value[1:-1]
-                    if placeholder.endswith("_output"):
-                        dep_id = placeholder[:-7]
-                        if dep_id in memory and memory[dep_id] is not None:
-                            resolved_args[key] = memory[dep_id]
-                            log_message(f"Resolved placeholder '{value}' using output from step '{dep_id}'.")
-                        else:
-                            raise ValueError(f"Could not resolve placeholder '{value}': Dependency '{dep_id}' result not found or is None.")
-                    # else: # Ignore non-output placeholders
-
-            step_result["resolved_args"] = resolved_args
-            log_message(f"Tool: {tool_name}")
-            log_message(f"Arguments (resolved):")
-            log_message(resolved_args)
-
-            # --- Cline Tool Execution Simulation ---
-            output_from_tool = None
-
-            if tool_name == "write_to_file":
-                path = resolved_args.get("path")
-                content = resolved_args.get("content")
-                if path is not None and content is not None:
-                    content_str = str(content) # Ensure content is string
-                    log_message(f"[SIMULATE] Would call Cline: <write_to_file><path>{path}</path><content>...
+    results = run_plan(
+        steps,
+        lambda i, step, memory: execute_step(
+            i, step, memory, len(steps),
+            run_tool=lambda name, args: run_tool(name, args),
+            log_message=log_message
+        ),
+        max_workers=max_workers,
+        store=store
+    )
+    log_message("--- Plan Execution Finished ---")
+    return results
+
+def run_tool(tool_name: str, resolved_args: dict):
+    """登録済みのツールを実行し、ツールの出力を返す（未登録のツールは NotImplementedError）"""
+    return TOOL_REGISTRY.call(tool_name, resolved_args)
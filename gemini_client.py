@@ -0,0 +1,135 @@
+"""Gemini APIの非同期クライアント
+
+GenerativeModel を (モデル名, 安全性設定) ごとに1つだけ生成して使い回し、
+genai.configure もAPIキーが変わったときだけ呼ぶ（gRPCチャネルを再利用するため）。
+非同期呼び出しはセマフォで同時実行数を制限する。
+rate_limiter を渡すとモデルごとの予算内で呼び出し、429などの一時的なエラーは再試行する。
+model_factory を差し替えると、APIに接続せずにテストやベンチマークができる。
+"""
+import asyncio
+import os
+import threading
+import weakref
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from mcp_shared import RateLimiter, RetryPolicy, acall_with_retry, call_with_retry, estimate_tokens
+
+DEFAULT_MODEL = "gemini-1.5-pro-latest"
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))
+
+ModelFactory = Callable[[str, Optional[list]], Any]
+
+def _genai_model_factory(model_name: str, safety_settings: Optional[list]):
+    import google.generativeai as genai
+    return genai.GenerativeModel(model_name, safety_settings=safety_settings)
+
+def is_cacheable_response(response_text: str) -> bool:
+    """応答キャッシュに保存してよいか（エージェントがエラー時に返す "Error..." の文字列は保存しない）"""
+    return bool(response_text) and not response_text.startswith("Error")
+
+def _freeze(value) -> Any:
+    """安全性設定をキャッシュキーに使えるようにハッシュ可能な形へ変換する"""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+class GeminiClient:
+    """モデルをキャッシュし、同時実行数を制限してGeminiを呼び出すクライアント"""
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        model_factory: Optional[ModelFactory] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        retry_policy: Optional[RetryPolicy] = None
+    ):
+        self.max_concurrency = max_concurrency or DEFAULT_MAX_CONCURRENCY
+        self._model_factory = model_factory or _genai_model_factory
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy()
+        self._models: Dict[Tuple[str, Any], Any] = {}
+        self._lock = threading.Lock()
+        self._api_key: Optional[str] = None
+        # asyncio.Semaphore はイベントループに紐づくため、ループごとに作る
+        self._semaphores: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def configure(self, api_key: Optional[str]):
+        """APIキーが変わったときだけ genai.configure を呼ぶ"""
+        if not api_key or api_key == self._api_key:
+            return
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        with self._lock:
+            self._api_key = api_key
+            self._models.clear()
+
+    def get_model(self, model_name: str = DEFAULT_MODEL, safety_settings: Optional[list] = None):
+        """キャッシュ済みのモデルを返す。なければ生成する"""
+        key = (model_name, _freeze(safety_settings))
+        model = self._models.get(key)
+        if model is None:
+            with self._lock:
+                model = self._models.get(key)
+                if model is None:
+                    model = self._model_factory(model_name, safety_settings)
+                    self._models[key] = model
+        return model
+
+    def generate_sync(self, prompt: str, model_name: str = DEFAULT_MODEL, safety_settings: Optional[list] = None):
+        """同期版。キャッシュ済みモデルで generate_content を呼ぶ"""
+        model = self.get_model(model_name, safety_settings)
+
+        def call():
+            self.calls += 1
+            return model.generate_content(prompt)
+
+        return call_with_retry(call, model_name, estimate_tokens(prompt), self.rate_limiter, self.retry_policy)
+
+    async def generate(self, prompt: str, model_name: str = DEFAULT_MODEL, safety_settings: Optional[list] = None):
+        """セマフォの範囲内で generate_content_async を呼ぶ（予算待ち・再試行の待機中は枠を占有しない）"""
+        model = self.get_model(model_name, safety_settings)
+
+        async def call():
+            async with self._semaphore():
+                self.calls += 1
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                try:
+                    return await model.generate_content_async(prompt)
+                finally:
+                    self.in_flight -= 1
+
+        return await acall_with_retry(call, model_name, estimate_tokens(prompt), self.rate_limiter, self.retry_policy)
+
+    async def generate_many(
+        self,
+        prompts: Iterable[str],
+        model_name: str = DEFAULT_MODEL,
+        safety_settings: Optional[list] = None
+    ) -> List[Any]:
+        """複数のプロンプトを並行に送信し、入力順の応答（失敗時は例外オブジェクト）を返す"""
+        return await asyncio.gather(
+            *(self.generate(prompt, model_name, safety_settings) for prompt in prompts),
+            return_exceptions=True
+        )
+
+    def stats(self) -> dict:
+        return {
+            "models": len(self._models),
+            "calls": self.calls,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "max_concurrency": self.max_concurrency
+        }
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphores[loop] = semaphore
+        return semaphore
@@ -0,0 +1,201 @@
+"""エージェントのログをバックグラウンドで書き出すパイプライン
+
+log_message の呼び出し側は標準出力への表示とキューへの投入だけを行い、
+ファイルへの追記とFluentdへの転送は専用スレッドがまとめて行う。
+キューが満杯のときは新しいログを捨てて件数を記録する（呼び出し側を待たせない）。
+"""
+import atexit
+import datetime
+import json
+import queue
+import threading
+import time
+from typing import Any, List, Optional
+
+_STOP = object()
+
+def format_message(message: Any) -> str:
+    """dict/listは1行のJSONに、それ以外は文字列に変換する"""
+    if isinstance(message, (dict, list)):
+        return json.dumps(message, ensure_ascii=False, default=str)
+    return str(message)
+
+class LogPipeline:
+    """ファイル追記とFluentd転送をバッチ化するロガー
+
+    - ファイルは開いたままにし、flush_interval 秒ごと（またはバッチ処理後）にflushする
+    - Fluentdへは batch_size 件までをJSON配列として1リクエストで送る
+    - Fluentdへの送信に失敗したら retry_interval 秒間は送信せずに破棄する
+    """
+
+    def __init__(
+        self,
+        log_file: Optional[str],
+        fluentd_url: Optional[str] = None,
+        max_queue_size: int = 10000,
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+        fluentd_timeout: float = 2.0,
+        retry_interval: float = 30.0,
+        echo: bool = True
+    ):
+        self.log_file = log_file
+        self.fluentd_url = fluentd_url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fluentd_timeout = fluentd_timeout
+        self.retry_interval = retry_interval
+        self.echo = echo
+        self.written = 0
+        self.shipped = 0
+        self.dropped = 0
+        self.ship_failures = 0
+        self._file_queue: "queue.Queue" = queue.Queue(maxsize=max_queue_size)
+        self._ship_queue: "queue.Queue" = queue.Queue(maxsize=max_queue_size)
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self._session = None
+        self._ship_suspended_until = 0.0
+
+    def log(self, message: Any):
+        """タイムスタンプ付きで表示し、ファイル書き込みをキューに積む"""
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        full_message = f"[{timestamp}] {format_message(message)}\n"
+        if self.echo:
+            print(full_message.strip())
+        if self.log_file:
+            self._put(self._file_queue, full_message)
+
+    def ship(self, record: dict):
+        """Fluentdへ送るイベントをキューに積む"""
+        if self.fluentd_url:
+            self._put(self._ship_queue, record)
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """キューに積まれた分の書き出し・送信が終わるまで待つ"""
+        if not self._threads or self._closed:
+            return True
+        markers = []
+        for q in (self._file_queue, self._ship_queue):
+            marker = threading.Event()
+            q.put(marker)
+            markers.append(marker)
+        return all(marker.wait(timeout) for marker in markers)
+
+    def close(self, timeout: float = 5.0):
+        """残りを書き出してスレッドを停止する"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self._threads:
+            self._file_queue.put(_STOP)
+            self._ship_queue.put(_STOP)
+            for thread in self._threads:
+                thread.join(timeout)
+        if self._session is not None:
+            self._session.close()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._file_queue.qsize() + self._ship_queue.qsize(),
+            "written": self.written,
+            "shipped": self.shipped,
+            "dropped": self.dropped,
+            "ship_failures": self.ship_failures
+        }
+
+    def _put(self, q: "queue.Queue", item):
+        self._ensure_started()
+        try:
+            q.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_started(self):
+        if self._threads or self._closed:
+            return
+        with self._lock:
+            if self._threads or self._closed:
+                return
+            self._threads = [
+                threading.Thread(target=self._run_file_writer, name="log-file-writer", daemon=True),
+                threading.Thread(target=self._run_shipper, name="log-fluentd-shipper", daemon=True)
+            ]
+            for thread in self._threads:
+                thread.start()
+            atexit.register(self.close)
+
+    def _drain(self, q: "queue.Queue"):
+        """1件目を flush_interval まで待ち、続けて取れる分を batch_size まで取り出す"""
+        try:
+            items = [q.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(items) < self.batch_size and not isinstance(items[-1], threading.Event) and items[-1] is not _STOP:
+            try:
+                items.append(q.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _run_file_writer(self):
+        handle = None
+        try:
+            while True:
+                items = self._drain(self._file_queue)
+                lines = [item for item in items if isinstance(item, str)]
+                if lines:
+                    try:
+                        if handle is None:
+                            handle = open(self.log_file, "a", encoding="utf-8")
+                        handle.writelines(lines)
+                        self.written += len(lines)
+                    except Exception as e:
+                        print(f"Error writing to log file: {e}")
+                if handle is not None:
+                    handle.flush()
+                for item in items:
+                    if isinstance(item, threading.Event):
+                        item.set()
+                if items and items[-1] is _STOP:
+                    return
+        finally:
+            if handle is not None:
+                handle.close()
+
+    def _run_shipper(self):
+        while True:
+            items = self._drain(self._ship_queue)
+            records = [item for item in items if isinstance(item, dict)]
+            if records:
+                self._send(records)
+            for item in items:
+                if isinstance(item, threading.Event):
+                    item.set()
+            if items and items[-1] is _STOP:
+                return
+
+    def _send(self, records: List[dict]):
+        if time.monotonic() < self._ship_suspended_until:
+            self.dropped += len(records)
+            return
+        try:
+            import requests
+            if self._session is None:
+                self._session = requests.Session()
+            response = self._session.post(
+                self.fluentd_url,
+                data=json.dumps(records, ensure_ascii=False, default=str),
+                headers={"Content-Type": "application/json"},
+                timeout=self.fluentd_timeout
+            )
+            response.raise_for_status()
+            self.shipped += len(records)
+        except Exception as e:
+            # Fluentdが落ちている間は送信を止め、エージェント側に影響させない
+            self.ship_failures += 1
+            self.dropped += len(records)
+            self._ship_suspended_until = time.monotonic() + self.retry_interval
+            print(f"Failed to log to Fluentd: {e}")
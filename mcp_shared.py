@@ -0,0 +1,20 @@
+"""MCP 側と共有する LLM 応答キャッシュ・レート制限（llm_cache / rate_limiter）の入口
+
+MCP/ は単独でデプロイされる（Dockerfile のビルドコンテキストが MCP/）ため、
+共有モジュールの実体は MCP/ に置いたまま、ルートのスクリプトはこのモジュールを通して使う。
+MCP 側と同じく MCP/ を起点に import する（MCP.rate_limiter と rate_limiter の両方で
+読み込むと別のモジュールになり、shared_limiter やキャッシュが分かれるため）。
+MCP/ を import パスに加えるのはここだけで、他のモジュールは import の順序によらず使える。
+"""
+import os
+import sys
+
+MCP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "MCP")
+if MCP_DIR not in sys.path:
+    sys.path.append(MCP_DIR)
+
+from llm_cache import LLMResponseCache, cache_key, response_cache_from_env
+from rate_limiter import (
+    ModelBudget, RateLimiter, RetryPolicy, acall_with_retry, call_with_retry, estimate_tokens,
+    retry_policy_from_env, shared_limiter
+)
@@ -0,0 +1,179 @@
+"""計画ステップを依存関係グラフに沿って並行実行するスケジューラ
+
+gemini_agent / gemini_agent_v2 の execute から利用する。依存がすべて完了した
+ステップから順にスレッドプールへ投入し、独立したステップは同時に実行する。
+1ステップ分の実行（依存の確認とプレースホルダーの解決）も execute_step として共有する。
+ステップの出力は StepOutputStore に保持し、大きな出力は一時ファイルに書き出して
+OutputRef として後続ステップに渡す（step_store.resolve_output で読み込む）。
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from step_store import OutputRef, StepOutputStore
+
+DEFAULT_MAX_WORKERS = int(os.getenv("PLAN_MAX_WORKERS", "4"))
+
+# (index, step, memory) -> (step_result, output)。outputがNoneなら失敗/スキップ扱い
+# memory の値は出力そのものか OutputRef
+StepExecutor = Callable[[int, dict, Dict[str, Any]], Tuple[dict, Any]]
+
+def step_id_of(step: dict, index: int) -> str:
+    """ステップIDを返す。未指定の場合は位置から採番する"""
+    return step.get("id", f"step_{index + 1}")
+
+def placeholder_dependencies(args: dict) -> List[str]:
+    """引数中の `{ステップID_output}` プレースホルダーが参照するステップIDを返す"""
+    refs = []
+    for value in (args or {}).values():
+        if isinstance(value, str) and value.startswith("{") and value.endswith("}"):
+            placeholder = value[1:-1]
+            if placeholder.endswith("_output"):
+                refs.append(placeholder[:-7])
+    return refs
+
+def execute_step(
+    i: int,
+    step: dict,
+    memory: Dict[str, Any],
+    total_steps: int,
+    run_tool: Callable[[str, dict], Any],
+    log_message: Callable[[Any], None],
+    format_error: Callable[[Exception], str] = str
+) -> tuple:
+    """
+    1ステップを実行し、(ステップ結果, 出力) を返す。
+    失敗またはスキップした場合の出力は None とする。
+    memory は依存ステップの出力 (ステップID -> 出力結果 or None)。
+    ツールの実行は run_tool(ツール名, 引数)、ログは log_message に委ねる（各エージェントで共通）。
+    失敗時の error は format_error(例外) の文字列にする。
+    """
+    step_id = step_id_of(step, i)
+    log_message(f"--- Executing Step {i+1}/{total_steps} (ID: {step_id}) ---")
+    log_message(f"Description: {step.get('description', 'N/A')}")
+    tool_name = step.get("tool")
+    args = step.get("args", {}).copy()
+
+    step_result = {
+        "step": i + 1, "id": step_id, "tool": tool_name, "args": args,
+        "resolved_args": {}, "status": "pending", "output": None,
+        "error": None, "skipped": False
+    }
+
+    if not tool_name:
+         log_message(f"Skipping step {step_id} because 'tool' is missing.")
+         step_result.update({"status": "skipped", "error": "Tool name missing", "skipped": True})
+         return step_result, None
+
+    try:
+        # 依存関係の解決
+        dependencies = step.get("dependencies", [])
+        log_message(f"Checking dependencies: {dependencies}")
+        for dep_id in dependencies:
+            if dep_id not in memory:
+                step_result.update({"status": "skipped", "error": f"Dependency '{dep_id}' result not found", "skipped": True})
+                return step_result, None
+            if memory[dep_id] is None:
+                step_result.update({"status": "skipped", "error": f"Dependency '{dep_id}' failed/skipped", "skipped": True})
+                return step_result, None
+
+        # 引数プレースホルダー置換
+        resolved_args = args.copy()
+        recorded_args = args.copy() # 結果とログ用（ファイルに書き出された出力は要約のまま載せる）
+        for key, value in args.items():
+             if isinstance(value, str) and value.startswith("{") and value.endswith("}"):
+                placeholder = value[1:-1]
+                if placeholder.endswith("_output"):
+                    dep_id = placeholder[:-7]
+                    if dep_id in memory and memory[dep_id] is not None:
+                        dep_output = memory[dep_id]
+                        resolved_args[key] = dep_output # OutputRef は必要なツールだけが読み込む（write_to_fileは逐次コピー）
+                        recorded_args[key] = dep_output.describe() if isinstance(dep_output, OutputRef) else dep_output
+                        log_message(f"Resolved placeholder '{value}' using output from step '{dep_id}'.")
+                    else:
+                        # 依存関係チェックで捕捉されるはずだが念のためエラー
+                        raise ValueError(f"Could not resolve placeholder '{value}': Dependency '{dep_id}' result not found or is None.")
+                # else: # 想定外のプレースホルダーは無視または警告
+
+        step_result["resolved_args"] = recorded_args
+        log_message(f"Tool: {tool_name}")
+        log_message(f"Arguments (resolved):")
+        log_message(recorded_args)
+
+        output_from_tool = run_tool(tool_name, resolved_args)
+        if isinstance(output_from_tool, OutputRef) and not output_from_tool.owned:
+            output_from_tool = output_from_tool.for_step(step_id) # ファイルへの参照に実際のステップIDを付ける
+        step_result.update({"status": "success", "output": output_from_tool})
+        return step_result, output_from_tool
+
+    except Exception as e:
+        log_message(f"Error executing step {step_id}: {e}")
+        step_result.update({"status": "failed", "error": format_error(e)})
+        return step_result, None # 失敗したステップの出力はNoneとする
+
+def run_plan(
+    steps: list,
+    execute_step: StepExecutor,
+    max_workers: Optional[int] = None,
+    store: Optional[StepOutputStore] = None
+) -> list:
+    """依存関係を満たしたステップから並行に実行し、計画順の結果リストを返す
+
+    dependencies に加えてプレースホルダーの参照先も待ち合わせる。計画に存在しない
+    依存や循環している依存は待たずに実行し、execute_step 側の依存チェックで
+    スキップさせる（従来の逐次実行と同じ扱い）。
+
+    書き出した出力は、結果の output を OutputRef.describe() の要約に置き換える。
+    store を渡さなければ実行後に一時ファイルを削除し、渡した場合は呼び出し側が close する。
+    """
+    ids = [step_id_of(step, i) for i, step in enumerate(steps)]
+    index_of: Dict[str, int] = {}
+    for i, step_id in enumerate(ids):
+        index_of.setdefault(step_id, i)
+
+    waiting_on: List[Set[int]] = []
+    dependents: List[List[int]] = [[] for _ in steps]
+    for i, step in enumerate(steps):
+        refs = list(step.get("dependencies") or []) + placeholder_dependencies(step.get("args"))
+        deps = {index_of[ref] for ref in refs if ref in index_of and index_of[ref] != i}
+        waiting_on.append(deps)
+        for dep in deps:
+            dependents[dep].append(i)
+
+    results: List[Optional[dict]] = [None] * len(steps)
+    owns_store = store is None
+    store = store or StepOutputStore()
+    try:
+        _schedule(steps, ids, execute_step, waiting_on, dependents, results, store, max_workers)
+    finally:
+        if owns_store:
+            store.close()
+    return results
+
+def _schedule(steps, ids, execute_step, waiting_on, dependents, results, store, max_workers):
+    ready = [i for i in range(len(steps)) if not waiting_on[i]]
+    pending = set(range(len(steps))) - set(ready)
+
+    with ThreadPoolExecutor(max_workers=max_workers or DEFAULT_MAX_WORKERS) as pool:
+        running = {}
+        while ready or pending or running:
+            if not ready and not running:
+                # 循環依存で進めないステップは依存不足としてスキップさせる
+                ready, pending = sorted(pending), set()
+            for i in ready:
+                running[pool.submit(execute_step, i, steps[i], store.snapshot())] = i
+            ready = []
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in sorted(done, key=running.get):
+                i = running.pop(future)
+                results[i], output = future.result()
+                # 同じIDのステップが複数ある場合は後に完了した出力で上書きする（従来どおり）
+                kept = store.put(ids[i], output)
+                if isinstance(kept, OutputRef) and isinstance(results[i], dict) and "output" in results[i]:
+                    results[i]["output"] = kept.describe()
+                for dependent in dependents[i]:
+                    waiting_on[dependent].discard(i)
+                    if not waiting_on[dependent] and dependent in pending:
+                        pending.discard(dependent)
+                        ready.append(dependent)
+            ready.sort()
@@ -0,0 +1,63 @@
+"""GeminiClient の並行呼び出しをオフラインで計測するベンチマーク
+
+APIの代わりに一定の遅延で応答する偽モデルを使い、従来の逐次呼び出しと
+セマフォで制限した並行呼び出し（generate_many）の所要時間を比較する。
+
+使い方:
+    python scripts/benchmark_gemini_client.py --requests 40 --concurrency 8 --latency 0.2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from gemini_client import GeminiClient
+
+class FakeGenerativeModel:
+    """latency 秒待ってからプロンプトをそのまま返す偽モデル"""
+
+    def __init__(self, model_name: str, safety_settings=None, latency: float = 0.2):
+        self.model_name = model_name
+        self.latency = latency
+
+    def generate_content(self, prompt: str):
+        time.sleep(self.latency)
+        return SimpleNamespace(text=prompt, candidates=[])
+
+    async def generate_content_async(self, prompt: str):
+        await asyncio.sleep(self.latency)
+        return SimpleNamespace(text=prompt, candidates=[])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.2, help="1リクエストあたりの擬似遅延(秒)")
+    args = parser.parse_args()
+
+    client = GeminiClient(
+        max_concurrency=args.concurrency,
+        model_factory=lambda name, safety: FakeGenerativeModel(name, safety, args.latency)
+    )
+    prompts = [f"task {i}" for i in range(args.requests)]
+
+    start = time.perf_counter()
+    for prompt in prompts:
+        client.generate_sync(prompt)
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    asyncio.run(client.generate_many(prompts))
+    concurrent = time.perf_counter() - start
+
+    print(f"requests={args.requests} concurrency={args.concurrency} latency={args.latency}s")
+    print(f"sequential: {sequential:.2f}s")
+    print(f"concurrent: {concurrent:.2f}s ({sequential / concurrent:.1f}x)")
+    print(f"client: {client.stats()}")
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,21 @@
 import json
-import datetime
-import subprocess # Clineのexecute_commandを模倣するため（実際はClineツールを使う）
-import os # Clineのwrite_to_file, read_fileを模倣するため（実際はClineツールを使う）
+from typing import Optional
+
+from log_pipeline import LogPipeline
+from plan_scheduler import execute_step, run_plan
+from step_store import StepOutputStore
+from tool_registry import build_default_registry
 
 LOG_FILE = "agent_log.txt"
+_log_pipeline = LogPipeline(LOG_FILE)
 
 def log_message(message):
-    """ログファイルにメッセージを追記する"""
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    full_message = f"[{timestamp}] {message}\n"
-    # ここでは標準出力とファイル書き込みを行う（Cline環境では不要になる想定）
-    print(full_message.strip())
-    # --- Cline環境では以下のファイル書き込みは不要 ---
-    try:
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(full_message)
-    except Exception as e:
-        print(f"Error writing to log file: {e}")
-    # --- ここまで ---
+    """ログファイルにメッセージを追記する（書き込みはバックグラウンドで行う）"""
+    _log_pipeline.log(message)
+
+# ツールの実行は tool_registry に委ねる（こちらは write_to_file も実際に書き込む）
+# plan() が作るステップで使う read_file / write_to_file だけを登録する
+TOOL_REGISTRY = build_default_registry(log_message, simulate_writes=False, tools=["read_file", "write_to_file"])
 
 def plan(task_description: str) -> list:
     """
@@ -76,98 +74,36 @@ def plan(task_description: str) -> list:
     log_message(f"Generated plan: {steps}")
     return steps
 
-def execute(steps: list) -> list:
+def execute(steps: list, store: Optional[StepOutputStore] = None) -> list:
     """
-    実行ステップのリストを受け取り、順番に実行する。
-    ステップ間のデータ連携（メモリ）と read_file ツール（模倣）を追加。
+    実行ステップのリストを受け取り、依存関係に沿って実行する。
+    依存の確認・プレースホルダーの解決・ツールの呼び出しは Geminiエージェントと共通の
+    plan_scheduler.execute_step で行う。結果の形は従来どおり
+    (step, id, tool, args, status, output, error) で、失敗したステップ（依存先の失敗で
+    実行できなかったステップを含む）は status "error"、error は "例外の型: メッセージ" とする。
+    一時ファイルに書き出された大きな出力は結果では要約になる。内容が必要なら store を渡し、
+    実行後に store.get(ステップID) で読む（close は呼び出し側。省略時は実行後に削除）。
     """
-    results = []
-    memory = {} # ステップ間のデータ保持用
     log_message(f"Executing {len(steps)} steps...")
-
-    # TODO: 依存関係に基づいて実行順序を決定するロジックを追加 (現在はリスト順)
-    for i, step in enumerate(steps):
-        step_id = step.get("id", f"step_{i+1}")
-        log_message(f"Executing step {i+1}/{len(steps)} (ID: {step_id}): {step.get('description', step['tool'])}")
-        tool_name = step.get("tool")
-        args = step.get("args", {}).copy() # 引数をコピーして変更可能にする
-        step_result = {
-            "step": i + 1,
-            "id": step_id,
-            "tool": tool_name,
-            "args": args, # 元の引数も記録
-            "status": "pending",
-            "output": None,
-            "error": None
-        }
-
-        try:
-            # 引数内のプレースホルダーをメモリの値で置換
-            for key, value in args.items():
-                if isinstance(value, str) and value.startswith("{") and value.endswith("}"):
-                    placeholder = value[1:-1] # {} を削除
-                    if placeholder.endswith("_output") and placeholder[:-7] in memory:
-                         # 例: {read_step_output} -> memory['read_step']
-                        args[key] = memory.get(placeholder[:-7])
-                    elif placeholder in memory:
-                        args[key] = memory.get(placeholder)
-
-            if tool_name == "write_to_file":
-                path = args.get("path")
-                content = args.get("content")
-                if path is not None and content is not None:
-                    # --- Cline write_to_file 実行部分 (模倣) ---
-                    dir_path = os.path.dirname(path)
-                    if dir_path and not os.path.exists(dir_path):
-                        os.makedirs(dir_path, exist_ok=True)
-                    with open(path, "w", encoding="utf-8") as f:
-                        f.write(str(content)) # contentがNoneでないことを保証
-                    step_result["status"] = "success"
-                    step_result["output"] = f"Successfully wrote to {path}"
-                    memory[step_id] = step_result["output"] # 結果をメモリに保存
-                    log_message(f"Step {i+1} success: {step_result['output']}")
-                    # --- ここまで ---
-                else:
-                    # contentがNoneの場合もエラーとする
-                    raise ValueError("Missing 'path' or valid 'content' for write_to_file")
-
-            elif tool_name == "read_file":
-                path = args.get("path")
-                if path is not None:
-                    # --- Cline read_file 実行部分 (模倣) ---
-                    # 実際にはClineの <read_file> ツールを使用する
-                    if os.path.exists(path):
-                        with open(path, "r", encoding="utf-8") as f:
-                            file_content = f.read()
-                        step_result["status"] = "success"
-                        step_result["output"] = file_content
-                        memory[step_id] = file_content # 結果をメモリに保存
-                        log_message(f"Step {i+1} success: Read {len(file_content)} characters from {path}")
-                    else:
-                        raise FileNotFoundError(f"File not found: {path}")
-                    # --- ここまで ---
-                else:
-                    raise ValueError("Missing 'path' for read_file")
-
-            # --- 他のClineツール (execute_command) の呼び出しをここに追加 ---
-            # elif tool_name == "execute_command":
-            #     # Cline <execute_command> 呼び出し
-            # --- ここまで ---
-
-            else:
-                raise NotImplementedError(f"Tool '{tool_name}' is not implemented yet.")
-
-        except Exception as e:
-            step_result["status"] = "error"
-            step_result["error"] = f"{type(e).__name__}: {e}"
-            memory[step_id] = None # エラー時はNoneをメモリに保存
-            log_message(f"Step {i+1} error: {step_result['error']}")
-
-        results.append(step_result)
-
+    results = run_plan(steps, lambda i, step, memory: _execute_step(i, step, memory, len(steps)), store=store)
     log_message("Execution finished.")
     return results
 
+def _execute_step(i: int, step: dict, memory: dict, total_steps: int) -> tuple:
+    step_result, output = execute_step(
+        i, step, memory, total_steps, TOOL_REGISTRY.call, log_message,
+        format_error=lambda e: f"{type(e).__name__}: {e}"
+    )
+    return {
+        "step": step_result["step"],
+        "id": step_result["id"],
+        "tool": step_result["tool"],
+        "args": step_result["resolved_args"] or step_result["args"],
+        "status": "error" if step_result["status"] in ("failed", "skipped") else step_result["status"],
+        "output": step_result["output"],
+        "error": step_result["error"]
+    }, output
+
 # スクリプトが直接実行された場合にのみ以下のコードを実行
 if __name__ == "__main__":
     # フェーズ3のテストタスク (エラー発生)
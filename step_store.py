@@ -0,0 +1,231 @@
+"""計画ステップの出力を保持するストア（メモリ使用量の上限付き）
+
+小さな出力はそのままメモリに置き、spill_bytes を超える出力やメモリ上の合計が
+max_memory_bytes を超える出力は一時ファイルに書き出して OutputRef（参照）だけを残す。
+参照先の内容は、プレースホルダーの解決などで必要になったときに load() で読み込む。
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+from typing import Any, Dict, Iterator, Optional
+
+DEFAULT_SPILL_BYTES = int(os.getenv("STEP_OUTPUT_SPILL_BYTES", str(1024 * 1024)))
+DEFAULT_MAX_MEMORY_BYTES = int(os.getenv("STEP_OUTPUT_MEMORY_BYTES", str(64 * 1024 * 1024)))
+DEFAULT_SPILL_DIR = os.getenv("STEP_OUTPUT_SPILL_DIR") or None
+PREVIEW_CHARS = 200
+CHUNK_SIZE = 1024 * 1024
+
+class StaleOutputError(RuntimeError):
+    """参照先のファイルが読み取り後に変更された"""
+
+def file_version(path_or_fd) -> tuple:
+    """ファイルの変更を検出するための (inode, サイズ, mtime, ctime)"""
+    st = os.stat(path_or_fd)
+    return (st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+
+class OutputRef:
+    """ファイル（またはその一部）に置かれたステップ出力への参照
+
+    書き出した出力（owned=True）のほか、read_file が大きなファイルをそのまま指す場合にも使う。
+    その場合は読み取り時の version（file_version）を持ち、後続のステップがファイルを
+    書き換えていたら古い内容の代わりに新しい内容を渡さないよう StaleOutputError にする。
+    """
+
+    def __init__(
+        self,
+        step_id: str,
+        path: str,
+        kind: str,
+        size: int,
+        preview: str,
+        offset: int = 0,
+        owned: bool = True,
+        version: Optional[tuple] = None
+    ):
+        self.step_id = step_id
+        self.path = path
+        self.kind = kind  # text / bytes / json
+        self.size = size  # バイト数
+        self.preview = preview
+        self.offset = offset
+        self.owned = owned  # Trueならストアが書き出したファイル（破棄時に削除する）
+        self.version = version
+
+    def load(self) -> Any:
+        """参照先の内容を読み込んで元の値を返す"""
+        data = b"".join(self.iter_chunks())
+        if self.kind == "bytes":
+            return data
+        text = data.decode("utf-8")
+        return json.loads(text) if self.kind == "json" else text
+
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """参照先をchunk_sizeずつ読み出す（内容全体をメモリに載せずにコピーするため）"""
+        remaining = self.size
+        with open(self.path, "rb") as f:
+            self._check_version(f.fileno())
+            f.seek(self.offset)
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+            # 読んでいる間に書き換えられた場合も検出する
+            self._check_version(f.fileno())
+
+    def for_step(self, step_id: str) -> "OutputRef":
+        """step_id を付け替えた参照を返す（ツールはどのステップから呼ばれたかを知らないため）"""
+        return OutputRef(step_id, self.path, self.kind, self.size, self.preview, self.offset, self.owned, self.version)
+
+    def ensure_current(self):
+        """参照先が読み取り時から変わっていないことを確認する（変わっていれば StaleOutputError）"""
+        self._check_version(self.path)
+
+    def _check_version(self, path_or_fd):
+        if self.version is not None and file_version(path_or_fd) != self.version:
+            raise StaleOutputError(
+                f"{self.path} was modified after step '{self.step_id}' read it; its output is no longer available"
+            )
+
+    def describe(self) -> dict:
+        """結果やログに載せる要約（内容そのものは含めない）
+
+        書き出した出力の内容が必要なら、run_plan に渡したストアの get(ステップID) で読む。
+        """
+        summary = {"ref": self.step_id, "kind": self.kind, "size": self.size, "preview": self.preview}
+        if not self.owned:
+            # ストアが書き出したファイルは close で消えるため、元のファイルを指す場合だけパスを載せる
+            summary["path"] = self.path
+        if self.offset:
+            summary["offset"] = self.offset
+        return summary
+
+    def __repr__(self) -> str:
+        return f"OutputRef({self.step_id!r}, {self.kind}, size={self.size})"
+
+def resolve_output(value: Any) -> Any:
+    """OutputRef なら内容を読み込み、それ以外はそのまま返す"""
+    return value.load() if isinstance(value, OutputRef) else value
+
+def make_preview(data: bytes) -> str:
+    return data[:PREVIEW_CHARS].decode("utf-8", errors="replace")
+
+def encode_output(value: Any):
+    """(種類, 書き出す内容) を返す。書き出せない値は None
+
+    str 以外の値は JSON にする（write_to_file もこれを使い、書き出したかどうかで内容が変わらないようにする）。
+    """
+    if isinstance(value, str):
+        return "text", value
+    if isinstance(value, (bytes, bytearray)):
+        return "bytes", bytes(value)
+    try:
+        return "json", json.dumps(value, ensure_ascii=False)
+    except (TypeError, ValueError):
+        return None
+
+class StepOutputStore:
+    """ステップID -> 出力（またはOutputRef）を保持する"""
+
+    def __init__(
+        self,
+        spill_bytes: Optional[int] = None,
+        max_memory_bytes: Optional[int] = None,
+        spill_dir: Optional[str] = None
+    ):
+        self.spill_bytes = DEFAULT_SPILL_BYTES if spill_bytes is None else spill_bytes
+        self.max_memory_bytes = DEFAULT_MAX_MEMORY_BYTES if max_memory_bytes is None else max_memory_bytes
+        self.spill_dir = spill_dir or DEFAULT_SPILL_DIR
+        self.memory_bytes = 0
+        self.spilled = 0
+        self.spilled_bytes = 0
+        self._values: Dict[str, Any] = {}
+        self._sizes: Dict[str, int] = {}
+        self._dir: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def put(self, step_id: str, value: Any) -> Any:
+        """出力を保存し、保持した値（書き出した場合は OutputRef）を返す"""
+        # 上書きする場合も古いファイルは残す（実行中のステップが参照している可能性があるため。close で削除）
+        with self._lock:
+            self.memory_bytes -= self._sizes.pop(step_id, 0)
+        if value is None or isinstance(value, OutputRef):
+            self._values[step_id] = value
+            return value
+        encoded = encode_output(value)
+        if encoded is None:
+            self._values[step_id] = value  # 書き出せない値はメモリに置く
+            return value
+        kind, data = encoded
+        size = len(data)
+        with self._lock:
+            keep = size < self.spill_bytes and self.memory_bytes + size <= self.max_memory_bytes
+            if keep:
+                self.memory_bytes += size
+                self._sizes[step_id] = size
+                self._values[step_id] = value
+                return value
+        ref = self._spill(step_id, kind, data)
+        self._values[step_id] = ref
+        return ref
+
+    def get(self, step_id: str, default: Any = None) -> Any:
+        """内容を返す（書き出した出力はここで読み込む）"""
+        return resolve_output(self._values.get(step_id, default))
+
+    def discard(self, step_id: str):
+        """出力を破棄する（書き出したファイルも削除する）"""
+        value = self._values.pop(step_id, None)
+        with self._lock:
+            self.memory_bytes -= self._sizes.pop(step_id, 0)
+        if isinstance(value, OutputRef) and value.owned:
+            try:
+                os.remove(value.path)
+            except OSError:
+                pass
+
+    def snapshot(self) -> Dict[str, Any]:
+        """ステップID -> 保持している値（OutputRefは読み込まない）"""
+        return dict(self._values)
+
+    def __contains__(self, step_id: str) -> bool:
+        return step_id in self._values
+
+    def close(self):
+        """書き出したファイルを削除する"""
+        self._values.clear()
+        self._sizes.clear()
+        self.memory_bytes = 0
+        if self._dir is not None:
+            shutil.rmtree(self._dir, ignore_errors=True)
+            self._dir = None
+
+    def stats(self) -> dict:
+        return {
+            "steps": len(self._values),
+            "memory_bytes": self.memory_bytes,
+            "max_memory_bytes": self.max_memory_bytes,
+            "spilled": self.spilled,
+            "spilled_bytes": self.spilled_bytes
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _spill(self, step_id: str, kind: str, data) -> OutputRef:
+        raw = data if kind == "bytes" else data.encode("utf-8")
+        with self._lock:
+            if self._dir is None:
+                self._dir = tempfile.mkdtemp(prefix="step-outputs-", dir=self.spill_dir)
+            self.spilled += 1
+            self.spilled_bytes += len(raw)
+            fd, path = tempfile.mkstemp(prefix=f"{self.spilled:04d}-", suffix=f".{kind}", dir=self._dir)
+        with os.fdopen(fd, "wb") as f:
+            f.write(raw)
+        return OutputRef(step_id, path, kind, len(raw), make_preview(raw))
@@ -0,0 +1,89 @@
+import os
+import sys
+import pytest
+
+# Add project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import dir_cache
+from dir_cache import DirectoryCache
+
+@pytest.fixture
+def tree(tmp_path):
+    (tmp_path / "a" / "b").mkdir(parents=True)
+    (tmp_path / "a" / "b" / "deep.py").write_text("x")
+    (tmp_path / "a" / "mid.py").write_text("xy")
+    (tmp_path / "top.txt").write_text("xyz")
+    return tmp_path
+
+def test_list_filters_depth_and_stat(tree):
+    """再帰・深さ・globパターン・stat付きの一覧のテスト"""
+    cache = DirectoryCache(watch=False)
+    root = str(tree)
+
+    assert cache.list(root) == ["a", "top.txt"]
+    assert cache.list(root, recursive=True) == ["a", "a/b", "a/b/deep.py", "a/mid.py", "top.txt"]
+    assert cache.list(root, recursive=True, pattern="*.py") == ["a/b/deep.py", "a/mid.py"]
+    assert cache.list(root, recursive=True, max_depth=2, include_dirs=False) == ["a/mid.py", "top.txt"]
+    assert cache.list(root, pattern="a/*") == []
+    assert cache.list(root, recursive=True, pattern="a/*") == ["a/b", "a/mid.py"]
+
+    described = cache.list(root, with_stat=True)
+    assert [(d["path"], d["type"]) for d in described] == [("a", "dir"), ("top.txt", "file")]
+    assert described[1]["size"] == 3
+
+def test_not_a_directory_and_missing(tree):
+    cache = DirectoryCache(watch=False)
+    with pytest.raises(ValueError, match="Path is not a directory"):
+        cache.list(str(tree / "top.txt"))
+    with pytest.raises(FileNotFoundError):
+        cache.list(str(tree / "missing"))
+
+def test_snapshot_revalidates_by_mtime(tree, monkeypatch):
+    """mtimeが変わらなければ再走査せず、変わったら読み直すテスト"""
+    monkeypatch.setattr(dir_cache, "RACY_NS", 0)
+    cache = DirectoryCache(watch=False)
+    root = str(tree)
+    old = os.stat(root).st_mtime_ns - 10_000_000_000
+    os.utime(root, ns=(old, old))
+
+    assert cache.list(root) == ["a", "top.txt"]
+    assert cache.list(root) == ["a", "top.txt"]
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["revalidated"] == 1
+
+    (tree / "new.txt").write_text("")
+    assert cache.list(root) == ["a", "new.txt", "top.txt"]
+    assert cache.stats()["misses"] == 2
+
+def test_recently_modified_directory_is_not_trusted(tree):
+    """走査直前に変更されたディレクトリの一覧は、mtimeが同じでも読み直すテスト"""
+    cache = DirectoryCache(watch=False)
+    cache.list(str(tree))
+    cache.list(str(tree))
+    assert cache.stats()["misses"] == 2
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux only")
+def test_watcher_serves_hits_and_sees_changes(tree):
+    """inotifyで監視中のディレクトリはstatせずに再利用し、変更通知で読み直すテスト"""
+    cache = DirectoryCache(watch=True)
+    if not cache.watching:
+        pytest.skip("inotify is not available")
+    root = str(tree)
+
+    assert cache.list(root, recursive=True, pattern="*.py") == ["a/b/deep.py", "a/mid.py"]
+    cache.list(root, recursive=True)
+    assert cache.stats()["misses"] == 3
+    assert cache.stats()["hits"] == 3
+    assert cache.stats()["watched"] == 3
+
+    (tree / "a" / "b" / "new.py").write_text("")
+    (tree / "a" / "mid.py").rename(tree / "a" / "moved.py")
+    assert cache.list(root, recursive=True, pattern="*.py") == ["a/b/deep.py", "a/b/new.py", "a/moved.py"]
+    assert cache.stats()["misses"] == 5
+    cache.close()
+
+def test_eviction_keeps_cache_bounded(tree):
+    cache = DirectoryCache(max_dirs=2, watch=False)
+    cache.list(str(tree), recursive=True)
+    assert cache.stats()["dirs"] == 2
@@ -0,0 +1,113 @@
+import json
+import os
+import sys
+import tracemalloc
+import pytest
+from unittest.mock import MagicMock
+
+# Add project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from file_tools import line_range, read_file, write_file
+from step_store import OutputRef, StepOutputStore
+
+def test_ranged_reads_by_bytes_and_lines(tmp_path):
+    path = tmp_path / "lines.txt"
+    path.write_bytes(b"one\ntwo\nthree\nfour")
+
+    assert read_file(str(path)) == "one\ntwo\nthree\nfour"
+    assert read_file(str(path), offset=4, length=3) == "two"
+    assert read_file(str(path), offset=14) == "four"
+    assert read_file(str(path), start_line=2, end_line=3) == "two\nthree\n"
+    assert read_file(str(path), start_line=4) == "four"
+    assert read_file(str(path), start_line=9) == ""
+    assert line_range(str(path), 2, 2) == (4, 4)
+    with pytest.raises(ValueError):
+        line_range(str(path), 3, 2)
+
+def test_large_and_binary_reads_return_refs(tmp_path):
+    """inline_bytes以上の範囲とバイナリは内容を読まずに参照を返すテスト"""
+    text = tmp_path / "big.txt"
+    text.write_text("b" * 100, encoding="utf-8")
+    blob = tmp_path / "blob.bin"
+    blob.write_bytes(bytes(range(256)))
+
+    ref = read_file(str(text), inline_bytes=50)
+    assert isinstance(ref, OutputRef) and not ref.owned
+    assert ref.size == 100 and ref.load() == "b" * 100
+
+    raw = read_file(str(blob), offset=10, length=5, binary=True)
+    assert raw.kind == "bytes"
+    assert raw.load() == bytes(range(10, 15))
+
+def test_write_file_streams_refs_binary_safe(tmp_path):
+    blob = tmp_path / "blob.bin"
+    blob.write_bytes(bytes(range(256)) * 10)
+    copy = tmp_path / "out" / "copy.bin"
+
+    assert write_file(str(copy), read_file(str(blob), binary=True)) == 2560
+    assert copy.read_bytes() == blob.read_bytes()
+    write_file(str(copy), b"\xff", append=True)
+    assert copy.read_bytes()[-1:] == b"\xff"
+    with pytest.raises(ValueError, match="onto itself"):
+        write_file(str(blob), read_file(str(blob), binary=True))
+
+def test_write_file_serializes_values_the_same_whether_spilled_or_not(tmp_path):
+    """同じdictを、メモリ上の値として書いても書き出した出力として書いても同じ内容になるテスト"""
+    value = {"name": "テスト", "ok": True, "missing": None, "items": list(range(50))}
+    small = tmp_path / "small.json"
+    spilled = tmp_path / "spilled.json"
+
+    with StepOutputStore(spill_bytes=1) as store:
+        ref = store.put("step-1", value)
+        assert isinstance(ref, OutputRef) and ref.kind == "json"
+        write_file(str(spilled), ref)
+    write_file(str(small), value)
+
+    assert small.read_bytes() == spilled.read_bytes()
+    assert json.loads(small.read_text(encoding="utf-8")) == value
+
+def test_copy_plan_runs_in_constant_memory(tmp_path, monkeypatch):
+    """simple_agent のコピー計画が、ファイルの大きさによらず一定のメモリで実行されるテスト"""
+    import simple_agent
+    src = tmp_path / "in.txt"
+    dst = tmp_path / "out.txt"
+    with open(src, "w", encoding="utf-8") as f:
+        for _ in range(32):
+            f.write("x" * (1024 * 1024))
+    monkeypatch.setattr(simple_agent, "_log_pipeline", MagicMock())
+
+    tracemalloc.start()
+    results = simple_agent.execute(simple_agent.plan(f"{src}の内容を読み取り、{dst}にコピーする"))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert [r["status"] for r in results] == ["success", "success"]
+    assert results[0]["output"]["size"] == 32 * 1024 * 1024
+    assert os.path.getsize(dst) == os.path.getsize(src)
+    assert peak < 8 * 1024 * 1024
+
+def test_ref_to_modified_file_is_rejected(tmp_path):
+    """読み取り後に元のファイルが書き換えられたら、新しい内容を渡さずにエラーにするテスト"""
+    from step_store import StaleOutputError
+    src = tmp_path / "data.bin"
+    src.write_bytes(b"original")
+    backup = tmp_path / "backup.bin"
+    backup.write_bytes(b"previous backup")
+    ref = read_file(str(src), binary=True)
+
+    src.write_bytes(b"rewritten!")
+    with pytest.raises(StaleOutputError, match="was modified after"):
+        ref.load()
+    with pytest.raises(StaleOutputError):
+        write_file(str(backup), ref)
+    assert backup.read_bytes() == b"previous backup"
+
+def test_shared_executor_tags_file_refs_with_step_id(tmp_path):
+    from plan_scheduler import execute_step
+    src = tmp_path / "blob.bin"
+    src.write_bytes(b"\x00\x01")
+    step = {"id": "read_blob", "tool": "read_file", "args": {"path": str(src), "binary": True}}
+    result, output = execute_step(0, step, {}, 1, lambda name, args: read_file(args["path"], binary=True), lambda m: None)
+    assert output.step_id == "read_blob"
+    assert output.load() == b"\x00\x01"
@@ -1,7 +1,9 @@
 import unittest
-from unittest.mock import patch, mock_open
+from unittest.mock import patch, mock_open, MagicMock
 import os
+import shutil
 import sys
+import tempfile
 import pytest
 
 # Add project root to the Python path
@@ -16,36 +18,128 @@ def set_env_vars(monkeypatch):
 
 class TestGeminiAgent(unittest.TestCase):
 
-    @patch('os.path.isdir')
-    @patch('os.listdir')
-    def test_execute_list_files_tool(self, mock_listdir, mock_isdir):
+    def test_execute_list_files_tool(self):
         """list_filesツールが正しく実行されるかテストする"""
-        # Arrange: os.path.isdirがTrueを返し、os.listdirがダミーのファイルリストを返すように設定
-        mock_isdir.return_value = True
-        mock_listdir.return_value = ['file1.txt', 'file2.log']
-        plan = [
-            {
-                "id": "step_1",
-                "tool": "list_files",
-                "args": {"path": "/fake/dir"},
-                "description": "List files in a directory.",
-                "dependencies": []
-            }
-        ]
+        # Arrange: ダミーのファイルを置いたディレクトリを用意
+        with tempfile.TemporaryDirectory() as fake_dir:
+            for name in ['file2.log', 'file1.txt']:
+                open(os.path.join(fake_dir, name), 'w').close()
+            plan = [
+                {
+                    "id": "step_1",
+                    "tool": "list_files",
+                    "args": {"path": fake_dir},
+                    "description": "List files in a directory.",
+                    "dependencies": []
+                }
+            ]
 
-        # Act: execute関数を実行
-        results = execute(plan)
+            # Act: execute関数を実行
+            results = execute(plan)
 
-        # Assert: 結果を検証
+        # Assert: 結果を検証（名前順で返る）
         self.assertEqual(len(results), 1)
         result = results[0]
         self.assertEqual(result['status'], 'success')
         self.assertIsNone(result['error'])
         self.assertFalse(result['skipped'])
         self.assertEqual(result['output'], ['file1.txt', 'file2.log'])
-        mock_isdir.assert_called_once_with("/fake/dir")
-        mock_listdir.assert_called_once_with("/fake/dir")
+
+    def test_execute_resolves_outputs_and_skips_dependents(self):
+        """プレースホルダー解決と失敗時のスキップ伝播が並行実行でも維持されるテスト"""
+        fake_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, fake_dir)
+        open(os.path.join(fake_dir, 'file1.txt'), 'w').close()
+        plan = [
+            {"id": "step_3", "tool": "write_to_file",
+             "args": {"path": "/fake/out.txt", "content": "{step_1_output}"},
+             "dependencies": ["step_1"]},
+            {"id": "step_1", "tool": "list_files", "args": {"path": fake_dir}, "dependencies": []},
+            {"id": "step_2", "tool": "read_file", "args": {"path": "/fake/missing.txt"}, "dependencies": []},
+            {"id": "step_4", "tool": "write_to_file",
+             "args": {"path": "/fake/copy.txt", "content": "{step_2_output}"},
+             "dependencies": ["step_2"]},
+        ]
+
+        results = execute(plan)
+
+        self.assertEqual([r['id'] for r in results], ["step_3", "step_1", "step_2", "step_4"])
+        self.assertEqual([r['step'] for r in results], [1, 2, 3, 4])
+        self.assertEqual(results[0]['status'], 'success')
+        self.assertEqual(results[0]['resolved_args']['content'], ['file1.txt'])
+        self.assertEqual(results[2]['status'], 'failed')
+        self.assertEqual(results[3]['status'], 'skipped')
+        self.assertEqual(results[3]['error'], "Dependency 'step_2' failed/skipped")
+
+def test_plan_reuses_cached_gemini_response(monkeypatch):
+    """同じタスクの計画はGeminiを呼ばずにキャッシュから返すテスト"""
+    import gemini_agent
+    from mcp_shared import LLMResponseCache
+
+    reply = '[{"id": "step_1", "tool": "list_files", "args": {"path": "."}, "dependencies": []}]'
+    api = MagicMock(return_value=reply)
+    monkeypatch.setattr(gemini_agent, "_call_gemini_api", api)
+    monkeypatch.setattr(gemini_agent, "_response_cache", LLMResponseCache())
+
+    assert gemini_agent.plan("nightly task") == gemini_agent.plan("nightly task")
+    assert api.call_count == 1
+    gemini_agent.plan("nightly task", bypass_cache=True)
+    gemini_agent.plan("nightly task", refresh_cache=True)
+    assert api.call_count == 3
+    assert gemini_agent._response_cache.stats()["memory_hits"] == 1
+
+def test_execute_command_uses_tool_executor_with_step_timeout():
+    """execute_command がタイムアウト付きで実行され、失敗時はステップを失敗にするテスト"""
+    import gemini_agent
+    from tool_executor import CommandTimeout
+
+    ok = gemini_agent.run_tool("execute_command", {"command": "echo hello"})
+    assert ok["stdout"] == "hello\n"
+    assert ok["returncode"] == 0
+    assert ok["truncated"] is False
+
+    with pytest.raises(CommandTimeout):
+        gemini_agent.run_tool("execute_command", {"command": "sleep 5", "timeout": 0.1})
+
+def test_large_read_output_is_spilled_and_resolved_lazily(tmp_path, monkeypatch):
+    """大きなファイルの内容は参照で渡され、結果には要約だけが残るテスト"""
+    import gemini_agent
+    import plan_scheduler
+    from step_store import StepOutputStore, resolve_output
+    big = tmp_path / "big.txt"
+    big.write_text("a" * 5000, encoding="utf-8")
+    written = {}
+    monkeypatch.setattr(plan_scheduler, "StepOutputStore", lambda: StepOutputStore(spill_bytes=1000, spill_dir=str(tmp_path)))
+
+    def fake_run_tool(name, args):
+        # 参照はツール側で読み込む（書き出したファイルは計画の終了後に消える）
+        written[name] = {key: resolve_output(value) for key, value in args.items()}
+        return big.read_text(encoding="utf-8") if name == "read_file" else "ok"
+
+    monkeypatch.setattr(gemini_agent, "run_tool", fake_run_tool)
+
+    results = execute([
+        {"id": "read", "tool": "read_file", "args": {"path": str(big)}},
+        {"id": "write", "tool": "write_to_file", "args": {"path": "/fake/out.txt", "content": "{read_output}"}},
+    ])
+
+    assert results[0]["output"]["size"] == 5000
+    assert "path" not in results[0]["output"]  # 書き出したファイルは計画の終了時に消える
+    assert results[1]["resolved_args"]["content"]["ref"] == "read"
+    assert written["write_to_file"]["content"] == "a" * 5000
+    assert os.listdir(tmp_path) == ["big.txt"]
+
+def test_spilled_output_can_be_read_from_caller_store(tmp_path, monkeypatch):
+    """store を渡すと、書き出された大きな出力を実行後も読めるテスト"""
+    import gemini_agent
+    from step_store import StepOutputStore
+    monkeypatch.setattr(gemini_agent, "run_tool", lambda name, args: "x" * 5000)
+
+    with StepOutputStore(spill_bytes=1000, spill_dir=str(tmp_path)) as store:
+        results = execute([{"id": "cmd", "tool": "execute_command", "args": {"command": "big"}}], store=store)
+        assert results[0]["output"]["size"] == 5000
+        assert store.get("cmd") == "x" * 5000
+    assert os.listdir(tmp_path) == []
 
 if __name__ == '__main__':
     unittest.main()
-
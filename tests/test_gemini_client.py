@@ -0,0 +1,139 @@
+import asyncio
+import os
+import sys
+import json
+from types import SimpleNamespace
+from unittest.mock import patch
+import pytest
+
+# Add project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from gemini_client import GeminiClient
+
+class FakeModel:
+    """APIに接続しない GenerativeModel の代わり"""
+
+    def __init__(self, model_name, safety_settings=None, latency=0.01, reply=None):
+        self.model_name = model_name
+        self.safety_settings = safety_settings
+        self.latency = latency
+        self.reply = reply or (lambda prompt: f"echo: {prompt}")
+
+    def generate_content(self, prompt):
+        return SimpleNamespace(text=self.reply(prompt), candidates=[])
+
+    async def generate_content_async(self, prompt):
+        await asyncio.sleep(self.latency)
+        if prompt == "boom":
+            raise RuntimeError("backend error")
+        return SimpleNamespace(text=self.reply(prompt), candidates=[])
+
+def test_models_are_cached_per_name_and_safety_settings():
+    """モデルが (モデル名, 安全性設定) ごとに1回だけ生成されるテスト"""
+    created = []
+
+    def factory(model_name, safety_settings):
+        created.append(model_name)
+        return FakeModel(model_name, safety_settings)
+
+    client = GeminiClient(model_factory=factory)
+    safety = [{"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"}]
+    first = client.get_model("gemini-1.5-pro-latest", safety)
+    assert client.get_model("gemini-1.5-pro-latest", [dict(safety[0])]) is first
+    assert client.get_model("gemini-1.5-pro-latest") is not first
+    assert client.get_model("gemini-1.5-flash") is not first
+    assert created == ["gemini-1.5-pro-latest", "gemini-1.5-pro-latest", "gemini-1.5-flash"]
+
+def test_configure_only_when_api_key_changes():
+    """genai.configure がAPIキー変更時だけ呼ばれるテスト"""
+    client = GeminiClient(model_factory=FakeModel)
+    with patch("google.generativeai.configure") as mock_configure:
+        client.configure("key-1")
+        client.configure("key-1")
+        client.configure(None)
+        client.configure("key-2")
+    assert [c.kwargs["api_key"] for c in mock_configure.call_args_list] == ["key-1", "key-2"]
+
+@pytest.mark.asyncio
+async def test_generate_many_respects_concurrency_limit():
+    """同時実行数がセマフォで制限され、結果が入力順で返るテスト"""
+    client = GeminiClient(max_concurrency=3, model_factory=FakeModel)
+    prompts = [f"task {n}" for n in range(10)] + ["boom"]
+
+    responses = await client.generate_many(prompts)
+
+    assert [r.text for r in responses[:10]] == [f"echo: task {n}" for n in range(10)]
+    assert isinstance(responses[10], RuntimeError)
+    assert client.stats()["max_in_flight"] == 3
+    assert client.stats()["in_flight"] == 0
+
+@pytest.mark.asyncio
+async def test_plan_many_fans_out_through_client(monkeypatch):
+    """plan_many が複数タスクの計画を並行に生成するテスト"""
+    monkeypatch.setenv("TESTING", "true")
+    import gemini_agent
+
+    def reply(prompt):
+        task = prompt.split("**タスク:**")[1].split("**出力形式")[0].strip()
+        return json.dumps([{"id": "step_1", "tool": "list_files", "args": {"path": task}, "dependencies": []}])
+
+    client = GeminiClient(max_concurrency=2, model_factory=lambda name, safety: FakeModel(name, safety, reply=reply))
+    monkeypatch.setattr(gemini_agent, "_gemini_client", client)
+
+    plans = await gemini_agent.plan_many(["/a", "/b", "/c"])
+
+    assert [p[0]["args"]["path"] for p in plans] == ["/a", "/b", "/c"]
+    assert client.stats()["models"] == 1
+    assert client.stats()["max_in_flight"] == 2
+
+@pytest.mark.asyncio
+async def test_generate_retries_resource_exhausted():
+    """429(ResourceExhausted)は待ってから再試行され、プラン全体を失敗させないテスト"""
+    from mcp_shared import ModelBudget, RateLimiter, RetryPolicy
+
+    class ResourceExhausted(Exception):
+        code = 429
+
+    attempts = []
+
+    class FlakyModel(FakeModel):
+        async def generate_content_async(self, prompt):
+            attempts.append(prompt)
+            if len(attempts) == 1:
+                raise ResourceExhausted("quota exceeded")
+            return await super().generate_content_async(prompt)
+
+    limiter = RateLimiter({"gemini-1.5-pro-latest": ModelBudget(requests_per_minute=6000)})
+    client = GeminiClient(
+        model_factory=FlakyModel,
+        rate_limiter=limiter,
+        retry_policy=RetryPolicy(base_delay=0.01, max_delay=0.01)
+    )
+
+    response = await client.generate("plan this")
+
+    assert response.text == "echo: plan this"
+    assert len(attempts) == 2
+    assert limiter.stats()["throttled"] == 1
+
+def test_mcp_modules_are_shared_with_mcp_side():
+    """ルートのスクリプトとMCP側で rate_limiter / llm_cache が同じモジュールになるテスト（共有の予算が分かれない）"""
+    import gemini_client
+    import mcp_shared
+    import llm_cache
+    import rate_limiter
+
+    assert gemini_client.RateLimiter is rate_limiter.RateLimiter
+    assert mcp_shared.shared_limiter is rate_limiter.shared_limiter
+    assert mcp_shared.LLMResponseCache is llm_cache.LLMResponseCache
+    assert rate_limiter.__file__ == os.path.join(mcp_shared.MCP_DIR, "rate_limiter.py")
+    assert llm_cache.__file__ == os.path.join(mcp_shared.MCP_DIR, "llm_cache.py")
+    assert "MCP.rate_limiter" not in sys.modules and "MCP.llm_cache" not in sys.modules
+
+def test_error_responses_are_not_cached():
+    from gemini_client import is_cacheable_response
+    assert is_cacheable_response('{"steps": []}')
+    assert not is_cacheable_response("")
+    assert not is_cacheable_response("Error: quota exceeded")
+    assert not is_cacheable_response("Error calling Gemini API: RuntimeError: boom")
@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+from unittest.mock import MagicMock, patch
+import pytest
+
+# Add project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from log_pipeline import LogPipeline
+
+@pytest.fixture
+def log_path(tmp_path):
+    return str(tmp_path / "agent_log.txt")
+
+def test_messages_are_written_in_order(log_path):
+    """ログがバックグラウンドで順番どおりに1つのファイルへ書き込まれるテスト"""
+    pipeline = LogPipeline(log_path, echo=False, flush_interval=0.05)
+    with patch("builtins.open", wraps=open) as mock_open:
+        for n in range(250):
+            pipeline.log(f"message {n}")
+        pipeline.log({"step": "step_1", "output": "日本語"})
+        assert pipeline.flush()
+        assert mock_open.call_count == 1  # ファイルは開いたまま使い回す
+    pipeline.close()
+
+    with open(log_path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 251
+    assert lines[0].endswith("] message 0")
+    assert lines[-1].endswith('] {"step": "step_1", "output": "日本語"}')
+    assert pipeline.stats()["written"] == 251
+
+def test_full_queue_drops_instead_of_blocking(log_path):
+    """キューが満杯のときは待たずに破棄して件数を数えるテスト"""
+    pipeline = LogPipeline(log_path, echo=False, max_queue_size=1)
+    with patch.object(pipeline, "_ensure_started"):  # 書き込みスレッドを起動しない
+        pipeline.log("first")
+        pipeline.log("second")
+        pipeline.log("third")
+    assert pipeline.stats()["dropped"] == 2
+
+def test_fluentd_records_are_batched(log_path):
+    """Fluentdへのイベントがまとめて1リクエストで送られるテスト"""
+    pipeline = LogPipeline(None, fluentd_url="http://fluentd:8888/gemini.log", echo=False)
+    session = MagicMock()
+    pipeline._session = session
+    with patch.object(pipeline, "_ensure_started"):
+        for n in range(3):
+            pipeline.ship({"event": "gemini_api_call", "n": n})
+    pipeline._threads = []
+    pipeline._ensure_started()
+    assert pipeline.flush()
+    pipeline.close()
+
+    session.post.assert_called_once()
+    assert session.post.call_args.args[0] == "http://fluentd:8888/gemini.log"
+    assert '"n": 2' in session.post.call_args.kwargs["data"]
+    assert pipeline.stats()["shipped"] == 3
+
+def test_unreachable_fluentd_does_not_block_caller():
+    """Fluentdが応答しなくても呼び出し側は待たされず、送信が一時停止されるテスト"""
+    pipeline = LogPipeline(None, fluentd_url="http://fluentd:8888/gemini.log", echo=False, retry_interval=60)
+
+    def slow_failure(*args, **kwargs):
+        time.sleep(0.3)
+        raise ConnectionError("down")
+
+    session = MagicMock()
+    session.post.side_effect = slow_failure
+    pipeline._session = session
+
+    started = time.perf_counter()
+    pipeline.ship({"event": "first"})
+    time.sleep(0.05)  # 1件目の送信が始まるのを待つ
+    pipeline.ship({"event": "second"})
+    assert time.perf_counter() - started < 0.2
+
+    assert pipeline.flush()
+    pipeline.close()
+    assert session.post.call_count == 1
+    assert pipeline.stats()["ship_failures"] == 1
+    assert pipeline.stats()["dropped"] == 2
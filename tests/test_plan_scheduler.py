@@ -0,0 +1,134 @@
+import os
+import sys
+import threading
+import time
+import pytest
+
+# Add project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from plan_scheduler import run_plan, placeholder_dependencies
+
+def make_executor(log=None, delay=0.0):
+    """依存ステップの出力を連結して返すダミーのステップ実行関数"""
+    def execute_step(i, step, memory):
+        if log is not None:
+            log.append(("start", step["id"]))
+        time.sleep(delay)
+        deps = step.get("dependencies", [])
+        if any(memory.get(dep) is None for dep in deps):
+            return {"id": step["id"], "status": "skipped"}, None
+        if step.get("fail"):
+            return {"id": step["id"], "status": "failed"}, None
+        output = step["id"] + "".join(f"<{memory[dep]}" for dep in deps)
+        if log is not None:
+            log.append(("end", step["id"]))
+        return {"id": step["id"], "status": "success", "output": output}, output
+    return execute_step
+
+def test_independent_steps_run_concurrently():
+    """依存のないステップが同時に実行されるテスト"""
+    barrier = threading.Barrier(3, timeout=5)
+
+    def execute_step(i, step, memory):
+        barrier.wait()  # 逐次実行ならタイムアウトする
+        return {"id": step["id"]}, step["id"]
+
+    steps = [{"id": f"step_{n}", "dependencies": []} for n in range(3)]
+    results = run_plan(steps, execute_step, max_workers=3)
+    assert [r["id"] for r in results] == ["step_0", "step_1", "step_2"]
+
+def test_dependencies_run_in_topological_order():
+    """依存先の完了後に実行され、結果は計画順で返るテスト"""
+    log = []
+    steps = [
+        {"id": "c", "dependencies": ["a", "b"]},
+        {"id": "a", "dependencies": []},
+        {"id": "b", "dependencies": ["a"]},
+    ]
+    results = run_plan(steps, make_executor(log), max_workers=4)
+
+    assert [r["id"] for r in results] == ["c", "a", "b"]
+    assert results[0]["output"] == "c<a<b<a"
+    assert log.index(("end", "a")) < log.index(("start", "b"))
+    assert log.index(("end", "b")) < log.index(("start", "c"))
+
+def test_failure_propagates_as_skip():
+    """失敗したステップに依存するステップが推移的にスキップされるテスト"""
+    steps = [
+        {"id": "a", "dependencies": [], "fail": True},
+        {"id": "b", "dependencies": ["a"]},
+        {"id": "c", "dependencies": ["b"]},
+        {"id": "d", "dependencies": []},
+    ]
+    results = run_plan(steps, make_executor(), max_workers=2)
+    assert [r["status"] for r in results] == ["failed", "skipped", "skipped", "success"]
+
+def test_placeholder_reference_is_waited_on():
+    """dependenciesに無いプレースホルダー参照先も待ち合わせるテスト"""
+    log = []
+    steps = [
+        {"id": "b", "dependencies": [], "args": {"content": "{a_output}"}},
+        {"id": "a", "dependencies": []},
+    ]
+    run_plan(steps, make_executor(log, delay=0.01), max_workers=2)
+    assert log.index(("end", "a")) < log.index(("start", "b"))
+
+def test_cycles_and_unknown_dependencies_do_not_hang():
+    """循環依存や存在しない依存があっても停止せずスキップされるテスト"""
+    steps = [
+        {"id": "a", "dependencies": ["b"]},
+        {"id": "b", "dependencies": ["a"]},
+        {"id": "c", "dependencies": ["missing"]},
+        {"id": "d", "dependencies": []},
+    ]
+    results = run_plan(steps, make_executor(), max_workers=2)
+    assert [r["status"] for r in results] == ["skipped", "skipped", "skipped", "success"]
+
+def test_placeholder_dependencies():
+    """プレースホルダーの参照先IDを抽出するテスト"""
+    args = {"content": "{step_1_output}", "path": "out.txt", "other": "{name}", "n": 1}
+    assert placeholder_dependencies(args) == ["step_1"]
+    assert placeholder_dependencies(None) == []
+
+def test_large_outputs_are_passed_by_reference(tmp_path):
+    """大きな出力は参照として後続ステップに渡り、結果には要約が載るテスト"""
+    from step_store import OutputRef, StepOutputStore, resolve_output
+    seen = {}
+
+    def execute_step(i, step, memory):
+        if step["id"] == "big":
+            return {"id": "big", "output": "z" * 100}, "z" * 100
+        seen["ref"] = memory["big"]
+        output = len(resolve_output(memory["big"]))
+        return {"id": step["id"], "output": output}, output
+
+    steps = [{"id": "big", "dependencies": []}, {"id": "use", "dependencies": ["big"]}]
+    store = StepOutputStore(spill_bytes=10, spill_dir=str(tmp_path))
+    results = run_plan(steps, execute_step, max_workers=2, store=store)
+
+    assert isinstance(seen["ref"], OutputRef)
+    assert results[0]["output"]["ref"] == "big"
+    assert results[0]["output"]["size"] == 100
+    assert results[1]["output"] == 100
+    assert store.get("big") == "z" * 100
+    store.close()
+
+def test_execute_step_resolves_placeholders_and_skips():
+    """共有の execute_step がプレースホルダーを解決し、失敗した依存先ではスキップするテスト"""
+    from plan_scheduler import execute_step
+    calls = []
+
+    def run_tool(name, args):
+        calls.append((name, args))
+        return "ok"
+
+    step = {"id": "b", "tool": "write_to_file", "args": {"content": "{a_output}"}, "dependencies": ["a"]}
+    result, output = execute_step(1, step, {"a": "data"}, 2, run_tool, lambda message: None)
+    assert output == "ok"
+    assert result["resolved_args"] == {"content": "data"}
+    assert calls == [("write_to_file", {"content": "data"})]
+
+    result, output = execute_step(1, step, {"a": None}, 2, run_tool, lambda message: None)
+    assert output is None
+    assert result["status"] == "skipped"
@@ -0,0 +1,42 @@
+import os
+import sys
+import pytest
+from unittest.mock import MagicMock
+
+# Add project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import simple_agent
+
+@pytest.fixture(autouse=True)
+def quiet_log(monkeypatch):
+    # agent_log.txt に書き込まない
+    monkeypatch.setattr(simple_agent, "_log_pipeline", MagicMock())
+
+def test_only_planned_tools_are_registered():
+    """plan() が使う read_file / write_to_file だけが登録されているテスト"""
+    assert simple_agent.TOOL_REGISTRY.names() == ["read_file", "write_to_file"]
+
+def test_copy_plan_result_shape(tmp_path):
+    src = tmp_path / "input.txt"
+    dst = tmp_path / "output.txt"
+    src.write_text("hello", encoding="utf-8")
+
+    results = simple_agent.execute(simple_agent.plan(f"{src}の内容を読み取り、{dst}にコピーする"))
+
+    assert [set(r) for r in results] == [{"step", "id", "tool", "args", "status", "output", "error"}] * 2
+    assert [r["status"] for r in results] == ["success", "success"]
+    assert results[1]["args"] == {"path": str(dst), "content": "hello"}
+    assert dst.read_text(encoding="utf-8") == "hello"
+
+def test_failed_read_reports_error_for_both_steps(tmp_path):
+    """読み取りに失敗したら、後続のコピーも含めて status "error" と "型: メッセージ" を返すテスト"""
+    src = tmp_path / "missing.txt"
+    dst = tmp_path / "output.txt"
+
+    results = simple_agent.execute(simple_agent.plan(f"{src}の内容を読み取り、{dst}にコピーする"))
+
+    assert [r["status"] for r in results] == ["error", "error"]
+    assert results[0]["error"] == f"FileNotFoundError: File not found: {src}"
+    assert results[1]["error"]
+    assert not dst.exists()
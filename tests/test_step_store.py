@@ -0,0 +1,50 @@
+import os
+import sys
+import pytest
+
+# Add project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from step_store import OutputRef, StepOutputStore, resolve_output
+
+def test_small_outputs_stay_in_memory():
+    store = StepOutputStore(spill_bytes=100, max_memory_bytes=1000)
+    assert store.put("a", "hello") == "hello"
+    assert store.put("b", None) is None
+    assert store.get("a") == "hello"
+    assert "b" in store
+    assert store.stats()["spilled"] == 0
+    assert store.memory_bytes == 5
+
+def test_large_outputs_spill_and_load_lazily(tmp_path):
+    """閾値を超える出力はファイルに書き出され、読み込むと元の値に戻るテスト"""
+    store = StepOutputStore(spill_bytes=10, spill_dir=str(tmp_path))
+    text = "x" * 50
+    ref = store.put("text", text)
+    data = store.put("data", {"stdout": "y" * 20, "returncode": 0})
+    raw = store.put("raw", b"\x00" * 20)
+
+    assert isinstance(ref, OutputRef) and isinstance(data, OutputRef) and isinstance(raw, OutputRef)
+    assert store.memory_bytes == 0
+    assert resolve_output(ref) == text
+    assert store.get("data") == {"stdout": "y" * 20, "returncode": 0}
+    assert store.get("raw") == b"\x00" * 20
+    assert ref.describe()["size"] == 50
+    assert ref.describe()["preview"] == text[:200]
+    assert "path" not in ref.describe()
+    assert os.path.exists(ref.path)
+
+    store.close()
+    assert not os.path.exists(ref.path)
+    assert os.listdir(tmp_path) == []
+
+def test_memory_budget_spills_once_exceeded(tmp_path):
+    """メモリ上の合計が上限を超える出力から書き出されるテスト"""
+    store = StepOutputStore(spill_bytes=100, max_memory_bytes=15, spill_dir=str(tmp_path))
+    assert store.put("a", "a" * 10) == "a" * 10
+    assert isinstance(store.put("b", "b" * 10), OutputRef)
+
+    store.discard("a")
+    assert store.memory_bytes == 0
+    assert store.put("c", "c" * 10) == "c" * 10
+    store.close()
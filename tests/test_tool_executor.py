@@ -0,0 +1,102 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import pytest
+
+# Add project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from tool_executor import CommandError, CommandTimeout, OutputCapture, ToolExecutor
+
+def test_output_capture_keeps_head_and_tail():
+    """先頭と末尾だけを保持し、省略したバイト数を示すテスト"""
+    capture = OutputCapture(head_bytes=4, tail_bytes=3)
+    for chunk in (b"abc", b"defgh", b"ijkl"):
+        capture.feed(chunk)
+
+    assert capture.total == 12
+    assert capture.omitted == 5
+    assert capture.text() == "abcd\n... [5 bytes omitted] ...\njkl"
+
+    small = OutputCapture(head_bytes=10, tail_bytes=10)
+    small.feed(b"hello")
+    assert small.text() == "hello"
+
+def test_run_command_captures_output_and_exit_code():
+    """標準出力・標準エラー・終了コードを返すテスト"""
+    executor = ToolExecutor()
+    result = executor.run_command_sync("echo out; echo err >&2; exit 3")
+
+    assert result.stdout == "out\n"
+    assert result.stderr == "err\n"
+    assert result.returncode == 3
+    assert not result.timed_out
+    executor.close()
+
+def test_check_command_raises_on_failure():
+    """終了コードが0以外なら出力付きのCommandErrorを送出するテスト"""
+    executor = ToolExecutor()
+    with pytest.raises(CommandError) as excinfo:
+        executor.check_command_sync("echo partial; exit 1")
+
+    assert "non-zero exit status 1" in str(excinfo.value)
+    assert excinfo.value.result.stdout == "partial\n"
+    executor.close()
+
+def test_timeout_kills_process_group():
+    """タイムアウトしたらシェルの子プロセスごと終了させるテスト"""
+    executor = ToolExecutor(timeout=0.2)
+    started = time.perf_counter()
+
+    with pytest.raises(CommandTimeout):
+        executor.check_command_sync("sleep 30 & sleep 30; echo never")
+
+    assert time.perf_counter() - started < 5
+    assert executor.stats()["timeouts"] == 1
+    assert executor.stats()["running"] == 0
+    executor.close()
+
+def test_large_output_is_truncated_without_buffering_everything():
+    """大量の出力でも先頭と末尾だけを返すテスト"""
+    executor = ToolExecutor(head_bytes=100, tail_bytes=100)
+    result = executor.run_command_sync("yes line | head -c 5000000; echo; echo last")
+
+    assert result.returncode == 0
+    assert result.truncated
+    assert result.stdout.startswith("line\nline\n")
+    assert result.stdout.endswith("last\n")
+    assert len(result.stdout) < 300
+    executor.close()
+
+def test_concurrency_is_bounded_across_threads():
+    """複数スレッドから呼び出しても同時実行数が上限を超えないテスト"""
+    executor = ToolExecutor(max_concurrency=2)
+    threads = [threading.Thread(target=executor.run_command_sync, args=("sleep 0.2",)) for _ in range(6)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert executor.stats()["max_in_flight"] == 2
+    assert time.perf_counter() - started >= 0.55
+    executor.close()
+
+def test_cancel_kills_running_command():
+    """呼び出し側がキャンセルしたらプロセスを終了させるテスト"""
+    executor = ToolExecutor()
+
+    async def scenario():
+        task = asyncio.create_task(executor.run_command("sleep 30"))
+        await asyncio.sleep(0.2)
+        assert executor.stats()["running"] == 1
+        process = next(iter(executor._processes))
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert executor.stats()["running"] == 0
+        assert process.returncode is not None  # 終了まで待って回収されている
+
+    asyncio.run(scenario())
@@ -0,0 +1,117 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import pytest
+
+# Add project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from tool_executor import CommandError, ToolExecutor
+from tool_registry import ConcurrencyClass, ToolRegistry, ToolSpec, build_default_registry
+
+def test_default_registry_schemas_match_tool_definitions():
+    """プランナー向けのツール一覧がレジストリの定義から作られるテスト"""
+    registry = build_default_registry(lambda message: None)
+    schemas = registry.schemas()
+
+    assert [s["name"] for s in schemas] == ["read_file", "write_to_file", "execute_command", "list_files"]
+    assert set(schemas[0]) == {"name", "description", "parameters"}
+    assert registry.get("execute_command").concurrency == ConcurrencyClass.PROCESS
+    assert [s["name"] for s in registry.schemas(["list_files"])] == ["list_files"]
+
+def test_unknown_tool_raises_not_implemented():
+    registry = ToolRegistry()
+    with pytest.raises(NotImplementedError, match="Tool 'missing' is not implemented yet."):
+        registry.call("missing", {})
+
+def test_file_tools_read_write_and_list(tmp_path):
+    """write_to_file（実書き込み）・read_file・list_files のテスト"""
+    registry = build_default_registry(lambda message: None, simulate_writes=False)
+    path = tmp_path / "sub" / "out.txt"
+
+    assert registry.call("write_to_file", {"path": str(path), "content": "hello"}) == f"Successfully wrote to {path}"
+    assert registry.call("read_file", {"path": str(path)}) == "hello"
+    assert registry.call("list_files", {"path": str(tmp_path / "sub")}) == ["out.txt"]
+
+    with pytest.raises(FileNotFoundError, match="File not found"):
+        registry.call("read_file", {"path": str(tmp_path / "missing.txt")})
+    with pytest.raises(ValueError, match="Missing 'path' or 'content'"):
+        registry.call("write_to_file", {"path": str(path)})
+
+def test_simulated_write_does_not_touch_disk(tmp_path):
+    logs = []
+    registry = build_default_registry(logs.append)
+    path = tmp_path / "out.txt"
+
+    assert registry.call("write_to_file", {"path": str(path), "content": "x"}) == f"Successfully wrote to {path}"
+    assert not path.exists()
+    assert any("[SIMULATE]" in line for line in logs)
+
+def test_execute_command_uses_executor():
+    registry = build_default_registry(lambda message: None, ToolExecutor())
+    assert registry.call("execute_command", {"command": "echo hi"})["stdout"].strip() == "hi"
+    with pytest.raises(CommandError):
+        registry.call("execute_command", {"command": "exit 2"})
+
+def test_async_tool_runs_on_executor_loop_with_timeout():
+    """非同期ハンドラは ToolExecutor のループで実行され、timeout を超えると TimeoutError になるテスト"""
+    registry = ToolRegistry(ToolExecutor())
+
+    @registry.tool("wait", "待機する", {"type": "object", "properties": {}}, timeout=0.1)
+    async def wait(args: dict):
+        await asyncio.sleep(args["seconds"])
+        return "done"
+
+    assert registry.get("wait").is_async
+    assert registry.call("wait", {"seconds": 0}) == "done"
+    with pytest.raises(asyncio.TimeoutError):
+        registry.call("wait", {"seconds": 1})
+
+def test_concurrency_class_limits_parallel_calls():
+    """区分ごとの枠を超えて同時に実行されないテスト"""
+    registry = ToolRegistry(slots={ConcurrencyClass.CPU: 2})
+    active = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def work(args: dict):
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+        time.sleep(0.05)
+        with lock:
+            active -= 1
+
+    registry.register(ToolSpec("work", "計算する", {}, work, ConcurrencyClass.CPU))
+    threads = [threading.Thread(target=registry.call, args=("work", {})) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert peak == 2
+
+def test_refs_are_loaded_unless_tool_accepts_them(tmp_path):
+    """accepts_refs でないツールには OutputRef を読み込んだ値を渡すテスト"""
+    from step_store import OutputRef
+    path = tmp_path / "data.txt"
+    path.write_text("payload", encoding="utf-8")
+    ref = OutputRef("data", str(path), "text", 7, "payload", owned=False)
+    registry = ToolRegistry()
+    registry.register(ToolSpec("echo", "", {}, lambda args: args["value"]))
+    registry.register(ToolSpec("raw", "", {}, lambda args: args["value"], accepts_refs=True))
+
+    assert registry.call("echo", {"value": ref}) == "payload"
+    assert registry.call("raw", {"value": ref}) is ref
+
+def test_registered_tools_match_planner_tools(monkeypatch):
+    """v2 で実行できるツールがプランナーに見せるツールと一致するテスト"""
+    monkeypatch.setenv("GOOGLE_API_KEY", "dummy_api_key")  # v2 は import 時にAPIキーを確認する
+    import gemini_agent_v2
+    assert gemini_agent_v2.TOOL_REGISTRY.names() == [tool["name"] for tool in gemini_agent_v2.AVAILABLE_TOOLS]
+    assert "list_files" not in gemini_agent_v2.TOOL_REGISTRY.names()
+    with pytest.raises(NotImplementedError):
+        gemini_agent_v2.run_tool("list_files", {"path": "."})
@@ -0,0 +1,262 @@
+"""ツール（シェルコマンド）を非同期サブプロセスで実行するエンジン
+
+- コマンドごとにタイムアウトを設け、超えたらプロセスグループごと強制終了する
+- 同時に実行するコマンド数をセマフォで制限する
+- 出力は逐次読み取り、先頭 head_bytes と末尾 tail_bytes だけを保持する（途中は省略）
+- 計画の実行スレッドからは run_command_sync で呼び出す（専用のイベントループで実行される）
+
+サンドボックスではない: コマンドはシェル経由でエージェントと同じユーザー・環境変数・
+作業ディレクトリの権限で実行される。分離は新しいセッション（プロセスグループ単位で
+終了させるため）だけで、ファイルシステムやネットワークの制限、rlimit は設けていない。
+"""
+import asyncio
+import atexit
+import os
+import signal
+import threading
+import time
+import weakref
+from dataclasses import dataclass
+from typing import Optional, Set
+
+DEFAULT_TIMEOUT = float(os.getenv("TOOL_COMMAND_TIMEOUT", "60"))
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("TOOL_MAX_CONCURRENCY", "4"))
+DEFAULT_HEAD_BYTES = int(os.getenv("TOOL_OUTPUT_HEAD_BYTES", str(64 * 1024)))
+DEFAULT_TAIL_BYTES = int(os.getenv("TOOL_OUTPUT_TAIL_BYTES", str(64 * 1024)))
+READ_CHUNK_SIZE = 64 * 1024
+
+class OutputCapture:
+    """ストリームの先頭と末尾だけを保持するバッファ"""
+
+    def __init__(self, head_bytes: int = DEFAULT_HEAD_BYTES, tail_bytes: int = DEFAULT_TAIL_BYTES):
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.total = 0
+        self._head = bytearray()
+        self._tail = bytearray()
+
+    def feed(self, chunk: bytes):
+        self.total += len(chunk)
+        room = self.head_bytes - len(self._head)
+        if room > 0:
+            self._head += chunk[:room]
+            chunk = chunk[room:]
+        if chunk and self.tail_bytes > 0:
+            self._tail += chunk
+            if len(self._tail) > self.tail_bytes:
+                del self._tail[:-self.tail_bytes]
+
+    @property
+    def omitted(self) -> int:
+        return self.total - len(self._head) - len(self._tail)
+
+    def text(self) -> str:
+        head = self._head.decode("utf-8", errors="replace")
+        tail = self._tail.decode("utf-8", errors="replace")
+        if self.omitted:
+            return f"{head}\n... [{self.omitted} bytes omitted] ...\n{tail}"
+        return head + tail
+
+@dataclass
+class CommandResult:
+    command: str
+    returncode: Optional[int]
+    stdout: str
+    stderr: str
+    truncated: bool = False
+    timed_out: bool = False
+    elapsed_ms: float = 0.0
+
+    def as_output(self) -> dict:
+        """計画のステップ出力として保存する形"""
+        return {
+            "stdout": self.stdout,
+            "stderr": self.stderr,
+            "returncode": self.returncode,
+            "truncated": self.truncated
+        }
+
+class CommandError(Exception):
+    """コマンドが失敗した（result に保持した出力を含む）"""
+
+    def __init__(self, message: str, result: CommandResult):
+        super().__init__(message)
+        self.result = result
+
+class CommandTimeout(CommandError):
+    pass
+
+def _kill(process: asyncio.subprocess.Process):
+    """プロセスグループごと終了させる（シェルが起動した子プロセスも残さない）"""
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+class ToolExecutor:
+    """コマンドを同時実行数・時間・出力サイズの上限付きで実行する"""
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+        head_bytes: Optional[int] = None,
+        tail_bytes: Optional[int] = None
+    ):
+        self.max_concurrency = max_concurrency or DEFAULT_MAX_CONCURRENCY
+        self.timeout = DEFAULT_TIMEOUT if timeout is None else timeout
+        self.head_bytes = DEFAULT_HEAD_BYTES if head_bytes is None else head_bytes
+        self.tail_bytes = DEFAULT_TAIL_BYTES if tail_bytes is None else tail_bytes
+        self.calls = 0
+        self.timeouts = 0
+        self.truncated = 0
+        self.max_in_flight = 0
+        self._processes: Set[asyncio.subprocess.Process] = set()
+        self._semaphores: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    async def run_command(
+        self,
+        command: str,
+        timeout: Optional[float] = None,
+        cwd: Optional[str] = None
+    ) -> CommandResult:
+        """コマンドを実行して結果を返す（終了コードが0以外でも例外にはしない）
+
+        timeout 秒を超えたら強制終了し、timed_out=True の結果を返す。0以下なら無制限。
+        呼び出し側がキャンセルした場合もプロセスを終了させてから CancelledError を伝える。
+        """
+        timeout = self.timeout if timeout is None else float(timeout)
+        async with self._get_semaphore():
+            self.calls += 1
+            started = time.perf_counter()
+            process = await asyncio.create_subprocess_shell(
+                command,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=cwd,
+                start_new_session=True
+            )
+            self._processes.add(process)
+            self.max_in_flight = max(self.max_in_flight, len(self._processes))
+            stdout = OutputCapture(self.head_bytes, self.tail_bytes)
+            stderr = OutputCapture(self.head_bytes, self.tail_bytes)
+            timed_out = False
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(self._pump(process.stdout, stdout), self._pump(process.stderr, stderr), process.wait()),
+                    timeout if timeout > 0 else None
+                )
+            except asyncio.TimeoutError:
+                timed_out = True
+                self.timeouts += 1
+                _kill(process)
+                await process.wait()
+            except asyncio.CancelledError:
+                _kill(process)
+                # 終了を待ってから伝える（ゾンビプロセスとトランスポートを残さない）
+                await asyncio.shield(process.wait())
+                raise
+            finally:
+                self._processes.discard(process)
+
+        truncated = bool(stdout.omitted or stderr.omitted)
+        if truncated:
+            self.truncated += 1
+        return CommandResult(
+            command=command,
+            returncode=process.returncode,
+            stdout=stdout.text(),
+            stderr=stderr.text(),
+            truncated=truncated,
+            timed_out=timed_out,
+            elapsed_ms=round((time.perf_counter() - started) * 1000, 1)
+        )
+
+    async def check_command(self, command: str, timeout: Optional[float] = None, cwd: Optional[str] = None) -> CommandResult:
+        """run_command と同じだが、タイムアウト・終了コード0以外を CommandError として送出する"""
+        result = await self.run_command(command, timeout=timeout, cwd=cwd)
+        if result.timed_out:
+            raise CommandTimeout(f"Command '{command}' timed out after {timeout or self.timeout}s", result)
+        if result.returncode != 0:
+            raise CommandError(f"Command '{command}' returned non-zero exit status {result.returncode}.", result)
+        return result
+
+    def run_command_sync(self, command: str, timeout: Optional[float] = None, cwd: Optional[str] = None) -> CommandResult:
+        """スレッドから呼び出す同期版（全スレッドで同時実行数の上限を共有する）"""
+        return self._submit(self.run_command(command, timeout=timeout, cwd=cwd))
+
+    def check_command_sync(self, command: str, timeout: Optional[float] = None, cwd: Optional[str] = None) -> CommandResult:
+        return self._submit(self.check_command(command, timeout=timeout, cwd=cwd))
+
+    def run_sync(self, coro):
+        """コルーチンを専用のイベントループで実行し、結果を待つ（スレッドから非同期ツールを呼ぶため）"""
+        return self._submit(coro)
+
+    def cancel_all(self):
+        """実行中のコマンドをすべて強制終了する"""
+        for process in list(self._processes):
+            _kill(process)
+
+    def close(self):
+        self.cancel_all()
+        with self._lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._thread.join(5)
+                self._loop.close()
+                self._loop = None
+                self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "running": len(self._processes),
+            "max_in_flight": self.max_in_flight,
+            "max_concurrency": self.max_concurrency,
+            "timeouts": self.timeouts,
+            "truncated": self.truncated
+        }
+
+    @staticmethod
+    async def _pump(stream: asyncio.StreamReader, capture: OutputCapture):
+        while True:
+            chunk = await stream.read(READ_CHUNK_SIZE)
+            if not chunk:
+                return
+            capture.feed(chunk)
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # asyncio.Semaphore はイベントループに紐づくため、ループごとに作る（同期版はすべて専用ループを使う）
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphores[loop] = semaphore
+        return semaphore
+
+    def _submit(self, coro):
+        future = asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is not None:
+            return self._loop
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="tool-executor", daemon=True)
+                thread.start()
+                self._loop, self._thread = loop, thread
+                atexit.register(self.close)
+        return self._loop
@@ -0,0 +1,260 @@
+"""エージェントが計画で使うツールのレジストリ
+
+ツール名 -> ToolSpec（引数スキーマ・同期/非同期・並行実行の区分・タイムアウト・ハンドラ）を保持し、
+プランナーに渡すツール一覧(AVAILABLE_TOOLS)と実行時の呼び出しを同じ定義から作る。
+実行時は区分ごとの枠(IO / CPU / PROCESS)で同時実行数を制限し、非同期ハンドラは
+ToolExecutor のイベントループで timeout 付きで実行する。
+
+標準ツール（read_file / write_to_file / execute_command / list_files）は build_default_registry で登録する。
+"""
+import asyncio
+import inspect
+import os
+import threading
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Callable, Dict, Iterable, List, Optional
+import file_tools
+from dir_cache import DirectoryCache
+from step_store import OutputRef, resolve_output
+from tool_executor import CommandError, ToolExecutor
+
+Logger = Callable[[Any], None]
+
+class ConcurrencyClass(str, Enum):
+    """ツールの負荷の種類（同時実行数の枠を分ける）"""
+    IO = "io"            # ファイル・ネットワークの待ちが中心
+    CPU = "cpu"          # Pythonの計算が中心（CPU数を超えて並べても速くならない）
+    PROCESS = "process"  # サブプロセスを起動する（ToolExecutor側でも制限される）
+
+DEFAULT_SLOTS = {
+    ConcurrencyClass.IO: int(os.getenv("TOOL_IO_SLOTS", "32")),
+    ConcurrencyClass.CPU: int(os.getenv("TOOL_CPU_SLOTS", str(os.cpu_count() or 1))),
+    ConcurrencyClass.PROCESS: int(os.getenv("TOOL_PROCESS_SLOTS", "8")),
+}
+
+@dataclass
+class ToolSpec:
+    name: str
+    description: str
+    parameters: Dict[str, Any]
+    handler: Callable[[dict], Any]
+    concurrency: ConcurrencyClass = ConcurrencyClass.IO
+    # 非同期ハンドラとサブプロセスに適用する上限秒数（同期ハンドラは途中で止められないため適用しない）
+    timeout: Optional[float] = None
+    # Trueなら引数の OutputRef を読み込まずにそのまま渡す（ハンドラが chunk ごとに読む）
+    accepts_refs: bool = False
+
+    @property
+    def is_async(self) -> bool:
+        return inspect.iscoroutinefunction(self.handler)
+
+    def schema(self) -> dict:
+        """プランナーのプロンプトに載せる形"""
+        return {"name": self.name, "description": self.description, "parameters": self.parameters}
+
+class ToolRegistry:
+    """ツール名からハンドラを引き、区分ごとの枠の中で実行する"""
+
+    def __init__(self, executor: Optional[ToolExecutor] = None, slots: Optional[Dict[ConcurrencyClass, int]] = None):
+        self.executor = executor or ToolExecutor()
+        self._tools: Dict[str, ToolSpec] = {}
+        self._slots = {
+            kind: threading.BoundedSemaphore(limit)
+            for kind, limit in {**DEFAULT_SLOTS, **(slots or {})}.items()
+        }
+
+    def register(self, spec: ToolSpec) -> ToolSpec:
+        self._tools[spec.name] = spec
+        return spec
+
+    def tool(
+        self,
+        name: str,
+        description: str,
+        parameters: Dict[str, Any],
+        concurrency: ConcurrencyClass = ConcurrencyClass.IO,
+        timeout: Optional[float] = None,
+        accepts_refs: bool = False
+    ):
+        """関数をツールとして登録するデコレーター"""
+        def decorator(handler: Callable[[dict], Any]):
+            self.register(ToolSpec(name, description, parameters, handler, concurrency, timeout, accepts_refs))
+            return handler
+        return decorator
+
+    def get(self, name: str) -> ToolSpec:
+        spec = self._tools.get(name)
+        if spec is None:
+            raise NotImplementedError(f"Tool '{name}' is not implemented yet.")
+        return spec
+
+    def names(self) -> List[str]:
+        return list(self._tools)
+
+    def schemas(self, names: Optional[Iterable[str]] = None) -> List[dict]:
+        """AVAILABLE_TOOLS として使うツール定義のリスト"""
+        return [self._tools[name].schema() for name in (names or self._tools)]
+
+    def call(self, name: str, args: dict) -> Any:
+        """ツールを実行して出力を返す（計画の実行スレッドから呼ぶ）"""
+        spec = self.get(name)
+        if not spec.accepts_refs:
+            args = {key: resolve_output(value) for key, value in args.items()}
+        with self._slots[spec.concurrency]:
+            if spec.is_async:
+                return self.executor.run_sync(asyncio.wait_for(spec.handler(args), spec.timeout))
+            return spec.handler(args)
+
+def build_default_registry(
+    log: Logger,
+    executor: Optional[ToolExecutor] = None,
+    simulate_writes: bool = True,
+    dir_cache: Optional[DirectoryCache] = None,
+    tools: Optional[Iterable[str]] = None
+) -> ToolRegistry:
+    """標準ツールを登録したレジストリを作る
+
+    simulate_writes=True なら write_to_file は書き込まずにログだけ残す（Geminiエージェントの従来の動作）。
+    list_files の一覧は dir_cache（省略時は新しく作る）に保持し、計画や改善の反復をまたいで使い回す。
+    tools を指定した場合はその名前のツールだけを登録する（プランナーに見せるツールと揃えるため）。
+    """
+    registry = ToolRegistry(executor)
+    dir_cache = dir_cache or DirectoryCache()
+
+    @registry.tool(
+        "read_file",
+        "指定されたパスのファイルの内容を読み取る。offset/length（バイト）または start_line/end_line（行、1始まり）で一部だけを読める。"
+        "大きな範囲やバイナリ（binary=true）は内容の代わりにファイルへの参照を返し、write_to_file の content に渡すとそのままコピーされる。",
+        {
+            "type": "object",
+            "properties": {
+                "path": {"type": "string", "description": "読み取るファイルのパス"},
+                "offset": {"type": "integer", "description": "読み始めるバイト位置（省略時は先頭）"},
+                "length": {"type": "integer", "description": "読み取るバイト数（省略時は末尾まで）"},
+                "start_line": {"type": "integer", "description": "読み始める行"},
+                "end_line": {"type": "integer", "description": "読み終わる行（この行を含む）"},
+                "binary": {"type": "boolean", "description": "バイナリとして扱う（内容は参照で返す）"}
+            },
+            "required": ["path"]
+        }
+    )
+    def read_file(args: dict):
+        path = args.get("path")
+        if path is None:
+            raise ValueError("Missing 'path' for read_file.")
+        log(f"[SIMULATE] Would read file: {path}")
+        try:
+            return file_tools.read_file(
+                path,
+                offset=args.get("offset"),
+                length=args.get("length"),
+                start_line=args.get("start_line"),
+                end_line=args.get("end_line"),
+                binary=bool(args.get("binary"))
+            )
+        except FileNotFoundError:
+            raise FileNotFoundError(f"File not found: {path}")
+        except Exception as e:
+            raise Exception(f"Error reading file {path}: {e}")
+
+    @registry.tool(
+        "write_to_file",
+        "指定されたパスに指定された内容を書き込む。ファイルが存在しない場合は作成される。",
+        {
+            "type": "object",
+            "properties": {
+                "path": {"type": "string", "description": "書き込むファイルのパス"},
+                "content": {"type": "string", "description": "書き込む内容"},
+                "append": {"type": "boolean", "description": "既存の内容の末尾に追記する"}
+            },
+            "required": ["path", "content"]
+        },
+        accepts_refs=True
+    )
+    def write_to_file(args: dict):
+        path = args.get("path")
+        content = args.get("content")
+        if path is None or content is None:
+            raise ValueError("Missing 'path' or 'content' for write_to_file.")
+        if simulate_writes:
+            log(f"[SIMULATE] Would call Cline: <write_to_file><path>{path}</path><content>... (content omitted)")
+            return f"Successfully wrote to {path}"
+        written = file_tools.write_file(path, content, append=bool(args.get("append")))
+        if isinstance(content, OutputRef):
+            log(f"Copied {written} bytes from {content.path} to {path}")
+        return f"Successfully wrote to {path}"
+
+    @registry.tool(
+        "execute_command",
+        "指定されたシェルコマンドを実行する。",
+        {
+            "type": "object",
+            "properties": {
+                "command": {"type": "string", "description": "実行するシェルコマンド"},
+                "timeout": {"type": "number", "description": "タイムアウト秒数（省略時は既定値）"}
+            },
+            "required": ["command"]
+        },
+        concurrency=ConcurrencyClass.PROCESS
+    )
+    def execute_command(args: dict):
+        command = args.get("command")
+        if command is None:
+            raise ValueError("Missing 'command' for execute_command.")
+        log(f"Executing command: {command}")
+        # タイムアウトと出力サイズの上限付きで実行（暴走したコマンドで計画全体が止まらないように）
+        try:
+            result = registry.executor.check_command_sync(command, timeout=args.get("timeout"))
+        except CommandError as e:
+            log(f"Command failed with error: {e}")
+            log(f"Command stdout: {e.result.stdout}")
+            log(f"Command stderr: {e.result.stderr}")
+            raise # エラーを再スローして呼び出し元で捕捉
+        log(f"Command stdout: {result.stdout}")
+        if result.stderr:
+            log(f"Command stderr: {result.stderr}")
+        if result.truncated:
+            log(f"Command output was truncated (elapsed {result.elapsed_ms}ms)")
+        return result.as_output()
+
+    @registry.tool(
+        "list_files",
+        "指定されたディレクトリ内のファイルとサブディレクトリのリストを返す。"
+        "recursive=true でサブディレクトリもたどり（max_depth で深さを制限）、pattern（例: *.py）で絞り込める。"
+        "stat=true なら各項目の種類・サイズ・更新時刻も返す。",
+        {
+            "type": "object",
+            "properties": {
+                "path": {"type": "string", "description": "リストするディレクトリのパス"},
+                "recursive": {"type": "boolean", "description": "サブディレクトリもたどる"},
+                "max_depth": {"type": "integer", "description": "たどる深さの上限（直下が1）"},
+                "pattern": {"type": "string", "description": "ファイル名のglobパターン（/を含めると相対パスに一致させる。例: src/*.py）"},
+                "include_dirs": {"type": "boolean", "description": "ディレクトリも含める（既定はtrue）"},
+                "stat": {"type": "boolean", "description": "種類・サイズ・更新時刻を含める"}
+            },
+            "required": ["path"]
+        }
+    )
+    def list_files(args: dict):
+        path = args.get("path")
+        if path is None:
+            raise ValueError("Missing 'path' for list_files.")
+        log(f"[SIMULATE] Would list files in: {path}")
+        try:
+            return dir_cache.list(
+                path,
+                recursive=bool(args.get("recursive")),
+                max_depth=args.get("max_depth"),
+                pattern=args.get("pattern"),
+                include_dirs=args.get("include_dirs", True) is not False,
+                with_stat=bool(args.get("stat"))
+            )
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Directory not found: {path}")
+        except Exception as e:
+            raise Exception(f"Error listing files in {path}: {e}")
+
+    if tools is not None:
+        registry._tools = {name: registry.get(name) for name in tools}
+    return registry